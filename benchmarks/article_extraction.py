@@ -0,0 +1,117 @@
+"""
+Measure the in-process article extraction of scraping.extract_fast on the given html files or urls.
+For each page it prints the confidence of the fast path, the time it took and the F1 score of the words
+of its text against a reference: the .txt file next to an html file (see benchmarks/corpus, where
+each one holds the text of the article as a reader would select it), or otherwise the readability
+node worker result. At the end it shows, for a range of confidence thresholds, how many pages would
+skip the node worker and the worst score among them, which is how FAST_EXTRACT_MIN_CONFIDENCE is chosen.
+
+With --node, the readability worker is also timed and scored against the reference.
+It needs node and the npm dependencies installed (see README).
+
+usage: python benchmarks/article_extraction.py [--runs 3] [--node] benchmarks/corpus/*.html https://example.com/post ...
+"""
+
+import os
+
+os.environ.setdefault("DISABLE_CRON_TASKS", "1")
+
+import argparse
+import collections
+import re
+import statistics
+import time
+
+import requests
+
+from feedi import scraping
+from feedi.config import default as config
+
+THRESHOLDS = (0.5, 0.6, 0.7, 0.8, 0.9)
+
+
+def words(text):
+    return collections.Counter(re.findall(r"\w+", (text or "").lower()))
+
+
+def f1_score(text, reference):
+    "Return the F1 score of the words of the text against the ones of the reference."
+    text, reference = words(text), words(reference)
+    common = sum((text & reference).values())
+    if not common:
+        return 0
+    precision = common / sum(text.values())
+    recall = common / sum(reference.values())
+    return 2 * precision * recall / (precision + recall)
+
+
+def timed(runs, function, *args):
+    "Return the result of the function and the median of the seconds it took over the given runs."
+    times = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        result = function(*args)
+        times.append(time.perf_counter() - start)
+    return result, statistics.median(times)
+
+
+def load(page):
+    "Return the url, html and reference text (if any) of the given page."
+    if page.startswith("http"):
+        return page, requests.get(page).content, None
+
+    with open(page, "rb") as file:
+        html = file.read()
+    reference_path = os.path.splitext(page)[0] + ".txt"
+    reference = None
+    if os.path.exists(reference_path):
+        with open(reference_path) as file:
+            reference = file.read()
+    return None, html, reference
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("pages", nargs="+", help="html files or urls")
+    parser.add_argument("--runs", type=int, default=3)
+    parser.add_argument("--node", action="store_true", help="also run the readability node worker")
+    args = parser.parse_args()
+
+    scraping.configure(vars(config))
+    pool = scraping.ExtractorPool(1, config.EXTRACTOR_TIMEOUT_SECONDS, config.EXTRACTOR_MAX_MEMORY_MB)
+    results = []
+    try:
+        for page in args.pages:
+            url, html, reference = load(page)
+            (article, confidence), fast_time = timed(args.runs, scraping.extract_fast, url, html)
+
+            node_columns = ""
+            if args.node or reference is None:
+                # the first run starts the node process, leave it out
+                pool.extract(url, html)
+                node_article, node_time = timed(args.runs, pool.extract, url, html)
+                if reference is None:
+                    reference = node_article["textContent"]
+                else:
+                    node_score = f1_score(node_article["textContent"], reference)
+                    node_columns = f"  node F1 {node_score:4.2f}"
+                node_columns += f"  {node_time * 1000:7.2f}ms node"
+
+            score = f1_score(article and article["textContent"], reference)
+            results.append((confidence, score))
+            print(
+                f"{os.path.basename(page)[-30:]:<30} confidence {confidence:4.2f}  F1 {score:4.2f}  "
+                f"{fast_time * 1000:6.2f}ms{node_columns}"
+            )
+    finally:
+        pool.close()
+
+    print()
+    for threshold in THRESHOLDS:
+        scores = [score for confidence, score in results if confidence >= threshold]
+        worst = f"worst F1 {min(scores):4.2f}" if scores else ""
+        print(f"threshold {threshold:.1f}: {len(scores)}/{len(results)} pages in-process  {worst}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,90 @@
+"""
+Compare the memory allocated and the time spent loading pages of the home timeline as full Entry
+objects (with their feeds) against the EntryRow projection used by the entry list views.
+
+Runs against the database of the given FLASK_ENV, with the entries of the given user.
+
+usage: FLASK_ENV=development python benchmarks/entry_list_memory.py [--email admin@admin.com] [--pages 20] [--page-size 10]
+"""
+
+import os
+
+os.environ.setdefault("DISABLE_CRON_TASKS", "1")
+
+import argparse
+import datetime
+import time
+import tracemalloc
+
+import sqlalchemy as sa
+
+import feedi.app as feedi_app
+from feedi import models
+from feedi.models import db
+
+
+def load_entities(user_id, start_at, page, page_size):
+    query = models.Entry.filter_by(user_id, start_at).options(sa.orm.joinedload(models.Entry.feed))
+    return db.session.scalars(query.limit(page_size).offset(page * page_size)).unique().all()
+
+
+def load_rows(user_id, start_at, page, page_size):
+    query = models.Entry.filter_by(user_id, start_at, rows=True)
+    return models.EntryRow.fetch(query.limit(page_size).offset(page * page_size))
+
+
+def measure(load, *args):
+    "Return the amount of results, bytes allocated and still held, peak bytes and seconds spent by the loader."
+    # start each page with an empty identity map, as a new request would
+    db.session.remove()
+
+    tracemalloc.start()
+    start = time.perf_counter()
+    results = load(*args)
+    elapsed = time.perf_counter() - start
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return len(results), current, peak, elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--email", default="admin@admin.com")
+    parser.add_argument("--pages", type=int, default=20)
+    parser.add_argument("--page-size", type=int, default=10)
+    args = parser.parse_args()
+
+    app = feedi_app.create_app()
+    with app.app_context():
+        user_id = db.session.scalar(db.select(models.User.id).filter_by(email=args.email))
+        if not user_id:
+            print(f"user {args.email} not found")
+            return
+
+        start_at = datetime.datetime.utcnow()
+        for label, load in [("Entry objects", load_entities), ("EntryRow projection", load_rows)]:
+            # warm up the db cache and sqlalchemy's statement cache
+            load(user_id, start_at, 0, args.page_size)
+
+            totals = [0, 0, 0, 0]
+            pages = 0
+            for page in range(args.pages):
+                results = measure(load, user_id, start_at, page, args.page_size)
+                if not results[0]:
+                    break
+                totals = [total + value for total, value in zip(totals, results)]
+                pages += 1
+
+            if not pages:
+                print("no entries found")
+                return
+
+            rows, held, peak, elapsed = [total / pages for total in totals]
+            print(
+                f"{label:<20} {pages} pages of {rows:.0f} entries: "
+                f"{held / 1024:8.1f}KB held  {peak / 1024:8.1f}KB peak  {elapsed * 1000:6.2f}ms per page"
+            )
+
+
+if __name__ == "__main__":
+    main()
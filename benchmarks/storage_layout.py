@@ -0,0 +1,170 @@
+"""
+Compare timeline scans on an entries table that stores the full article HTML and raw JSON inline
+against one that keeps them in a separate entry_blobs table.
+
+Builds two synthetic SQLite databases of roughly the given size, then reports the size of the entries
+table, how much of it fits in the page cache and the time of some typical queries with a cold and a warm cache.
+
+usage: python benchmarks/storage_layout.py [--size-mb 1024] [--dir /tmp] [--cache-mb 200]
+"""
+
+import argparse
+import datetime
+import json
+import os
+import random
+import sqlite3
+import string
+import time
+
+ENTRY_COLUMNS = """
+    id INTEGER PRIMARY KEY, feed_id INTEGER, user_id INTEGER NOT NULL, remote_id VARCHAR NOT NULL,
+    title VARCHAR, username VARCHAR, content_short VARCHAR, target_url VARCHAR, content_url VARCHAR,
+    media_url VARCHAR, created TIMESTAMP NOT NULL, updated TIMESTAMP NOT NULL, display_date TIMESTAMP NOT NULL,
+    sort_date TIMESTAMP NOT NULL, viewed TIMESTAMP, favorited TIMESTAMP, pinned TIMESTAMP,
+    recent BOOLEAN NOT NULL, bucket INTEGER
+"""
+
+INDEXES = """
+CREATE INDEX entry_rank ON entries (user_id, recent DESC, bucket, sort_date DESC);
+CREATE INDEX ix_entries_created ON entries (created);
+CREATE UNIQUE INDEX ix_feed_remote ON entries (feed_id, remote_id);
+"""
+
+QUERIES = {
+    "home page (10 rows)": """
+        SELECT id, title, content_short FROM entries
+        WHERE user_id = 1 AND created > :newer_than AND viewed IS NULL
+        ORDER BY recent DESC, bucket, sort_date DESC LIMIT 10 OFFSET 50""",
+    "feed list aggregate": """
+        SELECT feed_id, count(1), max(sort_date) FROM entries WHERE user_id = 1 GROUP BY feed_id""",
+    "text search title/short": """
+        SELECT count(*) FROM entries WHERE user_id = 1 AND (title LIKE '%zzz%' OR content_short LIKE '%zzz%')""",
+}
+
+
+def random_text(size):
+    words = ["".join(random.choices(string.ascii_lowercase, k=random.randint(2, 10))) for _ in range(200)]
+    text = []
+    length = 0
+    while length < size:
+        word = random.choice(words)
+        text.append(word)
+        length += len(word) + 1
+    return " ".join(text)
+
+
+def build(path, split, size_mb):
+    if os.path.exists(path):
+        os.remove(path)
+
+    db = sqlite3.connect(path)
+    db.execute("pragma journal_mode=WAL")
+    if split:
+        db.execute(f"CREATE TABLE entries ({ENTRY_COLUMNS})")
+        db.execute("CREATE TABLE entry_blobs (entry_id INTEGER PRIMARY KEY, content_full VARCHAR, raw_data VARCHAR)")
+    else:
+        db.execute(f"CREATE TABLE entries ({ENTRY_COLUMNS}, content_full VARCHAR, raw_data VARCHAR)")
+    db.executescript(INDEXES)
+
+    random.seed(0)
+    article = "<article>" + "".join(f"<p>{random_text(600)}</p>" for _ in range(25)) + "</article>"
+    raw = json.dumps({"summary": random_text(1500), "tags": [random_text(20)] * 5, "links": [random_text(80)] * 3})
+    now = datetime.datetime.utcnow()
+
+    entry_id = 0
+    while os.path.getsize(path) < size_mb * 1024 * 1024:
+        rows = []
+        blobs = []
+        for _ in range(1000):
+            entry_id += 1
+            date = now - datetime.timedelta(minutes=entry_id)
+            values = (
+                entry_id,
+                entry_id % 200,
+                1,
+                str(entry_id),
+                random_text(60),
+                "someone",
+                f"<p>{random_text(400)}</p>",
+                f"https://example.com/{entry_id}",
+                f"https://example.com/{entry_id}",
+                None,
+                date,
+                date,
+                date,
+                date,
+                None,
+                None,
+                None,
+                date > now - datetime.timedelta(hours=24),
+                entry_id % 6,
+            )
+            if split:
+                rows.append(values)
+                blobs.append((entry_id, article, raw))
+            else:
+                rows.append(values + (article, raw))
+
+        placeholders = ",".join("?" * len(rows[0]))
+        db.executemany(f"INSERT INTO entries VALUES ({placeholders})", rows)
+        if blobs:
+            db.executemany("INSERT INTO entry_blobs VALUES (?, ?, ?)", blobs)
+        db.commit()
+
+    db.execute("ANALYZE")
+    db.execute("pragma wal_checkpoint(TRUNCATE)")
+    db.close()
+    return entry_id
+
+
+def table_pages(db, name):
+    return db.execute("SELECT count(*) FROM dbstat WHERE name = ?", (name,)).fetchone()[0]
+
+
+def timed(db, sql, params):
+    start = time.perf_counter()
+    db.execute(sql, params).fetchall()
+    return (time.perf_counter() - start) * 1000
+
+
+def report(path, label, cache_mb):
+    db = sqlite3.connect(path)
+    page_size = db.execute("pragma page_size").fetchone()[0]
+    entries_pages = table_pages(db, "entries")
+    cache_pages = cache_mb * 1024 * 1024 // page_size
+
+    print(f"\n{label}: {os.path.getsize(path) / 1024 / 1024:.0f}MB file")
+    print(f"  entries table: {entries_pages} pages ({entries_pages * page_size / 1024 / 1024:.1f}MB)")
+    print(
+        f"  fraction of entries table that fits in a {cache_mb}MB page cache: {min(1, cache_pages / entries_pages):.0%}"
+    )
+    db.close()
+
+    params = {"newer_than": datetime.datetime.utcnow() - datetime.timedelta(days=14)}
+    for name, sql in QUERIES.items():
+        # a fresh connection starts with an empty page cache
+        db = sqlite3.connect(path)
+        db.execute(f"pragma cache_size = -{cache_mb * 1024}")
+        cold = timed(db, sql, params)
+        warm = min(timed(db, sql, params) for _ in range(5))
+        db.close()
+        print(f"  {name:<25} cold {cold:8.1f}ms   warm {warm:8.1f}ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--size-mb", type=int, default=1024)
+    parser.add_argument("--cache-mb", type=int, default=200)
+    parser.add_argument("--dir", default="/tmp")
+    args = parser.parse_args()
+
+    for label, split in [("inline blobs", False), ("entry_blobs table", True)]:
+        path = os.path.join(args.dir, f"feedi-bench-{'split' if split else 'inline'}.db")
+        rows = build(path, split, args.size_mb)
+        print(f"built {path} with {rows} entries")
+        report(path, label, args.cache_mb)
+
+
+if __name__ == "__main__":
+    main()
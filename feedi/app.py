@@ -10,6 +10,7 @@ import flask  # noqa: E402
 from werkzeug.serving import is_running_from_reloader  # noqa: E402
 
 import feedi.models as models  # noqa: E402
+import feedi.scraping as scraping  # noqa: E402
 
 
 def create_app():
@@ -53,12 +54,7 @@ def create_huey_app():
     load_config(app)
 
     with app.app_context():
-        # since huey tasks share the db engine pool, we want to have a big enough pool
-        # so all concurrent tasks get their own connection
-        pool_size = round(app.config["HUEY_POOL_SIZE"] * 1.1)
-        app.config["SQLALCHEMY_ENGINE_OPTIONS"] = {"pool_size": pool_size}
-
-        models.init_db(app)
+        models.init_db(app, tasks=True)
 
     return app
 
@@ -72,3 +68,10 @@ def load_config(app):
 
     app.config.from_object("feedi.config.default")
     app.config.from_object(f"feedi.config.{env}")
+
+    # the tasks app gets the instance folder of the web app too, see THUMBNAIL_CACHE_DIR
+    if not app.config["THUMBNAIL_CACHE_DIR"]:
+        app.config["THUMBNAIL_CACHE_DIR"] = os.path.join(flask.Flask(__package__).instance_path, "thumbnails")
+
+    # module level settings, used outside of the app context too
+    scraping.configure(app.config)
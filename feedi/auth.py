@@ -54,7 +54,15 @@ def kindle_add():
     feedi_email = app.config.get("FEEDI_EMAIL")
     if not feedi_email:
         return flask.abort(400, "no feedi email configured")
-    return flask.render_template("kindle.html", feedi_email=feedi_email)
+
+    # show the latest deliveries so failed ones can be noticed
+    deliveries = db.session.scalars(
+        db.select(models.KindleDelivery)
+        .filter_by(user_id=current_user.id)
+        .order_by(models.KindleDelivery.created.desc())
+        .limit(20)
+    ).all()
+    return flask.render_template("kindle.html", feedi_email=feedi_email, deliveries=deliveries)
 
 
 @app.post("/auth/kindle")
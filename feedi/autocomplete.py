@@ -0,0 +1,66 @@
+"""
+Matching of the search box input against feed names, folders and commands, see routes.autocomplete.
+This runs on every keystroke, so the names of each user are kept in memory (see models.Feed.autocomplete_index).
+"""
+
+import re
+
+
+def score(term, name):
+    """
+    Return how well the lowercase term matches the lowercase name, as a sortable value where lower
+    is better, or None if it doesn't match. Prefixes of the name rank first, then prefixes of one of
+    its words, then other substrings and last names that contain the characters of the term in
+    order, e.g. "hnws" for "hacker news".
+    """
+    position = name.find(term)
+    if position == 0:
+        return (0, 0)
+    if position > 0:
+        if re.search(r"\b" + re.escape(term), name):
+            return (1, position)
+        return (2, position)
+
+    # fuzzy match, ranked by how spread the characters are
+    gaps = 0
+    previous = None
+    for char in term:
+        position = name.find(char, 0 if previous is None else previous + 1)
+        if position == -1:
+            return None
+        if previous is not None:
+            gaps += position - previous - 1
+        previous = position
+    return (3, gaps)
+
+
+def rank(term, candidates):
+    """
+    Return the values of the given (lowercase name, value) pairs whose name matches
+    the term, best matches first.
+    """
+    term = term.lower()
+    scored = []
+    for name, value in candidates:
+        match = score(term, name)
+        if match is not None:
+            scored.append((match, len(name), name, value))
+
+    scored.sort(key=lambda item: item[:3])
+    return [value for (_match, _length, _name, value) in scored]
+
+
+class Index:
+    "The names of the feeds and folders of a user, prepared for matching."
+
+    def __init__(self, feeds, folders):
+        self.feeds = [(name.lower(), (feed_id, name)) for (feed_id, name) in feeds if name]
+        self.folders = [(folder.lower(), folder) for folder in folders if folder]
+
+    def search_feeds(self, term):
+        "Return the (id, name) of the feeds that match the term, best matches first."
+        return rank(term, self.feeds)
+
+    def search_folders(self, term):
+        "Return the names of the folders that match the term, best matches first."
+        return rank(term, self.folders)
@@ -0,0 +1,119 @@
+"""
+Simple in-memory caches, local to each process.
+
+Since other processes (e.g. cli commands) may change the cached data without the process
+noticing, values should either expire after a while or be keyed by something that changes along with them.
+"""
+
+import collections
+import sys
+import time
+
+import gevent.event
+
+
+class ExpiringDict:
+    "A dictionary whose values are discarded some seconds after being set."
+
+    def __init__(self, ttl_seconds):
+        self.ttl_seconds = ttl_seconds
+        self._data = {}
+
+    def get(self, key):
+        "Return the value for the given key, or None if it's missing or expired."
+        value, expires = self._data.get(key, (None, None))
+        if expires is not None and expires < time.monotonic():
+            self._data.pop(key, None)
+            return None
+        return value
+
+    def set(self, key, value):
+        self._data[key] = (value, time.monotonic() + self.ttl_seconds)
+
+    def pop(self, key):
+        self._data.pop(key, None)
+
+    def clear(self):
+        self._data.clear()
+
+
+class LRUCache:
+    """
+    A dictionary that holds up to `max_bytes` worth of values (as measured by the `sizeof` function),
+    discarding the least recently used ones to make room for new ones.
+    """
+
+    def __init__(self, max_bytes, sizeof=sys.getsizeof):
+        self.max_bytes = max_bytes
+        self.sizeof = sizeof
+        self.size = 0
+        self._data = collections.OrderedDict()
+
+    def __len__(self):
+        return len(self._data)
+
+    def get(self, key):
+        "Return the value for the given key, or None if it's missing."
+        if key not in self._data:
+            return None
+        self._data.move_to_end(key)
+        return self._data[key][0]
+
+    def set(self, key, value):
+        self.pop(key)
+        size = self.sizeof(value)
+        if size > self.max_bytes:
+            return
+
+        self._data[key] = (value, size)
+        self.size += size
+        while self.size > self.max_bytes:
+            _key, (_value, evicted_size) = self._data.popitem(last=False)
+            self.size -= evicted_size
+
+    def pop(self, key):
+        _value, size = self._data.pop(key, (None, 0))
+        self.size -= size
+
+    def clear(self):
+        self._data.clear()
+        self.size = 0
+
+
+class SingleFlight:
+    """
+    Collapse concurrent calls for the same key into one: while a call is in progress, other callers
+    with the same key wait for it and get its result (or its exception) instead of repeating it.
+    Waiters give up with a TimeoutError after `timeout_seconds`, while the call itself goes on.
+    The amount of collapsed calls is counted per the first item of each key, in `collapsed`.
+    """
+
+    def __init__(self, timeout_seconds=None):
+        self.timeout_seconds = timeout_seconds
+        self.collapsed = collections.Counter()
+        self._calls = {}
+
+    def call(self, key, function, *args, **kwargs):
+        in_flight = self._calls.get(key)
+        if in_flight is not None:
+            self.collapsed[key[0]] += 1
+            try:
+                return in_flight.get(timeout=self.timeout_seconds)
+            except gevent.Timeout:
+                raise TimeoutError(f"gave up waiting for the call in progress for {key}") from None
+
+        in_flight = gevent.event.AsyncResult()
+        self._calls[key] = in_flight
+        try:
+            result = function(*args, **kwargs)
+            in_flight.set(result)
+            return result
+        except Exception as error:
+            in_flight.set_exception(error)
+            raise
+        except BaseException:
+            # the calling greenlet was killed or timed out, which shouldn't end the waiting ones along with it
+            in_flight.set_exception(RuntimeError(f"the call in progress for {key} was interrupted"))
+            raise
+        finally:
+            del self._calls[key]
@@ -0,0 +1,102 @@
+"""
+Compression of large text values (article HTML, raw feed JSON) for storage at rest.
+
+Values are zlib-compressed and prefixed with a one byte header that identifies the format, so
+readers can tell them apart and new formats can be added without rewriting existing data.
+Small JSON documents compress poorly on their own, so they can optionally use a preset dictionary
+trained on a sample of the stored data. The dictionaries themselves are persisted by the caller
+(see models.CompressionDictionary) and registered here by id.
+"""
+
+import collections
+import struct
+import zlib
+
+ZLIB = b"z"
+ZLIB_DICT = b"d"
+
+# zlib only looks back this far, so a longer dictionary would be wasted
+MAX_DICTIONARY_SIZE = 32 * 1024
+
+_dictionaries = {}
+_current_dictionary = None
+
+
+def register_dictionary(dictionary_id, data):
+    """
+    Make the given dictionary available for decompression. The most recent (highest id) registered
+    dictionary is the one used to compress new values.
+    """
+    global _current_dictionary
+    _dictionaries[dictionary_id] = data
+    if _current_dictionary is None or dictionary_id > _current_dictionary:
+        _current_dictionary = dictionary_id
+
+
+def compress(text, use_dictionary=False):
+    "Return the compressed bytes for the given text, including the format header."
+    data = text.encode("utf-8")
+
+    if use_dictionary and _current_dictionary is not None:
+        compressor = zlib.compressobj(level=9, zdict=_dictionaries[_current_dictionary])
+        return ZLIB_DICT + struct.pack(">I", _current_dictionary) + compressor.compress(data) + compressor.flush()
+
+    return ZLIB + zlib.compress(data, level=6)
+
+
+def decompress(value, load_dictionary=None):
+    """
+    Return the text for a value produced by `compress`. Plain strings are assumed to be values stored
+    before compression was introduced and are returned as is.
+    If the value references a dictionary that isn't registered, `load_dictionary` is called with its id.
+    """
+    if value is None or isinstance(value, str):
+        return value
+
+    value = bytes(value)
+    header, payload = value[:1], value[1:]
+    if header == ZLIB:
+        return zlib.decompress(payload).decode("utf-8")
+
+    if header == ZLIB_DICT:
+        (dictionary_id,) = struct.unpack(">I", payload[:4])
+        if dictionary_id not in _dictionaries:
+            if not load_dictionary:
+                raise ValueError(f"unknown compression dictionary {dictionary_id}")
+            register_dictionary(dictionary_id, load_dictionary(dictionary_id))
+
+        decompressor = zlib.decompressobj(zdict=_dictionaries[dictionary_id])
+        return (decompressor.decompress(payload[4:]) + decompressor.flush()).decode("utf-8")
+
+    raise ValueError(f"unknown compression format {header}")
+
+
+def train_dictionary(samples, size=MAX_DICTIONARY_SIZE):
+    """
+    Build a preset dictionary out of the substrings most commonly shared by the given text samples.
+    The samples are expected to be JSON documents, which are split at their key/value separators.
+    """
+    counts = collections.Counter()
+    for sample in samples:
+        # count each segment once per sample, we want the ones shared across documents
+        segments = set(sample.replace('", "', '",\n"').replace(', "', ',\n"').split("\n"))
+        counts.update(segment for segment in segments if len(segment) > 3)
+
+    # score by the amount of bytes each segment would save
+    ranked = sorted(
+        (segment for segment, count in counts.items() if count > 1),
+        key=lambda segment: counts[segment] * len(segment),
+        reverse=True,
+    )
+
+    chosen = []
+    total = 0
+    for segment in ranked:
+        encoded = segment.encode("utf-8")
+        if total + len(encoded) > size:
+            continue
+        chosen.append(encoded)
+        total += len(encoded)
+
+    # zlib favors matches closer to the end of the dictionary, so the most valuable segments go last
+    return b"".join(reversed(chosen))
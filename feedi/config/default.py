@@ -1,20 +1,70 @@
 SQLALCHEMY_DATABASE_URI = "sqlite:///feedi.db"
 
 ENTRY_PAGE_SIZE = 10
+# Cached entry lists are rendered again at least this often, since they show relative dates and the ranking changes
+ENTRY_LIST_REFRESH_MINUTES = 5
 
 SYNC_FEEDS_CRON_MINUTES = "*/30"
 DELETE_OLD_CRON_HOURS = "*/12"
 
 SKIP_RECENTLY_UPDATED_MINUTES = 10
 CONTENT_PREFETCH_MINUTES = "*/15"
+# How many entries to fetch the article content for on each prefetch run, at most, and how many at a time
+CONTENT_PREFETCH_BUDGET = 100
+CONTENT_PREFETCH_WORKERS = 8
+# How many entries from the top of each user's home timeline are considered for prefetching
+CONTENT_PREFETCH_DEPTH = 15
+UPDATE_RANKING_CRON_MINUTES = "*/5"
+# Retry failed sends to kindle and pick up any queued ones that were left behind
+KINDLE_DELIVERY_CRON_MINUTES = "*/5"
 RSS_SKIP_OLDER_THAN_DAYS = 30
 DELETE_AFTER_DAYS = 30
+# How many entries to delete per transaction when purging old entries
+DELETE_CHUNK_SIZE = 500
+# Drop the original source data of entries after this many days. None keeps it as long as the entry.
+RAW_DATA_RETENTION_DAYS = None
 RSS_MINIMUM_ENTRY_AMOUNT = 10
+DB_MAINTENANCE_CRON_HOURS = "3"
 
 # How many tasks to allow running concurrently. eg. how many feeds to sync at a time.
 # This affects the sqlalchemy engine pool size
 HUEY_POOL_SIZE = 100
 
+# The web app reads through this many read-only connections and writes through a single one.
+# Set to 0 to use a single pool for both.
+DB_READER_POOL_SIZE = 4
+# Ceiling for the sqlite page cache memory of the process, split between the connections of the web and tasks apps
+DB_CACHE_MB = 200
+# Size of the db file that is memory mapped. This memory is shared by all connections.
+DB_MMAP_MB = 512
+# Memory for the rendered html of the most recently displayed entries, so scrolling lists don't re-render them
+ENTRY_CARD_CACHE_MB = 32
+# How many articles can be parsed with readability at the same time, each in a node process, how long to
+# wait for each of them and how much memory a process can use before it's replaced
+EXTRACTOR_POOL_SIZE = 2
+EXTRACTOR_TIMEOUT_SECONDS = 30
+EXTRACTOR_MAX_MEMORY_MB = 300
+# Pages with clean markup are parsed in-process instead, when the confidence of the result is at least
+# this much (see benchmarks/article_extraction.py). Pages with less paragraph text than
+# FAST_EXTRACT_MIN_TEXT characters are always left to readability, which handles short pages better
+FAST_EXTRACT_MIN_CONFIDENCE = 0.8
+FAST_EXTRACT_MIN_TEXT = 500
+# Kindle rejects large documents, so the images of the EPUB files sent to it are limited in amount and size,
+# and downscaled to fit e-reader screens. Up to EPUB_IMAGE_DOWNLOADS of them are fetched at a time
+EPUB_MAX_IMAGES = 30
+EPUB_MAX_IMAGE_BYTES = 5 * 1024 * 1024
+EPUB_IMAGE_SIZE = (1072, 1448)
+EPUB_IMAGE_DOWNLOADS = 8
+# Memory for the EPUB files of recently packaged articles, so sending them again doesn't repeat the work
+EPUB_CACHE_MB = 64
+# Disk space for the resized copies of entry images, avatars and icons served by the app
+THUMBNAIL_CACHE_MB = 256
+# Where to store them. Both the web app and the tasks app create them, so by default it's a directory
+# in the instance folder of the web app, which the tasks app doesn't share
+THUMBNAIL_CACHE_DIR = None
+# Site icons are cached by domain and discovered again after this many days
+FAVICON_TTL_DAYS = 7
+
 # username to use internally when authentication is "disabled"
 # this user will be inserted automatically when first creating the DB
 # and auto-logged-in when a browser first sends a request to the app.
@@ -1,4 +1,12 @@
+import os
+
 ENV = "testing"
 SECRET_KEY = b"\xffN\xcfX\xbc\xa9V\x8b*_zFB\xb9\xfa\x1d"
 TESTING = True
-SQLALCHEMY_DATABASE_URI = "sqlite:///feedi.test.db"
+# e.g. FEEDI_TEST_DATABASE_URI=postgresql+psycopg://localhost/feedi_test to run the tests against postgres
+SQLALCHEMY_DATABASE_URI = os.getenv("FEEDI_TEST_DATABASE_URI", "sqlite:///feedi.test.db")
+
+FEEDI_EMAIL = "feedi@mail.com"
+FEEDI_EMAIL_PASSWORD = ""
+FEEDI_EMAIL_SERVER = "smtp.mail.com"
+FEEDI_EMAIL_PORT = 587
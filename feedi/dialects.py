@@ -0,0 +1,161 @@
+"""
+The parts of the persistence layer that depend on the database backend.
+
+feedi uses SQLite by default. PostgreSQL is also supported, to run several web and task processes
+against the same database. Code that needs something the backends don't share (upserts, connection
+setup, maintenance, text search) should go through the dialect of the engine in use, see `get`.
+"""
+
+import os
+
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql, sqlite
+
+from feedi import compression
+
+
+def get(engine):
+    "Return the dialect for the given engine."
+    try:
+        return DIALECTS[engine.dialect.name]
+    except KeyError:
+        raise ValueError(f"unsupported database backend {engine.dialect.name}")
+
+
+class SQLite:
+    name = "sqlite"
+    # large text values are compressed before they are stored, see `models.CompressedString`
+    compress_values = True
+
+    @staticmethod
+    def insert(model):
+        "Return an insert statement for the model that supports `on_conflict_do_update`."
+        return sqlite.insert(model)
+
+    @staticmethod
+    def on_connect(dbapi_connection, read_only, cache_kb, mmap_size, load_dictionary):
+        # let the maintenance task return pages freed by purges to the filesystem.
+        # this only has an effect on a new db (so it needs to go first), existing ones are converted by a migration
+        dbapi_connection.execute("pragma auto_vacuum = INCREMENTAL")
+
+        # use WAL mode to prevent locks on concurrent writes
+        dbapi_connection.execute("pragma journal_mode=WAL")
+
+        # the memory mapped pages are shared by all connections (and processes), unlike the page cache
+        dbapi_connection.execute(f"pragma cache_size = -{cache_kb}")
+        dbapi_connection.execute(f"pragma mmap_size = {mmap_size}")
+
+        # allow matching against compressed columns in queries, e.g. for text search
+        dbapi_connection.create_function(
+            "feedi_decompress",
+            1,
+            lambda value: compression.decompress(value, load_dictionary),
+            deterministic=True,
+        )
+
+        if read_only:
+            dbapi_connection.execute("pragma query_only = 1")
+
+    @staticmethod
+    def contains(column, text, compressed=False):
+        "Return a case insensitive text search condition for the column."
+        if compressed:
+            column = sa.func.feedi_decompress(column)
+        return column.contains(text)
+
+    @staticmethod
+    def stats(connection):
+        """
+        Return the size in bytes of the database file, its write-ahead log
+        and the pages of the database that are unused.
+        """
+        page_size = connection.exec_driver_sql("pragma page_size").scalar()
+        page_count = connection.exec_driver_sql("pragma page_count").scalar()
+        freelist_count = connection.exec_driver_sql("pragma freelist_count").scalar()
+
+        wal_path = f"{connection.engine.url.database}-wal"
+        wal_size = os.path.getsize(wal_path) if os.path.exists(wal_path) else 0
+
+        return {"db": page_count * page_size, "wal": wal_size, "free": freelist_count * page_size}
+
+    @staticmethod
+    def connection_memory(connection):
+        "Return the page cache size and the memory mapped size of the connection, in bytes."
+        cache_size = connection.exec_driver_sql("pragma cache_size").scalar()
+        page_size = connection.exec_driver_sql("pragma page_size").scalar()
+        mmap_size = connection.exec_driver_sql("pragma mmap_size").scalar()
+
+        # a negative cache size is expressed in KB instead of pages
+        cache_bytes = -cache_size * 1024 if cache_size < 0 else cache_size * page_size
+        return {"cache": cache_bytes, "mmap": mmap_size}
+
+    @staticmethod
+    def maintain(connection):
+        """
+        Return the free pages to the filesystem, refresh the query planner statistics
+        and truncate the write-ahead log. Expects a connection in autocommit mode.
+        """
+        # the python driver only steps through statements that return nothing once, which for
+        # this pragma means freeing a single page. executescript runs it to completion
+        connection.connection.driver_connection.executescript("pragma incremental_vacuum")
+
+        # optimize only analyzes tables that look like they need it, which won't work without prior stats
+        if not connection.exec_driver_sql("select 1 from sqlite_master where name = 'sqlite_stat1'").first():
+            connection.exec_driver_sql("analyze")
+        connection.exec_driver_sql("pragma optimize")
+
+        # last, since the steps above write to the log too
+        connection.exec_driver_sql("pragma wal_checkpoint(TRUNCATE)").fetchall()
+
+
+class PostgreSQL:
+    name = "postgresql"
+    # the server already compresses large values (TOAST), and storing them
+    # as plain text lets it search into them
+    compress_values = False
+
+    @staticmethod
+    def insert(model):
+        "Return an insert statement for the model that supports `on_conflict_do_update`."
+        return postgresql.insert(model)
+
+    @staticmethod
+    def on_connect(dbapi_connection, read_only, cache_kb, mmap_size, load_dictionary):
+        # caching is handled by the server and values aren't compressed, so there's nothing to configure for them
+        if read_only:
+            dbapi_connection.read_only = True
+
+    @staticmethod
+    def contains(column, text, compressed=False):
+        "Return a case insensitive text search condition for the column."
+        # compressed columns are stored as plain text on this backend
+        return column.icontains(text)
+
+    @staticmethod
+    def stats(connection):
+        """
+        Return the size in bytes of the database and of its dead rows.
+        The write-ahead log is shared by the whole server, so its size isn't reported.
+        """
+        db_size = connection.exec_driver_sql("select pg_database_size(current_database())").scalar()
+        dead_rows = connection.exec_driver_sql(
+            "select coalesce(sum(pg_relation_size(relid) * n_dead_tup / greatest(n_live_tup + n_dead_tup, 1)), 0) "
+            "from pg_stat_user_tables"
+        ).scalar()
+        return {"db": db_size, "wal": None, "free": int(dead_rows)}
+
+    @staticmethod
+    def connection_memory(_connection):
+        "The server manages the cache memory, there's no per-connection cache to report."
+        return {"cache": 0, "mmap": 0}
+
+    @staticmethod
+    def maintain(connection):
+        """
+        Reclaim the space of dead rows and refresh the query planner statistics.
+        Expects a connection in autocommit mode.
+        """
+        connection.exec_driver_sql("vacuum (analyze)")
+
+
+DIALECTS = {dialect.name: dialect for dialect in [SQLite, PostgreSQL]}
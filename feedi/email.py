@@ -5,13 +5,16 @@ from email.mime.base import MIMEBase
 from email.mime.multipart import MIMEMultipart
 
 import flask
+import gevent.lock
+
+# the smtp session is kept open between sends, so batches of deliveries don't log in for each one.
+# it's checked before being reused, since servers drop idle sessions after a while
+_smtp = None
+_smtp_lock = gevent.lock.BoundedSemaphore()
 
 
 def send(recipient, attach_data, filename):
-    server = flask.current_app.config["FEEDI_EMAIL_SERVER"]
-    port = flask.current_app.config["FEEDI_EMAIL_PORT"]
     sender = flask.current_app.config["FEEDI_EMAIL"]
-    password = flask.current_app.config["FEEDI_EMAIL_PASSWORD"]
 
     msg = MIMEMultipart()
     msg["From"] = sender
@@ -27,9 +30,46 @@ def send(recipient, attach_data, filename):
     part.add_header("Content-Disposition", f"attachment; filename*=UTF-8''{filename}.epub")
     msg.attach(part)
 
+    with _smtp_lock:
+        try:
+            connection().sendmail(sender, recipient, msg.as_string())
+        except (smtplib.SMTPException, OSError):
+            # start over with a new session on the next send
+            disconnect()
+            raise
+
+
+def connection():
+    "Return the open smtp session if it's still usable, otherwise log in to a new one."
+    global _smtp
+    if _smtp is not None:
+        try:
+            if _smtp.noop()[0] == 250:
+                return _smtp
+        except (smtplib.SMTPException, OSError):
+            pass
+        disconnect()
+
+    server = flask.current_app.config["FEEDI_EMAIL_SERVER"]
+    port = flask.current_app.config["FEEDI_EMAIL_PORT"]
+    sender = flask.current_app.config["FEEDI_EMAIL"]
+    password = flask.current_app.config["FEEDI_EMAIL_PASSWORD"]
+
     smtp = smtplib.SMTP(server, port)
     smtp.ehlo()
     smtp.starttls()
     smtp.login(sender, password)
-    smtp.sendmail(sender, recipient, msg.as_string())
-    smtp.quit()
+    _smtp = smtp
+    return _smtp
+
+
+def disconnect():
+    global _smtp
+    if _smtp is None:
+        return
+
+    try:
+        _smtp.quit()
+    except (smtplib.SMTPException, OSError):
+        pass
+    _smtp = None
@@ -0,0 +1,61 @@
+"""
+In-memory publish/subscribe of per user events, e.g. to let the browser know of new entries after a sync.
+
+Subscribers are gevent queues in the process memory, so events only reach the clients connected to the
+process that publishes them. This works because the periodic tasks run in the web app process
+(see app.create_app), but events published by cli commands are lost.
+"""
+
+import collections
+import contextlib
+
+import gevent.queue
+
+# seconds without events after which listeners are woken up, so they can check the client is still there
+KEEPALIVE_SECONDS = 30
+
+# events for clients that don't keep up are dropped beyond this amount
+MAX_PENDING_EVENTS = 100
+
+_subscribers = collections.defaultdict(set)
+
+
+def publish(user_id, event, **data):
+    "Send an event with the given data to all the current subscribers of the user."
+    for queue in list(_subscribers.get(user_id, ())):
+        try:
+            queue.put_nowait((event, data))
+        except gevent.queue.Full:
+            pass
+
+
+@contextlib.contextmanager
+def subscribe(user_id):
+    "Return a queue that receives the (event, data) pairs published for the given user until the context exits."
+    queue = gevent.queue.Queue(maxsize=MAX_PENDING_EVENTS)
+    _subscribers[user_id].add(queue)
+    try:
+        yield queue
+    finally:
+        _subscribers[user_id].discard(queue)
+        if not _subscribers[user_id]:
+            del _subscribers[user_id]
+
+
+def listen(user_id, keepalive=KEEPALIVE_SECONDS):
+    """
+    Yield the (event, data) pairs published for the given user as they come.
+    None is yielded after `keepalive` seconds without events.
+    """
+    with subscribe(user_id) as queue:
+        while True:
+            try:
+                yield queue.get(timeout=keepalive)
+            except gevent.queue.Empty:
+                yield None
+
+
+def encode(event, data):
+    "Return the given event and its data (a string) in the text/event-stream format."
+    lines = "".join(f"data: {line}\n" for line in data.splitlines() or [""])
+    return f"event: {event}\n{lines}\n"
@@ -2,9 +2,15 @@
 // node.js script that parses the HTML from the given urls and passes it to the readability package
 // to clean it up. If no url is passed, the HTML document is expected from stdin.
 // A JSON document is printed to stdout with some metadata and the cleaned up HTML in the 'content' field
+//
+// With --server, the process stays up to parse many documents, saving the startup cost on each one.
+// It reads one JSON request per line from stdin, with the 'url' and 'html' of a document, and writes
+// one JSON response per line to stdout, with either the parsed 'article' or an 'error', along with
+// the 'memory' (resident set size in bytes) of the process. Requests are handled one at a time.
 
 const { JSDOM } = require("jsdom");
 const { Readability } = require('@mozilla/readability');
+const readline = require('node:readline');
 const util = require('node:util');
 
 function parseAndPrint(dom) {
@@ -13,6 +19,29 @@ function parseAndPrint(dom) {
   process.stdout.write(JSON.stringify(article), process.exit);
 }
 
+function parse(html, url) {
+  const dom = new JSDOM(html, {url});
+  const article = new Readability(dom.window.document).parse();
+  dom.window.close();
+  return article;
+}
+
+function serve() {
+  const lines = readline.createInterface({input: process.stdin, crlfDelay: Infinity});
+  lines.on('line', (line) => {
+    let response;
+    try {
+      const {url, html} = JSON.parse(line);
+      response = {article: parse(html, url)};
+    } catch (error) {
+      response = {error: String(error)};
+    }
+    response.memory = process.memoryUsage().rss;
+    process.stdout.write(JSON.stringify(response) + '\n');
+  });
+  lines.on('close', () => process.exit());
+}
+
 async function read(stream) {
   const chunks = [];
   for await (const chunk of stream) chunks.push(chunk);
@@ -22,16 +51,19 @@ async function read(stream) {
 const {values, positionals} =  util.parseArgs({
   allowPositionals: true,
   options: {
-    stdin: {type: 'boolean'}
+    stdin: {type: 'boolean'},
+    server: {type: 'boolean'}
   }
 });
 
 const url = positionals[0];
-if (!url) {
+if (!url && !values.server) {
   process.stderr.write('missing url argument', () => process.exit(1));
 }
 
-if (values.stdin) {
+if (values.server) {
+  serve();
+} else if (values.stdin) {
   read(process.stdin).then(s => new JSDOM(s, {url})).then(parseAndPrint);
 } else {
   JSDOM.fromURL(url).then(parseAndPrint);
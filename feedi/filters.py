@@ -2,11 +2,12 @@ import datetime
 import urllib
 
 import flask
-from bs4 import BeautifulSoup
+import markupsafe
 from flask import current_app as app
+from flask_login import current_user
 
 import feedi.models as models
-from feedi.models import db
+from feedi import scraping, thumbnails
 
 
 # TODO unit test this
@@ -34,39 +35,16 @@ def feed_domain(url):
 
 
 @app.template_filter("sanitize")
-def sanitize_content(html, truncate=True):
-    if not html:
-        return ""
-
-    # poor man's line truncating: reduce the amount of characters and let bs4 fix the html
-    soup = BeautifulSoup(html, "lxml")
-    if len(html) > 500 and truncate:
-        html = html[:500] + "…"
-        soup = BeautifulSoup(html, "lxml")
-
-    if soup.html:
-        if soup.html.body:
-            soup.html.body.unwrap()
-        soup.html.unwrap()
-
-    for a in soup.find_all("a", href=True):
-        # prevent link clicks triggering the container's click event
-        # add kb modifiers to open in reader
-        read_url = flask.url_for("entry_add", url=a["href"], redirect=1)
-        a["_"] = f"""
-        on click[shiftKey and not metaKey] go to url {read_url} then halt
-        then on click[shiftKey and metaKey] go to url {read_url} in new window then halt
-        then on click halt the event's bubbling
-        """
-
-    return str(soup)
+def sanitize_content(html):
+    "Render the preview of entries that don't have one stored yet, see `Entry.content_preview`."
+    return scraping.preview_html(html) or ""
 
 
 # FIXME this wouldn't be necessary if I could figure out the proper CSS
 # to make the text hide on overflow
 @app.template_filter("entry_excerpt")
 def entry_excerpt(entry):
-    if not entry.content_short:
+    if entry.content_excerpt is None and not entry.content_short:
         return "[click to read]"
 
     if entry.content_url and entry.title:
@@ -76,19 +54,65 @@ def entry_excerpt(entry):
     else:
         title = entry.feed.name
 
-    body_text = BeautifulSoup(entry.content_short, "lxml").text
+    body_text = entry.content_excerpt
+    if body_text is None:
+        body_text = scraping.preview_text(entry.content_short)
 
     # truncate according to display title length so all entries
     # have aproximately the same length
-    max_length = 100
-    max_body_length = max(0, max_length - len(title))
+    max_body_length = max(0, scraping.EXCERPT_LENGTH - len(title))
     if len(body_text) > max_body_length:
         return body_text[:max_body_length] + "…"
 
     return body_text
 
 
+ENTRY_CARD_VARIANTS = 4
+
+
+@app.template_filter("entry_card")
+def entry_card(entry, filters, is_pinned_list=False):
+    """
+    Render the card of an entry in a list. The cards of recently displayed entries are cached, keyed
+    by everything they show that can change without the entry being updated, e.g. the relative date.
+    """
+    is_pinned_list = bool(is_pinned_list)
+    variant = (
+        entry.updated,
+        bool(entry.viewed),
+        bool(entry.pinned),
+        bool(entry.favorited),
+        humanize_date(entry.display_date),
+        entry.feed,
+        flask.session.get("view"),
+        is_pinned_list,
+        tuple(sorted(filters.items())),
+        bool(current_user.kindle_email),
+    )
+
+    variants = models.entry_card_cache.get(entry.id) or {}
+    html = variants.get(variant)
+    if html is None:
+        html = markupsafe.Markup(
+            flask.render_template("entry_card.html", entry=entry, filters=filters, is_pinned_list=is_pinned_list)
+        )
+        # variants go stale as the date ages, only keep the latest few
+        recent_variants = dict(list(variants.items())[-(ENTRY_CARD_VARIANTS - 1) :])
+        models.entry_card_cache.set(entry.id, {**recent_variants, variant: html})
+    return html
+
+
 @app.template_filter("feed_name")
 def feed_name(feed_id):
-    feed = db.get_or_404(models.Feed, feed_id)
+    feed = models.Feed.get_meta(feed_id)
+    if not feed:
+        flask.abort(404)
     return feed.name
+
+
+@app.template_filter("thumbnail")
+def thumbnail(url, width):
+    "Return the url of the given image resized to the given width, see `routes.image_proxy`."
+    if not url or not url.startswith(("http://", "https://")):
+        return url
+    return thumbnails.proxy_url(url, width)
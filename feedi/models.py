@@ -1,38 +1,113 @@
+import collections
 import datetime
+import functools
+import heapq
 import json
 import logging
+import sys
 import urllib
 
+import flask_sqlalchemy.session
 import sqlalchemy as sa
-import sqlalchemy.dialects.sqlite as sqlite
+import sqlalchemy.ext.associationproxy as associationproxy
 import werkzeug.security as security
 from flask_login import UserMixin
 from flask_sqlalchemy import SQLAlchemy
 
 import feedi.parsers as parsers
-from feedi import scraping
+from feedi import autocomplete, cache, compression, dialects, events, scraping
 
 # TODO consider adding explicit support for url columns
 
-db = SQLAlchemy()
+
+# name of the flask-sqlalchemy bind used for the read-only connections
+READER_BIND = "reader"
+
+
+class RoutingSession(flask_sqlalchemy.session.Session):
+    """
+    Sends the queries of a session to the read-only connection pool, if one is configured,
+    until the session writes something. From then on, and until the end of its transaction,
+    the session uses the writer pool so it can read back its own changes.
+    """
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if bind is None and READER_BIND in self._db.engines:
+            if self._flushing or isinstance(clause, sa.sql.expression.UpdateBase):
+                self.info["writing"] = True
+            if not self.info.get("writing"):
+                return self._db.engines[READER_BIND]
+
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+
+@sa.event.listens_for(RoutingSession, "after_transaction_end")
+def after_transaction_end(session, transaction):
+    if transaction.parent is None:
+        session.info.pop("writing", None)
+
+
+db = SQLAlchemy(session_options={"class_": RoutingSession})
 
 
 logger = logging.getLogger(__name__)
 
 
-def init_db(app):
-    db.init_app(app)
+def pool_sizes(config):
+    """
+    Return how many db connections each pool of the process can open: the writer and readers of the
+    web app, and the single pool of the tasks app, which needs one connection per concurrent task.
+    """
+    reader_pool_size = config["DB_READER_POOL_SIZE"]
+    return {
+        "writer": 1 if reader_pool_size else 5,
+        READER_BIND: reader_pool_size,
+        "tasks": round(config["HUEY_POOL_SIZE"] * 1.1),
+    }
 
-    @sa.event.listens_for(db.engine, "connect")
-    def on_connect(dbapi_connection, _connection_record):
-        # use WAL mode to prevent locks on concurrent writes
-        dbapi_connection.execute("pragma journal_mode=WAL")
 
-        # experiment to try holding most of the db in memory
-        # this should be ~200mb
-        dbapi_connection.execute("pragma cache_size = -195313")
+def init_db(app, tasks=False):
+    """
+    Configure the db engines of the app. Both the web app and the tasks app (`tasks=True`) are
+    created in the same process, so they share a single memory budget.
+    """
+    pools = pool_sizes(app.config)
+    engine_options = app.config.setdefault("SQLALCHEMY_ENGINE_OPTIONS", {})
+    engine_options.setdefault("max_overflow", 0)
+    if tasks:
+        # most tasks write, and they hold their connection while waiting on the network,
+        # so a small pool of readers would only throttle them
+        engine_options.setdefault("pool_size", pools["tasks"])
+    else:
+        engine_options.setdefault("pool_size", pools["writer"])
+        if pools[READER_BIND]:
+            app.config["SQLALCHEMY_BINDS"] = {
+                READER_BIND: {"url": app.config["SQLALCHEMY_DATABASE_URI"], "pool_size": pools[READER_BIND]}
+            }
+
+    # the sqlite page cache is allocated per connection, so the budget is split between all the
+    # connections the process can open, in the pools of both apps. The mmap isn't: all the connections
+    # map the same region of the db file, so its pages are shared
+    cache_kb = max(app.config["DB_CACHE_MB"] * 1024 // sum(pools.values()), 1)
+    mmap_size = app.config["DB_MMAP_MB"] * 1024 * 1024
 
-        app.logger.debug("Created DB connection")
+    db.init_app(app)
+    dialect = dialects.get(db.engine)
+    entry_card_cache.max_bytes = app.config["ENTRY_CARD_CACHE_MB"] * 1024 * 1024
+
+    def on_connect(dbapi_connection, _connection_record, role):
+        dialect.on_connect(
+            dbapi_connection,
+            read_only=role == READER_BIND,
+            cache_kb=cache_kb,
+            mmap_size=mmap_size,
+            load_dictionary=CompressionDictionary.load,
+        )
+        app.logger.debug("Created %s DB connection with a %sKB page cache", role, cache_kb)
+
+    for bind_key, engine in db.engines.items():
+        role = bind_key or "writer"
+        sa.event.listen(engine, "connect", functools.partial(on_connect, role=role))
 
     @sa.event.listens_for(User.__table__, "after_create")
     def after_create(user_table, connection, **kw):
@@ -44,13 +119,75 @@ def init_db(app):
 
     db.create_all()
 
+    for dictionary in db.session.scalars(db.select(CompressionDictionary)):
+        compression.register_dictionary(dictionary.id, dictionary.data)
+    db.session.remove()
+
+
+def db_stats():
+    "Return the size in bytes of the database, its write-ahead log and its unused space."
+    with db.engine.connect() as connection:
+        return dialects.get(db.engine).stats(connection)
+
+
+def connection_stats():
+    """
+    Return the state of each of the db connection pools, along with the memory the
+    page cache of each connection is allowed to use.
+    """
+    stats = []
+    for bind_key, engine in db.engines.items():
+        with engine.connect() as connection:
+            memory = dialects.get(engine).connection_memory(connection)
+
+        # the pools are configured not to overflow
+        max_connections = engine.pool.size()
+        stats.append(
+            {
+                "role": bind_key or "writer",
+                "pool": engine.pool.status(),
+                "cache_per_connection": memory["cache"],
+                "cache_total": memory["cache"] * max_connections,
+                "mmap": memory["mmap"],
+            }
+        )
+    return stats
+
+
+class CompressedString(sa.types.TypeDecorator):
+    """
+    A string column that is transparently compressed at rest, see the feedi.compression module.
+    Rows written before the column was compressed are read as is. Backends that compress
+    large values on their own store it as plain text instead (see `dialects.PostgreSQL`).
+    """
+
+    impl = sa.LargeBinary
+    cache_ok = True
+
+    def __init__(self, use_dictionary=False):
+        super().__init__()
+        self.use_dictionary = use_dictionary
+
+    def load_dialect_impl(self, dialect):
+        if dialects.DIALECTS[dialect.name].compress_values:
+            return sa.LargeBinary()
+        return sa.Text()
+
+    def process_bind_param(self, value, dialect):
+        if value is None or not dialects.DIALECTS[dialect.name].compress_values:
+            return value
+        return compression.compress(value, use_dictionary=self.use_dictionary)
+
+    def process_result_value(self, value, _dialect):
+        return compression.decompress(value, CompressionDictionary.load)
+
 
 class User(UserMixin, db.Model):
     __tablename__ = "users"
 
     id = sa.Column(sa.Integer, primary_key=True)
     email = db.Column(db.String(100), unique=True, nullable=False)
-    password = db.Column(db.String(100), nullable=False)
+    password = db.Column(db.String(255), nullable=False)
 
     kindle_email = db.Column(db.String(100))
 
@@ -65,9 +202,26 @@ class User(UserMixin, db.Model):
         return security.check_password_hash(self.password, raw_password)
 
 
+FeedMeta = collections.namedtuple("FeedMeta", ["id", "name", "icon_url", "folder", "url"])
+
+# changes to feeds in other processes aren't seen, so don't keep values for too long
+feed_meta_cache = cache.ExpiringDict(ttl_seconds=5 * 60)
+
+# the names of the feeds and folders of each user, see `Feed.autocomplete_index`
+autocomplete_index_cache = cache.ExpiringDict(ttl_seconds=5 * 60)
+
+# the rendered html of entries in lists, see filters.entry_card. Sized from the app config by `init_db`
+entry_card_cache = cache.LRUCache(max_bytes=0, sizeof=lambda cards: sum(sys.getsizeof(html) for html in cards.values()))
+
+# counts of the entries opened in this process and how many of them had their content ready,
+# reported and reset by the content prefetch task
+prefetch_stats = collections.Counter()
+
+
 class Feed(db.Model):
     """
-    Represents an external source of items, e.g. an RSS feed or social app account.
+    A user's subscription to an external source of items (e.g. an RSS feed or social app account),
+    with its own name, folder and settings. The source and its entries are shared, see `Source`.
     """
 
     __tablename__ = "feeds"
@@ -77,6 +231,8 @@ class Feed(db.Model):
 
     id = sa.Column(sa.Integer, primary_key=True)
     user_id = sa.orm.mapped_column(sa.ForeignKey("users.id"), nullable=False, index=True)
+    source_id = sa.orm.mapped_column(sa.ForeignKey("sources.id"), nullable=False, index=True)
+    source = sa.orm.relationship("Source", back_populates="feeds")
 
     url = sa.Column(sa.String)
     type = sa.Column(sa.String, nullable=False)
@@ -88,15 +244,17 @@ class Feed(db.Model):
     updated = sa.Column(
         sa.TIMESTAMP, nullable=False, default=datetime.datetime.utcnow, onupdate=datetime.datetime.utcnow
     )
-    last_fetch = sa.Column(sa.TIMESTAMP)
+    last_fetch = sa.Column(sa.TIMESTAMP, doc="The last time the feed got the entries of its source.")
 
     bucket = sa.Column(sa.Integer, doc="TODO")
 
     entries = sa.orm.relationship("Entry", back_populates="feed", cascade="all, delete-orphan", lazy="dynamic")
-    raw_data = sa.orm.deferred(sa.Column(sa.String, doc="The original feed data received from the feed, as JSON"))
+    raw_data = associationproxy.association_proxy("source", "raw_data")
 
     folder = sa.Column(sa.String, index=True)
 
+    delete_after_days = sa.Column(sa.Integer, doc="Overrides the DELETE_AFTER_DAYS setting for this feed's entries.")
+
     __mapper_args__ = {"polymorphic_on": type, "polymorphic_identity": "feed"}
 
     __table_args__ = (sa.UniqueConstraint("user_id", "name"), sa.Index("ix_name_user", "user_id", "name"))
@@ -104,6 +262,43 @@ class Feed(db.Model):
     def __repr__(self):
         return f"<{self.__class__.__name__} {self.name}>"
 
+    @sa.orm.validates("delete_after_days")
+    def validate_delete_after_days(self, _key, value):
+        # values may come as strings from the feed form
+        return int(value) if value else None
+
+    @classmethod
+    def autocomplete_index(cls, user_id):
+        """
+        Return the index of the names of the user's feeds and folders used to match the search input.
+        It's queried on every keystroke so it's cached in memory until the feeds change.
+        """
+        index = autocomplete_index_cache.get(user_id)
+        if index is None:
+            feeds = db.session.execute(db.select(cls.id, cls.name, cls.folder).filter_by(user_id=user_id)).all()
+            folders = sorted({folder for (_id, _name, folder) in feeds if folder})
+            index = autocomplete.Index([(feed_id, name) for (feed_id, name, _folder) in feeds], folders)
+            autocomplete_index_cache.set(user_id, index)
+        return index
+
+    @classmethod
+    def get_meta(cls, feed_id):
+        """
+        Return the id, name, icon, folder and url of the given feed, or None if it doesn't exist.
+        This data is rendered along most entries so it's cached in memory.
+        """
+        feed_id = int(feed_id)
+        meta = feed_meta_cache.get(feed_id)
+        if meta is None:
+            row = db.session.execute(
+                db.select(cls.id, cls.name, cls.icon_url, cls.folder, cls.url).filter(cls.id == feed_id)
+            ).first()
+            if not row:
+                return None
+            meta = FeedMeta(*row)
+            feed_meta_cache.set(feed_id, meta)
+        return meta
+
     @classmethod
     def resolve(cls, type):
         "Return the Feed model subclass for the given feed type."
@@ -126,48 +321,50 @@ class Feed(db.Model):
 
     def sync_with_remote(self, force=False):
         """
-        Fetch this feed entries from its remote sources, saving them to the database and updating
-        the feed metadata. The specific fetching logic is implemented by subclasses through the
-        `fetch_entry_data` method.
+        Sync the source of this feed, which saves its new entries to this feed and to the other feeds
+        subscribed to it, see `Source.sync`.
         If `force` is True, syncing will be attempted even if it was already done recently.
         """
-        from flask import current_app as app
+        self.source.sync(force=force)
 
-        utcnow = datetime.datetime.utcnow()
+    def accepts(self, _values):
+        "Return whether the given entry values of the feed source should be added to this feed."
+        return True
 
-        cooldown_minutes = datetime.timedelta(minutes=app.config["SKIP_RECENTLY_UPDATED_MINUTES"])
-        if not force and self.last_fetch and (utcnow - self.last_fetch < cooldown_minutes):
-            app.logger.info("skipping recently synced feed %s", self.name)
-            return
-
-        entries = self.fetch_entry_data(force)
-        self.last_fetch = utcnow
-
-        for values in entries:
-            # upsert to handle already seen entries.
-            # updated time set explicitly as defaults are not honored in manual on_conflict_do_update
-            values["updated"] = utcnow
-            values["feed_id"] = self.id
-            values["user_id"] = self.user_id
-
-            update_values = dict(**values)
-            update_values.pop("sort_date", None)
-            db.session.execute(
-                sqlite.insert(Entry)
-                .values(**values)
-                .on_conflict_do_update(("feed_id", "remote_id"), set_=update_values)
+    def add_entries(self, source_entry_ids, utcnow):
+        """
+        Add the given entries of the feed source to this feed, or mark them as updated if they were
+        already in it. Return the amount of added entries.
+        """
+        inserted = 0
+        if source_entry_ids:
+            # the per-user rows copy the sort date of the source entry so the timeline can be read off an index
+            columns = ("user_id", "feed_id", "source_entry_id", "sort_date", "created", "updated")
+            rows = db.select(
+                sa.literal(self.user_id),
+                sa.literal(self.id),
+                SourceEntry.id,
+                SourceEntry.sort_date,
+                sa.literal(utcnow, sa.TIMESTAMP),
+                sa.literal(utcnow, sa.TIMESTAMP),
+            ).where(SourceEntry.id.in_(source_entry_ids))
+            stmt = (
+                dialects.get(db.engine)
+                .insert(Entry)
+                .from_select(columns, rows)
+                .on_conflict_do_update(index_elements=("feed_id", "source_entry_id"), set_={"updated": utcnow})
+                .returning(Entry.id, Entry.created)
             )
+            for entry_id, created in db.session.execute(stmt):
+                # the creation date is only set on insert, after this sync started
+                if created >= utcnow:
+                    inserted += 1
+                entry_card_cache.pop(entry_id)
 
         # Calculate and store bucket after entries are inserted
         self.bucket = self._calculate_bucket_from_db()
-        db.session.commit()
-
-    def fetch_entry_data(self, _force=False):
-        """
-        To be implemented by subclasses, this should contact the remote feed source, parse any new entries
-        and return a list of values for each one.
-        """
-        raise NotImplementedError
+        Entry.update_ranking(feed=self)
+        return inserted
 
     def _calculate_bucket_from_db(self):
         """
@@ -209,16 +406,65 @@ class Feed(db.Model):
             return 5  # more
 
     def load_icon(self):
-        ""
-        self.icon_url = scraping.get_favicon(self.url)
+        """
+        Set the icon of the feed to the cached one of its site, without contacting it.
+        Return True if the icon needs to be discovered again (see `tasks.refresh_icons`),
+        because the site isn't cached yet or its icon is older than FAVICON_TTL_DAYS.
+        """
+        site_url = self.icon_site_url()
+        if not site_url:
+            return True
 
+        favicon = Favicon.lookup(site_url)
+        if favicon and favicon.icon_url:
+            self.icon_url = favicon.icon_url
+        return favicon is None or favicon.is_stale()
+
+    def icon_site_url(self):
+        "Return the url of the site the feed icon is taken from, or None if it's not known yet."
+        return self.url
+
+    def fetch_icon(self):
+        "Contact the feed site to discover its icon. Return its url or None."
+        return scraping.get_favicon(self.url)
+
+
+@sa.event.listens_for(Feed, "after_insert", propagate=True)
+@sa.event.listens_for(Feed, "after_update", propagate=True)
+@sa.event.listens_for(Feed, "after_delete", propagate=True)
+def invalidate_feed_meta(_mapper, _connection, feed):
+    feed_meta_cache.pop(feed.id)
+
+
+@sa.event.listens_for(Feed, "after_insert", propagate=True)
+@sa.event.listens_for(Feed, "after_delete", propagate=True)
+def invalidate_autocomplete_index(_mapper, _connection, feed):
+    autocomplete_index_cache.pop(feed.user_id)
 
-class RssFeed(Feed):
-    etag = sa.Column(sa.String, doc="Etag received on last parsed rss, to prevent re-fetching if it hasn't changed.")
-    modified_header = sa.Column(
-        sa.String, doc="Last-modified received on last parsed rss, to prevent re-fetching if it hasn't changed."
-    )
 
+@sa.event.listens_for(RoutingSession, "before_flush")
+def subscribe_feeds(session, _flush_context, _instances):
+    "Link the new feeds, and those which url changed, to the source of their url."
+    for feed in [*session.new, *session.dirty]:
+        if not isinstance(feed, Feed):
+            continue
+
+        url_changed = feed not in session.new and sa.inspect(feed).attrs.url.history.has_changes()
+        if url_changed or (feed.source_id is None and feed.source is None):
+            feed.source = Source.lookup(feed.type, feed.url)
+            # so it gets the current entries of the new source on its next sync
+            feed.last_fetch = None
+
+
+@sa.event.listens_for(Feed, "after_update", propagate=True)
+def update_autocomplete_index(_mapper, _connection, feed):
+    # most updates come from syncs, which don't touch the indexed columns
+    attrs = sa.inspect(feed).attrs
+    if attrs.name.history.has_changes() or attrs.folder.history.has_changes():
+        autocomplete_index_cache.pop(feed.user_id)
+
+
+class RssFeed(Feed):
     filters = sa.Column(
         sa.String,
         doc="a comma separated list of conditions that feed source entries need to meet \
@@ -234,20 +480,176 @@ class RssFeed(Feed):
     def to_valuelist(self):
         return [self.type, self.name, self.url, self.folder, self.filters]
 
+    def accepts(self, values):
+        return not self.filters or parsers.rss.matches(json.loads(values["raw_data"]), self.filters)
+
+    def feed_data(self):
+        "Return the feed metadata received on the last sync of its source, if any."
+        return self.source.feed_data() if self.source else {}
+
+    def icon_site_url(self):
+        # prefer the link inside the rss, the feed may be served from another domain than its site.
+        # that link is only known after the first sync, so until then the feed domain isn't assumed
+        if not self.raw_data:
+            return None
+        return self.feed_data().get("link") or self.url
+
+    def fetch_icon(self):
+        return parsers.rss.fetch_icon(self.url, self.feed_data() or None)
+
+
+class CustomFeed(Feed):
+    __mapper_args__ = {"polymorphic_identity": Feed.TYPE_CUSTOM}
+
+
+class Source(db.Model):
+    """
+    A remote source of entries, e.g. an RSS feed url. Sources are shared by all the feeds that subscribe
+    to them, so each one is fetched and parsed once per sync regardless of how many users follow it.
+    """
+
+    __tablename__ = "sources"
+
+    id = sa.Column(sa.Integer, primary_key=True)
+    type = sa.Column(sa.String, nullable=False)
+    url = sa.Column(sa.String, nullable=False, doc="The address it's fetched from, as entered by its first feed.")
+    normalized_url = sa.Column(sa.String, nullable=False, doc="The url used to tell whether feeds share the source.")
+
+    created = sa.Column(sa.TIMESTAMP, nullable=False, default=datetime.datetime.utcnow)
+    last_fetch = sa.Column(sa.TIMESTAMP)
+
+    raw_data = sa.orm.deferred(
+        sa.Column(CompressedString(use_dictionary=True), doc="The original feed data received from the source, as JSON")
+    )
+
+    feeds = sa.orm.relationship("Feed", back_populates="source", order_by="Feed.id")
+
+    __mapper_args__ = {"polymorphic_on": type, "polymorphic_identity": "source"}
+
+    __table_args__ = (sa.UniqueConstraint("type", "normalized_url"),)
+
+    def __repr__(self):
+        return f"<{self.__class__.__name__} {self.url}>"
+
+    @classmethod
+    def resolve(cls, type):
+        "Return the Source model subclass for the given feed type."
+        subclasses = {
+            Feed.TYPE_RSS: RssSource,
+            Feed.TYPE_CUSTOM: CustomSource,
+        }
+
+        subcls = subclasses.get(type)
+        if not subcls:
+            raise ValueError(f"unknown type {type}")
+        return subcls
+
+    @classmethod
+    def lookup(cls, type, url):
+        "Return the source of the given type for the given url, creating it if it's not known yet."
+        normalized_url = scraping.normalize_url(url)
+        stmt = (
+            dialects.get(db.engine)
+            .insert(cls)
+            .values(type=type, url=url, normalized_url=normalized_url, created=datetime.datetime.utcnow())
+            .on_conflict_do_nothing(index_elements=("type", "normalized_url"))
+        )
+        db.session.execute(stmt)
+        return db.session.scalar(db.select(cls).filter_by(type=type, normalized_url=normalized_url))
+
+    def sync(self, force=False):
+        """
+        Fetch the entries of this source from remote, saving them once and adding them to each of the feeds
+        subscribed to it (those that match the feed filters). The specific fetching logic is implemented by
+        subclasses through the `fetch_entry_data` method.
+        If `force` is True, syncing will be attempted even if it was already done recently.
+        """
+        from flask import current_app as app
+
+        utcnow = datetime.datetime.utcnow()
+
+        # new subscriptions get all the current entries of the source, as a feed of their own would on its first sync
+        if any(feed.last_fetch is None for feed in self.feeds):
+            force = True
+
+        cooldown_minutes = datetime.timedelta(minutes=app.config["SKIP_RECENTLY_UPDATED_MINUTES"])
+        if not force and self.last_fetch and (utcnow - self.last_fetch < cooldown_minutes):
+            app.logger.info("skipping recently synced source %s", self.url)
+            return
+
+        feed_entries = collections.defaultdict(list)
+        for values in self.fetch_entry_data(force):
+            feeds = [feed for feed in self.feeds if feed.accepts(values)]
+            if feeds:
+                source_entry_id = self.save_entry(dict(values), utcnow)
+                for feed in feeds:
+                    feed_entries[feed].append(source_entry_id)
+        self.last_fetch = utcnow
+
+        new_entries = collections.Counter()
+        for feed in self.feeds:
+            feed.last_fetch = utcnow
+            new_entries[feed.user_id] += feed.add_entries(feed_entries[feed], utcnow)
+
+        db.session.commit()
+
+        for user_id, count in new_entries.items():
+            if count:
+                events.publish(user_id, "new-entries", count=count)
+
+    def save_entry(self, values, utcnow):
+        "Insert the given entry values to this source, or update them if it was already seen. Return its id."
+        # the large columns are stored separately, see EntryBlob
+        blob_values = {field: values.pop(field, None) for field in EntryBlob.FIELDS}
+
+        # upsert to handle already seen entries.
+        # updated time set explicitly as defaults are not honored in manual on_conflict_do_update
+        values["updated"] = utcnow
+        values["source_id"] = self.id
+        if "content_short" in values:
+            values.update(SourceEntry.preview_values(values["content_short"]))
+
+        update_values = dict(**values)
+        update_values.pop("sort_date", None)
+        source_entry_id = db.session.scalar(
+            dialects.get(db.engine)
+            .insert(SourceEntry)
+            .values(**values)
+            .on_conflict_do_update(index_elements=("source_id", "remote_id"), set_=update_values)
+            .returning(SourceEntry.id)
+        )
+        EntryBlob.upsert(source_entry_id, **blob_values)
+        return source_entry_id
+
+    def fetch_entry_data(self, _force=False):
+        """
+        To be implemented by subclasses, this should contact the remote source, parse any new entries
+        and return a list of values for each one.
+        """
+        raise NotImplementedError
+
+
+class RssSource(Source):
+    etag = sa.Column(sa.String, doc="Etag received on last parsed rss, to prevent re-fetching if it hasn't changed.")
+    modified_header = sa.Column(
+        sa.String, doc="Last-modified received on last parsed rss, to prevent re-fetching if it hasn't changed."
+    )
+
+    __mapper_args__ = {"polymorphic_identity": Feed.TYPE_RSS}
+
     def fetch_entry_data(self, force=False):
         from flask import current_app as app
 
         skip_older_than = datetime.datetime.utcnow() - datetime.timedelta(days=app.config["RSS_SKIP_OLDER_THAN_DAYS"])
 
         feed_data, entries, etag, modified = parsers.rss.fetch(
-            self.name,
+            self.url,
             self.url,
             skip_older_than,
             app.config["RSS_MINIMUM_ENTRY_AMOUNT"],
             None if force else self.last_fetch,
             None if force else self.etag,
             None if force else self.modified_header,
-            self.filters,
         )
 
         self.etag = etag
@@ -256,29 +658,62 @@ class RssFeed(Feed):
             self.raw_data = json.dumps(feed_data)
         return entries
 
-    def load_icon(self):
-        self.icon_url = parsers.rss.fetch_icon(self.url)
+    def feed_data(self):
+        "Return the feed metadata received on the last sync, if any."
+        return json.loads(self.raw_data) if self.raw_data else {}
 
 
-class CustomFeed(Feed):
+class CustomSource(Source):
     __mapper_args__ = {"polymorphic_identity": Feed.TYPE_CUSTOM}
 
     def fetch_entry_data(self, _force=False):
-        return parsers.custom.fetch(self.name, self.url)
+        return parsers.custom.fetch(self.url, self.url)
+
+
+class EntryDisplayMixin:
+    "Attributes derived from the entry columns to decide how to render it."
+
+    __slots__ = ()
+
+    @property
+    def is_external_link(self):
+        """
+        Return True if the target url seems to be external to the source, e.g. a link submitted to a link aggregator,
+        or a preview url. This is handy to decide whether a new RSS feed may be discoverable from an entry. This will
+        incorrectly return True if the rss feed is hosted at a different domain than the actual source site it exposes.
+        """
+        if not self.target_url:
+            return False
+
+        if not self.feed:
+            return True
+
+        if not self.feed.url:
+            return False
 
+        return urllib.parse.urlparse(self.target_url).netloc != urllib.parse.urlparse(self.feed.url)
 
-class Entry(db.Model):
+    @property
+    def has_distinct_user(self):
+        """
+        Returns True if this entry has a recognizable author, particularly that
+        it has an avatar and a name that can be displayed instead of a generic feed icon.
+        """
+        return self.avatar_url and (self.display_name or self.username)
+
+
+class SourceEntry(db.Model):
     """
-    Represents an item within a Feed.
+    Represents an item within a Source. Its content is stored once and shared by the feeds that subscribe
+    to the source, while the state of each user on it (e.g. viewed, favorited) is kept in their `Entry`.
+    Standalone entries (e.g. an article added by url) have a source entry of their own, without source.
     """
 
-    __tablename__ = "entries"
+    __tablename__ = "source_entries"
 
     id = sa.Column(sa.Integer, primary_key=True)
 
-    feed_id = sa.orm.mapped_column(sa.ForeignKey("feeds.id"))
-    user_id = sa.orm.mapped_column(sa.ForeignKey("users.id"), nullable=False, index=True)
-    feed = sa.orm.relationship("Feed", back_populates="entries")
+    source_id = sa.orm.mapped_column(sa.ForeignKey("sources.id"))
     remote_id = sa.Column(sa.String, nullable=False, doc="The identifier of this entry in its source feed.")
 
     title = sa.Column(sa.String, index=True)
@@ -294,9 +729,17 @@ class Entry(db.Model):
     For article entries, it would be an excerpt of the full article content.",
     )
 
-    content_full = sa.orm.deferred(
-        sa.Column(sa.String, doc="The content to be displayed in the reader, e.g. the cleaned full article HTML.")
+    # derived from content_short when it's set, so list views don't need to parse its html on every render
+    content_preview = sa.Column(sa.String, doc="The truncated and cleaned up content_short html, as displayed.")
+    content_excerpt = sa.Column(sa.String, doc="The beginning of the content_short text, for the compact view.")
+
+    blob = sa.orm.relationship("EntryBlob", uselist=False, cascade="all, delete-orphan")
+
+    # the large columns are kept in a separate table and only loaded when accessed through these proxies
+    content_full = associationproxy.association_proxy(
+        "blob", "content_full", creator=lambda value: EntryBlob(content_full=value)
     )
+    raw_data = associationproxy.association_proxy("blob", "raw_data", creator=lambda value: EntryBlob(raw_data=value))
 
     target_url = sa.Column(
         sa.String,
@@ -306,6 +749,7 @@ class Entry(db.Model):
 
     content_url = sa.Column(
         sa.String,
+        index=True,
         doc="The URL to fetch the full entry content from, for reading locally. \
         NULL is interpreted as the entry cannot be read locally.",
     )
@@ -318,7 +762,7 @@ class Entry(db.Model):
 
     media_url = sa.Column(sa.String, doc="URL of a media attachement or preview.")
 
-    created = sa.Column(sa.TIMESTAMP, nullable=False, default=datetime.datetime.utcnow, index=True)
+    created = sa.Column(sa.TIMESTAMP, nullable=False, default=datetime.datetime.utcnow)
     updated = sa.Column(
         sa.TIMESTAMP, nullable=False, default=datetime.datetime.utcnow, onupdate=datetime.datetime.utcnow
     )
@@ -332,65 +776,186 @@ class Entry(db.Model):
     sort_date = sa.Column(
         sa.TIMESTAMP,
         nullable=False,
-        index=True,
         doc="The date that determines an entry's chronological order. \
                           Typically the updated date informed at the source.",
     )
 
+    header = sa.Column(sa.String, doc="an html line to put above the title, such as 'user reblogged'.")
+
+    icon_url = sa.Column(
+        sa.String, doc="To be used for standalone entry avatars or as a fallback when the feed has no icon."
+    )
+
+    __table_args__ = (sa.UniqueConstraint("source_id", "remote_id"),)
+
+    def __repr__(self):
+        return f"<SourceEntry {self.source_id}/{self.remote_id}>"
+
+    @staticmethod
+    def preview_values(content_short):
+        "Return the values of the preview columns derived from the given short content."
+        return {
+            "content_preview": scraping.preview_html(content_short),
+            "content_excerpt": scraping.preview_text(content_short),
+        }
+
+    @sa.orm.validates("content_short")
+    def validate_content_short(self, _key, value):
+        # entries saved by source syncs get their previews in `Source.save_entry` instead
+        for column, preview in self.preview_values(value).items():
+            setattr(self, column, preview)
+        return value
+
+    @classmethod
+    def delete_orphans(cls, source_entry_ids):
+        "Delete the given source entries that were removed from all feeds, along with their blobs."
+        orphan_ids = db.session.scalars(
+            db.select(cls.id).where(
+                cls.id.in_(source_entry_ids),
+                ~db.select(Entry.id).where(Entry.source_entry_id == cls.id).exists(),
+            )
+        ).all()
+        db.session.execute(db.delete(EntryBlob).where(EntryBlob.source_entry_id.in_(orphan_ids)))
+        db.session.execute(db.delete(cls).where(cls.id.in_(orphan_ids)))
+
+
+def source_entry_proxy(column):
+    "Expose a column of the source entry of an Entry as if it were its own."
+    return associationproxy.association_proxy("source_entry", column)
+
+
+class Entry(EntryDisplayMixin, db.Model):
+    """
+    Represents an item within a Feed: the state of a user on an entry of the feed source.
+    """
+
+    __tablename__ = "entries"
+
+    id = sa.Column(sa.Integer, primary_key=True)
+
+    feed_id = sa.orm.mapped_column(sa.ForeignKey("feeds.id"))
+    user_id = sa.orm.mapped_column(sa.ForeignKey("users.id"), nullable=False, index=True)
+    feed = sa.orm.relationship("Feed", back_populates="entries")
+
+    source_entry_id = sa.orm.mapped_column(sa.ForeignKey("source_entries.id"), nullable=False, index=True)
+    source_entry = sa.orm.relationship("SourceEntry", lazy="joined", innerjoin=True)
+
+    # the content is shared with the other feeds of the source, and read through these proxies
+    remote_id = source_entry_proxy("remote_id")
+    title = source_entry_proxy("title")
+    username = source_entry_proxy("username")
+    user_url = source_entry_proxy("user_url")
+    display_name = source_entry_proxy("display_name")
+    avatar_url = source_entry_proxy("avatar_url")
+    content_short = source_entry_proxy("content_short")
+    content_preview = source_entry_proxy("content_preview")
+    content_excerpt = source_entry_proxy("content_excerpt")
+    content_full = source_entry_proxy("content_full")
+    raw_data = source_entry_proxy("raw_data")
+    target_url = source_entry_proxy("target_url")
+    content_url = source_entry_proxy("content_url")
+    comments_url = source_entry_proxy("comments_url")
+    media_url = source_entry_proxy("media_url")
+    display_date = source_entry_proxy("display_date")
+    header = source_entry_proxy("header")
+    icon_url = source_entry_proxy("icon_url")
+
+    created = sa.Column(sa.TIMESTAMP, nullable=False, default=datetime.datetime.utcnow, index=True)
+    updated = sa.Column(
+        sa.TIMESTAMP, nullable=False, default=datetime.datetime.utcnow, onupdate=datetime.datetime.utcnow
+    )
+
+    sort_date = sa.Column(
+        sa.TIMESTAMP,
+        nullable=False,
+        index=True,
+        doc="A copy of the source entry sort date, which determines an entry's chronological order.",
+    )
+
     viewed = sa.Column(sa.TIMESTAMP, index=True)
     favorited = sa.Column(sa.TIMESTAMP, index=True)
     pinned = sa.Column(sa.TIMESTAMP, index=True)
 
     sent_to_kindle = sa.Column(sa.TIMESTAMP, index=True)
 
-    raw_data = sa.orm.deferred(sa.Column(sa.String, doc="The original entry data received from the feed, as JSON"))
-
-    header = sa.Column(sa.String, doc="an html line to put above the title, such as 'user reblogged'.")
+    # the columns below denormalize the home timeline ordering so it can be read straight off an index
+    # instead of sorting a computed expression over a join. See `update_ranking`.
+    recent = sa.Column(
+        sa.Boolean,
+        nullable=False,
+        default=False,
+        doc="Whether the sort_date falls within the last RECENCY_HOURS.",
+    )
+    bucket = sa.Column(sa.Integer, doc="A copy of the feed frequency bucket, NULL for standalone entries.")
 
-    icon_url = sa.Column(
-        sa.String, doc="To be used for standalone entry avatars or as a fallback when the feed has no icon."
+    __table_args__ = (
+        sa.UniqueConstraint("feed_id", "source_entry_id"),
+        sa.Index("entry_sort_ts", sort_date.desc()),
+        sa.Index("entry_rank", user_id, recent.desc(), bucket, sort_date.desc()),
+        sa.Index("entry_recent_sort", recent, sort_date),
     )
 
-    __table_args__ = (sa.UniqueConstraint("feed_id", "remote_id"), sa.Index("entry_sort_ts", sort_date.desc()))
+    # entries newer than this are shown before the rest of the timeline, regardless of their feed bucket
+    RECENCY_HOURS = 24
 
     @classmethod
-    def from_url(cls, user_id, url):
-        "Load an entry for the given article url if it exists, otherwise create a new one."
-        entry = db.session.scalar(db.select(cls).filter_by(content_url=url, user_id=user_id))
+    def from_url(cls, user_id, url, html=None):
+        """
+        Load an entry for the given article url if it exists, otherwise create a new one.
+        If the html of the article page is passed, it's used instead of fetching the url.
+        """
+        entry = cls.find_by_url(user_id, url)
 
         if not entry:
-            values = parsers.html.fetch(url)
-            entry = cls(user_id=user_id, **values)
+            # reuse the icon of the site if known, otherwise cache the one found in the page
+            favicon = Favicon.lookup(url)
+            icon_url = favicon and favicon.icon_url
+            if html is None:
+                values = parsers.html.fetch(url, icon_url=icon_url)
+            else:
+                values = parsers.html.parse(url, html, icon_url=icon_url)
+            if not favicon and values["icon_url"]:
+                Favicon.store(url, values["icon_url"])
+
+            # standalone entries are sorted as of their creation date
+            source_entry = SourceEntry(**values)
+            entry = cls(user_id=user_id, source_entry=source_entry, sort_date=source_entry.sort_date, recent=True)
         return entry
 
+    @classmethod
+    def find_by_url(cls, user_id, url):
+        "Return the entry of the given user for the given article url, or None."
+        return db.session.scalar(
+            db.select(cls)
+            .join(cls.source_entry)
+            .options(sa.orm.contains_eager(cls.source_entry))
+            .filter(cls.user_id == user_id, SourceEntry.content_url == url)
+            .limit(1)
+        )
+
     def __repr__(self):
         return f"<Entry {self.feed_id}/{self.remote_id}>"
 
-    @property
-    def is_external_link(self):
-        """
-        Return True if the target url seems to be external to the source, e.g. a link submitted to a link aggregator,
-        or a preview url. This is handy to decide whether a new RSS feed may be discoverable from an entry. This will
-        incorrectly return True if the rss feed is hosted at a different domain than the actual source site it exposes.
-        """
-        if not self.target_url:
-            return False
-
-        if not self.feed:
-            return True
-
-        if not self.feed.url:
-            return False
-
-        return urllib.parse.urlparse(self.target_url).netloc != urllib.parse.urlparse(self.feed.url)
+    def stored_article(self):
+        "Return the stored content of the entry in the format of `scraping.extract`, or None if it wasn't fetched."
+        if not self.content_full:
+            return None
+
+        return {
+            "title": self.title,
+            "byline": self.username,
+            "siteName": self.feed and self.feed.name,
+            "publishedTime": self.display_date and self.display_date.isoformat(),
+            "content": self.content_full,
+        }
 
-    @property
-    def has_distinct_user(self):
-        """
-        Returns True if this entry has a recognizable author, particularly that
-        it has an avatar and a name that can be displayed instead of a generic feed icon.
-        """
-        return self.avatar_url and (self.display_name or self.username)
+    def has_content(self):
+        "Return whether the article content of the entry is stored, without loading it."
+        return db.session.scalar(
+            db.select(
+                db.exists().where(EntryBlob.source_entry_id == self.source_entry_id, EntryBlob.content_full.isnot(None))
+            )
+        )
 
     def fetch_content(self):
         if self.content_url and not self.content_full:
@@ -399,6 +964,83 @@ class Entry(db.Model):
             except Exception as e:
                 logger.debug("failed to fetch content %s", e)
 
+    @classmethod
+    def recency_boundary(cls):
+        return datetime.datetime.utcnow() - datetime.timedelta(hours=cls.RECENCY_HOURS)
+
+    @classmethod
+    def update_ranking(cls, feed=None):
+        """
+        Bring the denormalized ranking columns (`recent` and `bucket`) up to date.
+        If a feed is given, only its entries are considered and their bucket is synced with the feed's.
+        Otherwise, only the entries that crossed the recency boundary since the last update are touched,
+        which is cheap enough to run periodically.
+        Returns the amount of updated rows.
+        """
+        boundary = cls.recency_boundary()
+        is_recent = sa.case((cls.sort_date >= boundary, True), else_=False)
+
+        if feed:
+            # only write the rows that actually changed
+            stmt = (
+                db.update(cls)
+                .where(
+                    cls.feed_id == feed.id,
+                    cls.bucket.is_distinct_from(feed.bucket) | (cls.recent != is_recent),
+                )
+                .values(bucket=feed.bucket, recent=is_recent)
+            )
+            return db.session.execute(stmt, execution_options={"synchronize_session": False}).rowcount
+
+        # both updates are range scans over the entry_recent_sort index
+        expired = db.update(cls).where(cls.recent.is_(True), cls.sort_date < boundary).values(recent=False)
+        fresh = db.update(cls).where(cls.recent.is_(False), cls.sort_date >= boundary).values(recent=True)
+        opts = {"synchronize_session": False}
+        return sum(db.session.execute(stmt, execution_options=opts).rowcount for stmt in (expired, fresh))
+
+    @classmethod
+    def select_expired(cls, delete_after_days, minimum):
+        """
+        Return a query for the ids of the entries that are older than `delete_after_days` (or their feed's
+        override of it), except for the `minimum` most recent ones of each feed.
+        Favorited, pinned and sent to kindle entries are never included.
+        """
+        utcnow = datetime.datetime.utcnow()
+        older_than = sa.literal(utcnow - datetime.timedelta(days=delete_after_days), sa.TIMESTAMP)
+
+        overrides = db.session.scalars(
+            db.select(Feed.delete_after_days).filter(Feed.delete_after_days.isnot(None)).distinct()
+        )
+        whens = [(Feed.delete_after_days == days, utcnow - datetime.timedelta(days=days)) for days in overrides]
+        if whens:
+            older_than = sa.case(*whens, else_=older_than)
+
+        # the position is computed over all the feed entries, so protected ones still count towards the minimum
+        position = sa.func.row_number().over(partition_by=cls.feed_id, order_by=cls.sort_date.desc())
+        ranked = (
+            db.select(
+                cls.id,
+                cls.feed_id,
+                cls.sort_date,
+                cls.favorited,
+                cls.pinned,
+                cls.sent_to_kindle,
+                position.label("position"),
+                older_than.label("older_than"),
+            )
+            .join(Feed, isouter=True)
+            .subquery()
+        )
+
+        return db.select(ranked.c.id).where(
+            ranked.c.sort_date < ranked.c.older_than,
+            # standalone entries (without feed) have no minimum
+            (ranked.c.position > minimum) | ranked.c.feed_id.is_(None),
+            ranked.c.favorited.is_(None),
+            ranked.c.pinned.is_(None),
+            ranked.c.sent_to_kindle.is_(None),
+        )
+
     @classmethod
     def _filtered_query(
         cls,
@@ -412,12 +1054,23 @@ class Entry(db.Model):
         older_than=None,
         newer_than=None,
         text=None,
+        rows=False,
     ):
         """
-        Return a base Entry query applying any combination of filters.
+        Return a base Entry query applying any combination of filters. The query is joined with the
+        source entries, so their columns can be filtered on too.
+        If `rows` is True, the query selects the columns of `EntryRow` instead of Entry objects.
         """
 
-        query = db.select(cls).filter_by(user_id=user_id)
+        if rows:
+            query = EntryRow.select().filter(cls.user_id == user_id)
+        else:
+            query = (
+                db.select(cls)
+                .join(cls.source_entry)
+                .options(sa.orm.contains_eager(cls.source_entry))
+                .filter(cls.user_id == user_id)
+            )
 
         if older_than:
             query = query.filter(cls.created < older_than)
@@ -444,33 +1097,95 @@ class Entry(db.Model):
             query = query.filter(cls.feed.has(folder=folder))
 
         if username:
-            query = query.filter(cls.username == username)
+            query = query.filter(SourceEntry.username == username)
 
         if text:
             # Poor Text Search™
+            dialect = dialects.get(db.engine)
             query = query.filter(
-                cls.title.contains(text)
-                | cls.username.contains(text)
-                | cls.content_short.contains(text)
-                | cls.content_full.contains(text)
+                dialect.contains(SourceEntry.title, text)
+                | dialect.contains(SourceEntry.username, text)
+                | dialect.contains(SourceEntry.content_short, text)
+                | SourceEntry.blob.has(dialect.contains(EntryBlob.content_full, text, compressed=True))
             )
 
         return query
 
+    @classmethod
+    def last_change(cls, user_id):
+        """
+        Return values that change whenever the entry lists of the given user may: the last time
+        one of their feeds (e.g. on sync) or entries (e.g. when pinned) was updated, and their feed
+        and entry counts (e.g. after a purge).
+        """
+        return tuple(
+            db.session.execute(
+                db.select(
+                    db.select(sa.func.max(Feed.updated)).filter(Feed.user_id == user_id).scalar_subquery(),
+                    db.select(sa.func.count(Feed.id)).filter(Feed.user_id == user_id).scalar_subquery(),
+                    db.select(sa.func.max(cls.updated)).filter(cls.user_id == user_id).scalar_subquery(),
+                    db.select(sa.func.count(cls.id)).filter(cls.user_id == user_id).scalar_subquery(),
+                )
+            ).one()
+        )
+
+    @classmethod
+    def select_prefetch(cls, budget, depth):
+        """
+        Return the (source entry id, content_url) of up to `budget` entries without full content that users
+        are likely to open next, best candidates first. Pinned entries go first, then the top `depth` unseen
+        entries of each user's home timeline, slightly favoring those of the least frequent feeds.
+        The content is shared, so entries followed by several users are only returned once.
+        """
+        missing_content = (
+            SourceEntry.content_url.isnot(None),
+            ~SourceEntry.blob.has(EntryBlob.content_full.isnot(None)),
+        )
+        start_at = datetime.datetime.utcnow()
+
+        priorities = {}
+        for user_id in db.session.scalars(db.select(User.id)):
+            pinned = (
+                db.select(cls.source_entry_id, SourceEntry.content_url)
+                .join(cls.source_entry)
+                .filter(cls.user_id == user_id, cls.pinned.isnot(None), *missing_content)
+                .order_by(cls.pinned.desc())
+                .limit(depth)
+            )
+            for source_entry_id, content_url in db.session.execute(pinned):
+                priorities[source_entry_id] = (-1, content_url)
+
+            timeline = (
+                cls.filter_by(user_id, start_at, rows=True, hide_seen=True)
+                .filter(*missing_content)
+                .with_only_columns(cls.source_entry_id, SourceEntry.content_url, cls.bucket)
+                .limit(depth)
+            )
+            for position, (source_entry_id, content_url, bucket) in enumerate(db.session.execute(timeline)):
+                priorities.setdefault(source_entry_id, (position + (bucket or 0), content_url))
+
+        best = heapq.nsmallest(budget, priorities.items(), key=lambda item: item[1][0])
+        return [(source_entry_id, content_url) for source_entry_id, (_priority, content_url) in best]
+
     @classmethod
     def select_pinned(cls, user_id, **kwargs):
-        "Return the full list of pinned entries considering the optional filters."
-        query = cls._filtered_query(user_id, **kwargs).filter(cls.pinned.is_not(None)).order_by(cls.pinned.desc())
+        "Return the full list of pinned entries considering the optional filters, as `EntryRow`s."
+        query = (
+            cls._filtered_query(user_id, rows=True, **kwargs)
+            .filter(cls.pinned.is_not(None))
+            .order_by(cls.pinned.desc())
+        )
 
-        return db.session.scalars(query).all()
+        return EntryRow.fetch(query)
 
     @classmethod
-    def filter_by(cls, user_id, start_at, **filters):
+    def filter_by(cls, user_id, start_at, rows=False, **filters):
         """
         Return a query to filter entries added after the `start_at` datetime,
         sorted according to the specified `ordering` criteria and with optional filters.
+        If `rows` is True, the query selects the columns of `EntryRow` instead of Entry objects.
         """
-        query = cls._filtered_query(user_id, older_than=start_at, **filters)
+        query = cls._filtered_query(user_id, older_than=start_at, rows=rows, **filters)
 
         if filters.get("favorited"):
             return query.order_by(cls.favorited.desc())
@@ -483,10 +1198,303 @@ class Entry(db.Model):
         # exhaust last n hours of all ranks before moving to older stuff
         # if smaller delta, more chances to bury infrequent posts
         # if bigger, more chances to bury recent stuff under old unseen infrequent posts
-        recency_bucket_date = datetime.datetime.utcnow() - datetime.timedelta(hours=24)
+        # The recency flag and the feed bucket are denormalized in the entries table (see `update_ranking`)
+        # so this ordering can be served by the entry_rank index.
+        return query.order_by(cls.recent.desc(), cls.bucket, cls.sort_date.desc())
+
+
+class EntryRow(EntryDisplayMixin):
+    """
+    A read-only projection of the entry columns needed to render entry lists, along with the
+    metadata of its feed. Lists only display a handful of columns, so they skip the cost of
+    building and tracking full Entry objects.
+    """
+
+    COLUMNS = (
+        "id",
+        "feed_id",
+        "title",
+        "username",
+        "user_url",
+        "display_name",
+        "avatar_url",
+        "content_short",
+        "content_preview",
+        "content_excerpt",
+        "target_url",
+        "content_url",
+        "comments_url",
+        "media_url",
+        "display_date",
+        "updated",
+        "viewed",
+        "favorited",
+        "pinned",
+        "header",
+        "icon_url",
+    )
+    FEED_COLUMNS = ("name", "icon_url", "folder", "url")
+
+    __slots__ = COLUMNS + ("feed",)
+
+    def __init__(self, row):
+        # rows are unpacked by position, which is much cheaper than by attribute name
+        for column, value in zip(self.COLUMNS, row):
+            setattr(self, column, value)
+
+        self.feed = None
+        if self.feed_id:
+            self.feed = FeedMeta(self.feed_id, *row[len(self.COLUMNS) :])
+
+    def __repr__(self):
+        return f"<EntryRow {self.id}>"
+
+    @classmethod
+    def select(cls):
+        "Return a query for the columns of the rows, to be filtered further."
+        # the state columns come from the entry of the user, the rest from the shared source entry
+        columns = [getattr(Entry if column in Entry.__table__.c else SourceEntry, column) for column in cls.COLUMNS]
+        # the full short content is only needed to render the entries whose preview wasn't computed yet
+        columns[cls.COLUMNS.index("content_short")] = sa.case(
+            (SourceEntry.content_preview.is_(None), SourceEntry.content_short)
+        ).label("content_short")
+        feed_columns = [getattr(Feed, column).label(f"feed_{column}") for column in cls.FEED_COLUMNS]
+        return (
+            db.select(*columns, *feed_columns)
+            .select_from(Entry)
+            .join(SourceEntry, Entry.source_entry_id == SourceEntry.id)
+            .outerjoin(Feed, Entry.feed_id == Feed.id)
+        )
+
+    @classmethod
+    def fetch(cls, query):
+        "Run the given query and return its results as a list of rows."
+        return [cls(row) for row in db.session.execute(query)]
+
+
+class EntryBlob(db.Model):
+    """
+    Holds the large columns of a SourceEntry, which are only needed when an entry is viewed or debugged.
+    Keeping them out of the entries table means that timeline scans, index lookups and purges don't
+    need to walk pages bloated with full article HTML and JSON dumps.
+    """
+
+    __tablename__ = "entry_blobs"
+
+    FIELDS = ("content_full", "raw_data")
+
+    source_entry_id = sa.orm.mapped_column(sa.ForeignKey("source_entries.id", ondelete="CASCADE"), primary_key=True)
+
+    content_full = sa.Column(
+        CompressedString, doc="The content to be displayed in the reader, e.g. the cleaned full article HTML."
+    )
+    raw_data = sa.Column(
+        CompressedString(use_dictionary=True), doc="The original entry data received from the feed, as JSON"
+    )
+
+    @classmethod
+    def upsert(cls, source_entry_id, content_full=None, raw_data=None):
+        """
+        Insert or update the blob of the given source entry. Missing values don't overwrite existing ones
+        (e.g. a sync won't discard article content that was previously fetched).
+        """
+        if content_full is None and raw_data is None:
+            return
+
+        stmt = (
+            dialects.get(db.engine)
+            .insert(cls)
+            .values(source_entry_id=source_entry_id, content_full=content_full, raw_data=raw_data)
+        )
+        stmt = stmt.on_conflict_do_update(
+            index_elements=("source_entry_id",),
+            set_={
+                "content_full": sa.func.coalesce(stmt.excluded.content_full, cls.content_full),
+                "raw_data": sa.func.coalesce(stmt.excluded.raw_data, cls.raw_data),
+            },
+        )
+        db.session.execute(stmt)
+
+    @classmethod
+    def drop_raw_data(cls, older_than):
+        """
+        Discard the raw data of entries created before the given date, removing the blobs that are left empty.
+        Returns the amount of entries that had their raw data dropped.
+        """
+        old_entries = db.select(SourceEntry.id).where(SourceEntry.created < older_than)
+        stmt = (
+            db.update(cls)
+            .where(cls.raw_data.isnot(None), cls.source_entry_id.in_(old_entries))
+            .values(raw_data=None)
+            .execution_options(synchronize_session=False)
+        )
+        dropped = db.session.execute(stmt).rowcount
+
+        db.session.execute(
+            db.delete(cls).where(
+                cls.raw_data.is_(None), cls.content_full.is_(None), cls.source_entry_id.in_(old_entries)
+            )
+        )
+        return dropped
+
+
+class CompressionDictionary(db.Model):
+    """
+    A preset dictionary used to compress small JSON documents, see feedi.compression.
+    Dictionaries are never modified or deleted, since stored values reference them by id.
+    """
 
-        # isouter = true so that if a feed with only old stuff is added, entries still show up
-        # even without having a freq rank
-        return query.join(Feed, isouter=True).order_by(
-            (cls.sort_date >= recency_bucket_date).desc(), Feed.bucket, cls.sort_date.desc()
+    __tablename__ = "compression_dictionaries"
+
+    id = sa.Column(sa.Integer, primary_key=True)
+    data = sa.Column(sa.LargeBinary, nullable=False)
+    created = sa.Column(sa.TIMESTAMP, nullable=False, default=datetime.datetime.utcnow)
+
+    @classmethod
+    def load(cls, dictionary_id):
+        """
+        Fetch the data of the given dictionary. This is used while other results are being processed,
+        so it goes straight to the connection the session is reading from, skipping the autoflush.
+        Checking out another connection could wait forever if the session holds the only writer one.
+        """
+        query = db.select(cls.data).where(cls.id == dictionary_id)
+        return db.session.connection(bind_arguments={"clause": query}).scalar(query)
+
+    @classmethod
+    def train(cls, sample_size):
+        "Build a new dictionary from a sample of the most recent entries raw data and register it."
+        samples = db.session.scalars(
+            db.select(EntryBlob.raw_data)
+            .where(EntryBlob.raw_data.isnot(None))
+            .order_by(EntryBlob.source_entry_id.desc())
+            .limit(sample_size)
+        ).all()
+
+        dictionary = cls(data=compression.train_dictionary(samples))
+        db.session.add(dictionary)
+        db.session.commit()
+        compression.register_dictionary(dictionary.id, dictionary.data)
+        return dictionary
+
+
+class KindleDelivery(db.Model):
+    """
+    An article queued to be sent to the kindle of a user, see `tasks.deliver_to_kindle`.
+    Failed deliveries are retried with an increasing delay until they run out of attempts.
+    """
+
+    __tablename__ = "kindle_deliveries"
+
+    QUEUED = "queued"
+    SENDING = "sending"
+    SENT = "sent"
+    FAILED = "failed"
+
+    MAX_ATTEMPTS = 5
+    # deliveries claimed by a task aren't picked by other ones for this long
+    CLAIM_MINUTES = 10
+
+    id = sa.Column(sa.Integer, primary_key=True)
+    user_id = sa.orm.mapped_column(sa.ForeignKey("users.id", ondelete="CASCADE"), nullable=False, index=True)
+    url = sa.Column(sa.String, nullable=False)
+    status = sa.Column(sa.String, nullable=False, default=QUEUED)
+    attempts = sa.Column(sa.Integer, nullable=False, default=0)
+    error = sa.Column(sa.String, doc="The reason of the last failed attempt.")
+    created = sa.Column(sa.TIMESTAMP, nullable=False, default=datetime.datetime.utcnow)
+    next_attempt = sa.Column(
+        sa.TIMESTAMP, nullable=False, default=datetime.datetime.utcnow, doc="Queued deliveries aren't sent before this."
+    )
+
+    __table_args__ = (sa.Index("kindle_delivery_due", status, next_attempt),)
+
+    @classmethod
+    def claim_due(cls):
+        """
+        Return the queued deliveries that are due, grouped by user, and postpone their next attempt
+        so concurrent runs don't send them too. The claim expires if the process dies while sending them.
+        """
+        now = datetime.datetime.utcnow()
+        claimed_ids = db.session.scalars(
+            db.update(cls)
+            .where(cls.status == cls.QUEUED, cls.next_attempt <= now)
+            .values(next_attempt=now + datetime.timedelta(minutes=cls.CLAIM_MINUTES))
+            .returning(cls.id)
+        ).all()
+        db.session.commit()
+
+        deliveries = collections.defaultdict(list)
+        for delivery in db.session.scalars(db.select(cls).filter(cls.id.in_(claimed_ids)).order_by(cls.id)):
+            deliveries[delivery.user_id].append(delivery)
+        return deliveries
+
+    def mark_sending(self):
+        """
+        Record that the article is about to be emailed. Sending deliveries aren't claimed again,
+        so if saving the result fails after the email went out, it isn't sent twice.
+        """
+        self.status = self.SENDING
+
+    def mark_sent(self):
+        self.status = self.SENT
+        self.error = None
+
+    def mark_failed(self, error, permanent=False):
+        """
+        Record the failed attempt and schedule a retry, doubling the delay of the previous one.
+        Deliveries that failed because of a `permanent` error, or that ran out of attempts, aren't retried.
+        """
+        self.attempts += 1
+        self.error = str(error) or type(error).__name__
+        if permanent or self.attempts >= self.MAX_ATTEMPTS:
+            self.status = self.FAILED
+        else:
+            self.status = self.QUEUED
+            self.next_attempt = datetime.datetime.utcnow() + datetime.timedelta(minutes=2**self.attempts)
+
+
+class Favicon(db.Model):
+    """
+    The icon of a site, cached by domain so it's discovered once for all the feeds and entries
+    that come from it. Icons are discovered again after FAVICON_TTL_DAYS, see `tasks.refresh_icons`.
+    """
+
+    __tablename__ = "favicons"
+
+    domain = sa.Column(sa.String, primary_key=True)
+    icon_url = sa.Column(sa.String, doc="NULL if the site doesn't seem to have an icon.")
+    updated = sa.Column(sa.TIMESTAMP, nullable=False, default=datetime.datetime.utcnow)
+
+    @staticmethod
+    def domain_of(url):
+        return urllib.parse.urlparse(url).netloc.lower().removeprefix("www.")
+
+    @classmethod
+    def lookup(cls, url):
+        "Return the cached icon of the site of the given url, or None."
+        return db.session.get(cls, cls.domain_of(url))
+
+    @classmethod
+    def store(cls, url, icon_url):
+        """
+        Cache the icon of the site of the given url. A missing icon doesn't overwrite a
+        previously found one, so a site that is temporarily down doesn't lose it.
+        """
+        stmt = (
+            dialects.get(db.engine)
+            .insert(cls)
+            .values(domain=cls.domain_of(url), icon_url=icon_url, updated=datetime.datetime.utcnow())
+        )
+        stmt = stmt.on_conflict_do_update(
+            index_elements=("domain",),
+            set_={
+                "icon_url": sa.func.coalesce(stmt.excluded.icon_url, cls.icon_url),
+                "updated": stmt.excluded.updated,
+            },
         )
+        db.session.execute(stmt)
+
+    def is_stale(self):
+        from flask import current_app as app
+
+        max_age = datetime.timedelta(days=app.config["FAVICON_TTL_DAYS"])
+        return self.updated < datetime.datetime.utcnow() - max_age
@@ -8,9 +8,10 @@ from feedi import scraping
 from feedi.requests import requests
 
 
-def fetch(url):
+def fetch(url, icon_url=None):
     """
     Return the entry values for an article at the given url.
+    If the icon of the site is already known it's used instead of looking for one in the page.
     Raises ValueError if the url doesn't seem to point to an article (it doesn't have a title).
     Raises HTTPError if the request is not successful.
     """
@@ -21,7 +22,16 @@ def fetch(url):
     if not response.ok:
         raise Exception()
 
-    soup = BeautifulSoup(response.content, "lxml")
+    return parse(url, response.content, icon_url=icon_url)
+
+
+def parse(url, html, icon_url=None):
+    """
+    Return the entry values for an article at the given url from its already fetched html.
+    If the icon of the site is already known it's used instead of looking for one in the page.
+    Raises ValueError if the url doesn't seem to point to an article (it doesn't have a title).
+    """
+    soup = BeautifulSoup(html, "lxml")
     metadata = scraping.all_meta(soup)
 
     title = metadata.get("og:title", metadata.get("twitter:title", getattr(soup.title, "text")))
@@ -35,7 +45,7 @@ def fetch(url):
 
     username = metadata.get("author", "").split(",")[0]
 
-    icon_url = scraping.get_favicon(url, html=response.content)
+    icon_url = icon_url or scraping.get_favicon(url, html=html)
 
     entry = {
         "remote_id": url,
@@ -3,6 +3,7 @@ import html
 import json
 import logging
 import pprint
+import re
 import time
 import traceback
 import urllib
@@ -18,8 +19,13 @@ logger = logging.getLogger(__name__)
 
 feedparser.USER_AGENT = USER_AGENT
 
+# the embedded content of a feed item is taken as the full article if it has at least this many characters
+# of text and doesn't end like an excerpt
+FULL_CONTENT_MIN_LENGTH = 1000
+TRUNCATED_CONTENT = re.compile(r"(\.\.\.|…|\[…\]|read more|continue reading|keep reading)\W*$", re.IGNORECASE)
 
-def fetch(feed_name, url, skip_older_than, min_amount, previous_fetch, etag, modified, filters):
+
+def fetch(feed_name, url, skip_older_than, min_amount, previous_fetch, etag, modified):
     parser_cls = RSSParser
     for cls in RSSParser.__subclasses__():
         if cls.is_compatible(url):
@@ -28,20 +34,26 @@ def fetch(feed_name, url, skip_older_than, min_amount, previous_fetch, etag, mod
     # TODO these arg distribution between constructor and method probably
     # doesn't make sense anymore
     parser = parser_cls(feed_name, url, skip_older_than, min_amount)
-    return parser.fetch(previous_fetch, etag, modified, filters)
+    return parser.fetch(previous_fetch, etag, modified)
 
 
-def fetch_icon(url):
+def fetch_icon(url, feed_data=None):
+    """
+    Return the icon of the site of the feed at the given url, or None.
+    If the feed metadata was already fetched, it's used instead of parsing the feed again.
+    """
+    if feed_data is None:
+        feed_data = feedparser.parse(url)["feed"]
+
     # prefer link inside rss as the base url
-    feed = feedparser.parse(url)
-    feed_link = feed["feed"].get("link", url)
+    feed_link = feed_data.get("link", url)
     icon_url = scraping.get_favicon(feed_link)
     if icon_url:
         logger.debug("using feed icon: %s", icon_url)
         return icon_url
 
     # otherwise try to get the icon from an explicit icon link
-    icon_url = feed["feed"].get("icon", feed["feed"].get("webfeeds_icon"))
+    icon_url = feed_data.get("icon", feed_data.get("webfeeds_icon"))
     if icon_url and requests.get(icon_url).ok:
         logger.debug("using feed icon: %s", icon_url)
         return icon_url
@@ -49,6 +61,24 @@ def fetch_icon(url):
     logger.debug("no feed icon found for %s", url)
 
 
+def matches(entry, filters):
+    """
+    Check a filter expression (e.g. "author=John Doe") against the raw data of a feed entry and return whether
+    it matches the condition. The filters are set per feed, so they are checked after the source is parsed.
+    """
+    # this is very brittle and ad hoc but gets the job done
+    filters = filters.split(",")
+    for filter in filters:
+        field, value = filter.strip().split("=")
+        field = field.lower().strip()
+        value = value.lower().strip()
+
+        if value not in entry.get(field, "").lower():
+            return False
+
+    return True
+
+
 class RSSParser(CachingRequestsMixin):
     """
     A generic parser for RSS articles.
@@ -87,7 +117,7 @@ class RSSParser(CachingRequestsMixin):
         self.skip_older_than = skip_older_than
         self.min_amount = min_amount
 
-    def fetch(self, previous_fetch, etag, modified, filters=None):
+    def fetch(self, previous_fetch, etag, modified):
         """
         Requests the RSS/Atom feed and, if it has changed, parses recent entries which
         are returned as a list of value dicts.
@@ -110,7 +140,7 @@ class RSSParser(CachingRequestsMixin):
         entries = []
         for item in feed["items"]:
             try:
-                entry = self.parse(item, len(entries), previous_fetch, filters)
+                entry = self.parse(item, len(entries), previous_fetch)
                 if entry:
                     entry["raw_data"] = json.dumps(item)
                     entries.append(entry)
@@ -122,7 +152,7 @@ class RSSParser(CachingRequestsMixin):
 
         return feed["feed"], entries, etag, modified
 
-    def parse(self, item, parsed_count, previous_fetch, filters):
+    def parse(self, item, parsed_count, previous_fetch):
         """
         Pass the given raw entry data to each of the field parsers to produce an
         entry values dict.
@@ -140,10 +170,6 @@ class RSSParser(CachingRequestsMixin):
                 logger.debug("skipping old entry %s", item.get("link"))
                 return
 
-        if filters and not self._matches(item, filters):
-            logger.debug("skipping entry not matching filters %s %s", item.get("link"), filters)
-            return
-
         result = {}
         for field in self.FIELDS:
             method = "parse_" + field
@@ -156,24 +182,6 @@ class RSSParser(CachingRequestsMixin):
         # hook for subclasses to apply ad hoc skipping logic
         return False
 
-    @staticmethod
-    def _matches(entry, filters):
-        """
-        Check a filter expression (e.g. "author=John Doe") against the parsed entry and return whether
-        it matches the condition.
-        """
-        # this is very brittle and ad hoc but gets the job done
-        filters = filters.split(",")
-        for filter in filters:
-            field, value = filter.strip().split("=")
-            field = field.lower().strip()
-            value = value.lower().strip()
-
-            if value not in entry.get(field, "").lower():
-                return False
-
-        return True
-
     def parse_title(self, entry):
         return entry.get("title") or self.fetch_meta(self.parse_content_url(entry), "og:title")
 
@@ -233,9 +241,21 @@ class RSSParser(CachingRequestsMixin):
         # on the view side if necessary (so it applies regardless of the parser implementation)
         return str(soup)
 
-    def parse_content_full(self, _entry):
-        # by default skip the full content parsing since it's too expensive to do on every article
-        return None
+    def parse_content_full(self, entry):
+        """
+        Return the article html when the feed already includes it (as many WordPress, Substack or Ghost
+        feeds do), so it doesn't have to be scraped later. Feeds that only include a teaser return None.
+        """
+        contents = [content for content in entry.get("content", []) if "html" in content.get("type", "")]
+        if not contents:
+            return None
+
+        content = max(contents, key=lambda content: len(content["value"]))["value"]
+        text = BeautifulSoup(content, "lxml").get_text(" ", strip=True)
+        if len(text) < FULL_CONTENT_MIN_LENGTH or TRUNCATED_CONTENT.search(text[-100:]):
+            return None
+
+        return scraping.cleanup_content(content, self.parse_content_url(entry))
 
     def parse_media_url(self, entry):
         # first try to get it in standard feed fields
@@ -385,6 +405,10 @@ class RedditParser(RSSParser):
 
         return self.fetch_meta(link_anchor["href"], "og:description", "description")
 
+    def parse_content_full(self, _entry):
+        # the feed content is about the link, not the linked article
+        return None
+
     def parse_content_url(self, entry):
         target = self.parse_target_url(entry)
         # use old.reddit for content fetching, which I think is less likely to be blocked?
@@ -419,6 +443,10 @@ class LobstersParser(RSSParser):
             return self.fetch_meta(url, "og:description", "description")
         return entry["summary"]
 
+    def parse_content_full(self, _entry):
+        # the feed content is about the link, not the linked article
+        return None
+
     def parse_username(self, entry):
         username = super().parse_username(entry)
         return username.split("@")[0]
@@ -436,6 +464,10 @@ class HackerNewsParser(RSSParser):
             return self.fetch_meta(url, "og:description", "description")
         return entry["summary"]
 
+    def parse_content_full(self, _entry):
+        # the feed content is about the link, not the linked article
+        return None
+
 
 class GithubFeedParser(RSSParser):
     """
@@ -565,3 +597,7 @@ class IndieBlogParser(RSSParser):
         body = soup.blockquote
         body.name = "p"
         return str(body)
+
+    def parse_content_full(self, _entry):
+        # the feed content is about the link, not the linked article
+        return None
@@ -1,14 +1,17 @@
 import datetime
+import hashlib
+import hmac
+import time
 
 import flask
 import sqlalchemy as sa
 from flask import current_app as app
 from flask_login import current_user, login_required
 
-import feedi.email as email
+import feedi.autocomplete as autocompletion
 import feedi.models as models
 import feedi.tasks as tasks
-from feedi import scraping
+from feedi import events, thumbnails
 from feedi.models import db
 from feedi.parsers import rss
 
@@ -16,7 +19,7 @@ from feedi.parsers import rss
 @app.route("/users/<username>")
 @app.route("/favorites", defaults={"favorited": True}, endpoint="favorites")
 @app.route("/folder/<folder>")
-@app.route("/feeds/<feed_id>/entries")
+@app.route("/feeds/<int:feed_id>/entries")
 @app.get("/entries/kindle", defaults={"sent_to_kindle": True}, endpoint="sent_to_kindle")
 @app.route("/")
 @login_required
@@ -36,14 +39,28 @@ def entry_list(**filters):
 
     is_mixed_feed_list = filters.get("folder") or (flask.request.path == "/" and not filters.get("text"))
 
-    (entries, next_page) = fetch_entries_page(page, current_user.id, hide_seen, is_mixed_feed_list, **filters)
-
     if page:
         # if it's a paginated request, render a single page of the entry list
+        (entries, next_page) = fetch_entries_page(page, current_user.id, hide_seen, is_mixed_feed_list, **filters)
         return flask.render_template("entry_list_page.html", entries=entries, filters=filters, next_page=next_page)
 
+    # the first page only changes after a sync or some user action, so it can be revalidated cheaply.
+    # it's still rendered again every few minutes, for its relative dates and ranking to catch up
+    refresh_seconds = app.config["ENTRY_LIST_REFRESH_MINUTES"] * 60
+    etag = make_etag(
+        models.Entry.last_change(current_user.id),
+        hide_seen,
+        flask.session.get("view"),
+        int(time.time() // refresh_seconds),
+    )
+    response = not_modified(etag)
+    if response:
+        return response
+
+    (entries, next_page) = fetch_entries_page(page, current_user.id, hide_seen, is_mixed_feed_list, **filters)
+
     # render home, including feeds sidebar
-    return flask.render_template(
+    response = flask.render_template(
         "entry_list.html",
         pinned=models.Entry.select_pinned(current_user.id, **filters),
         entries=entries,
@@ -51,6 +68,43 @@ def entry_list(**filters):
         is_mixed_feed_view=is_mixed_feed_list,
         filters=filters,
     )
+    return cacheable_response(response, etag)
+
+
+@app.get("/events")
+@login_required
+def event_stream():
+    """
+    Push notifications for the current user as server-sent events,
+    e.g. a notice with the amount of new entries each time a sync saves some.
+    """
+    user_id = current_user.id
+
+    # don't hold a db connection for as long as the client stays connected
+    db.session.remove()
+
+    def stream():
+        # send something right away so the response headers go out, along with the reconnection delay in ms
+        yield f"retry: {events.KEEPALIVE_SECONDS * 1000}\n\n"
+
+        new_entries = 0
+        for message in events.listen(user_id):
+            if message is None:
+                # send something so a disconnected client is noticed
+                yield ": keepalive\n\n"
+                continue
+
+            event, data = message
+            if event == "new-entries":
+                # the notice replaces the previous one, so it shows the total since the page was loaded
+                new_entries += data["count"]
+                yield events.encode(event, flask.render_template("new_entries_notice.html", count=new_entries))
+
+    response = app.response_class(flask.stream_with_context(stream()), mimetype="text/event-stream")
+    response.headers["Cache-Control"] = "no-cache"
+    # tell proxies not to buffer the stream
+    response.headers["X-Accel-Buffering"] = "no"
+    return response
 
 
 def fetch_entries_page(page_arg, user_id, hide_seen_setting, is_mixed_feed_list, **filters):
@@ -81,21 +135,40 @@ def fetch_entries_page(page_arg, user_id, hide_seen_setting, is_mixed_feed_list,
     if is_mixed_feed_list:
         filters["newer_than"] = datetime.datetime.utcnow() - datetime.timedelta(days=14)
 
-    query = models.Entry.filter_by(user_id, start_at, **filters)
-    entry_page = db.paginate(query, per_page=app.config["ENTRY_PAGE_SIZE"], page=page_num)
-    next_page = f"{start_at.timestamp()}:{page_num + 1}" if entry_page.has_next else None
+    query = models.Entry.filter_by(user_id, start_at, rows=True, **filters)
+    per_page = app.config["ENTRY_PAGE_SIZE"]
+
+    # fetch one more than the page size to know if there's a next page, without a separate count query
+    entries = models.EntryRow.fetch(query.limit(per_page + 1).offset((page_num - 1) * per_page))
+    next_page = f"{start_at.timestamp()}:{page_num + 1}" if len(entries) > per_page else None
+    entries = entries[:per_page]
 
-    if entry_page.has_prev:
+    if page_num > 1:
         # mark the previous page as viewed. The rationale is that the user fetches
         # nth page we can assume the previous one can be marked as viewed.
-        previous_ids = [e.id for e in entry_page.prev().items]
+        previous_page = query.with_only_columns(models.Entry.id).limit(per_page).offset((page_num - 2) * per_page)
+        previous_ids = db.session.scalars(previous_page).all()
         update = (
             db.update(models.Entry).where(models.Entry.id.in_(previous_ids)).values(viewed=datetime.datetime.utcnow())
         )
         db.session.execute(update)
         db.session.commit()
 
-    return entry_page, next_page
+    return entries, next_page
+
+
+# the commands offered by the search input regardless of the user's feeds, by (lowercase) name
+AUTOCOMPLETE_COMMANDS = [
+    (label.lower(), (label, endpoint, icon))
+    for (label, endpoint, icon) in [
+        ("Home", "entry_list", "fas fa-home"),
+        ("Favorites", "favorites", "far fa-star"),
+        ("Add Feed", "feed_add", "fas fa-plus"),
+        ("Manage Feeds", "feed_list", "fas fa-edit"),
+        ("Kindle setup", "kindle_add", "fas fa-tablet-alt"),
+        ("Kindle log", "sent_to_kindle", "fas fa-tablet-alt"),
+    ]
+]
 
 
 @app.get("/autocomplete")
@@ -122,12 +195,13 @@ def autocomplete():
         if current_user.kindle_email:
             options += [("Send to Kindle", flask.url_for("send_to_kindle", url=term), "fas fa-tablet-alt", "POST")]
     else:
-        matching_feeds = db.session.execute(
-            db.select(models.Feed.id, models.Feed.name)
-            .filter(models.Feed.name.icontains(term), models.Feed.user_id == current_user.id)
-            .distinct()
-        ).all()
+        index = models.Feed.autocomplete_index(current_user.id)
+        matching_feeds = index.search_feeds(term)
         options += [(name, flask.url_for("entry_list", feed_id=id), "far fa-list-alt") for (id, name) in matching_feeds]
+        options += [
+            (folder, flask.url_for("entry_list", folder=folder), "far fa-folder")
+            for folder in index.search_folders(term)
+        ]
 
         # search is less important than quick access but more than edit
         options.append(("Search: " + term, flask.url_for("entry_list", q=term), "fas fa-search"))
@@ -137,17 +211,8 @@ def autocomplete():
         ]
 
     # TODO home and favorites should have more priority than search
-    static_options = [
-        ("Home", flask.url_for("entry_list"), "fas fa-home"),
-        ("Favorites", flask.url_for("favorites", favorited=True), "far fa-star"),
-        ("Add Feed", flask.url_for("feed_add"), "fas fa-plus"),
-        ("Manage Feeds", flask.url_for("feed_list"), "fas fa-edit"),
-        ("Kindle setup", flask.url_for("kindle_add"), "fas fa-tablet-alt"),
-        ("Kindle log", flask.url_for("sent_to_kindle"), "fas fa-tablet-alt"),
-    ]
-    for so in static_options:
-        if term.lower() in so[0].lower():
-            options.append(so)
+    for label, endpoint, icon in autocompletion.rank(term, AUTOCOMPLETE_COMMANDS):
+        options.append((label, flask.url_for(endpoint), icon))
 
     return flask.render_template("autocomplete_items.html", options=options)
 
@@ -169,6 +234,7 @@ def entry_pin(id):
         entry.fetch_content()
         entry.pinned = datetime.datetime.utcnow()
     db.session.commit()
+    models.entry_card_cache.pop(entry.id)
 
     # get the new list of pinned based on filters
     filters = dict(**flask.request.args)
@@ -191,6 +257,7 @@ def entry_favorite(id):
         entry.favorited = datetime.datetime.utcnow()
 
     db.session.commit()
+    models.entry_card_cache.pop(entry.id)
     return "", 204
 
 
@@ -202,7 +269,7 @@ def feed_list():
         .filter(models.Feed.user_id == current_user.id)
         .join(models.Entry, models.Feed.id == models.Entry.feed_id, isouter=True)
         .group_by(models.Feed)
-        .order_by(sa.text("bucket desc"), sa.text("updated desc"))
+        .order_by(models.Feed.bucket.desc(), sa.text("updated desc"))
     )
 
     return flask.render_template("feeds.html", feeds=feeds)
@@ -225,7 +292,7 @@ def feed_add():
 
     folders = db.session.scalars(
         db.select(models.Feed.folder)
-        .filter(models.Feed.folder.isnot(None), models.Feed.folder.isnot(""))
+        .filter(models.Feed.folder.isnot(None), models.Feed.folder != "")
         .filter_by(user_id=current_user.id)
         .distinct()
     )
@@ -245,6 +312,10 @@ def feed_add_submit():
     if not values.get("url"):
         return flask.render_template("feed_edit.html", error_msg="url is required", **values)
 
+    error_msg = parse_delete_after_days(values)
+    if error_msg:
+        return flask.render_template("feed_edit.html", error_msg=error_msg, **values)
+
     name = values.get("name")
     feed = db.session.scalar(db.select(models.Feed).filter_by(name=name, user_id=current_user.id))
     if feed:
@@ -257,6 +328,7 @@ def feed_add_submit():
     db.session.add(feed)
     db.session.flush()
 
+    # the icon is set if the site is already cached, otherwise it's discovered in the background after syncing
     feed.load_icon()
     db.session.commit()
 
@@ -270,7 +342,31 @@ def feed_add_submit():
     return flask.redirect(flask.url_for("entry_list", feed_id=feed.id))
 
 
-@app.get("/feeds/<feed_id>")
+def parse_delete_after_days(values):
+    """
+    Convert the delete_after_days value of a feed form to a number of days, or to None when
+    it's left blank to use the default retention. Return an error message if it's not valid.
+    """
+    if "delete_after_days" not in values:
+        return None
+
+    days = values["delete_after_days"]
+    if not days:
+        values["delete_after_days"] = None
+        return None
+
+    try:
+        days = int(days)
+    except ValueError:
+        return "Delete after days must be a number"
+    if days < 1:
+        return "Delete after days must be at least 1"
+
+    values["delete_after_days"] = days
+    return None
+
+
+@app.get("/feeds/<int:feed_id>")
 @login_required
 def feed_edit(feed_id):
     feed = db.session.scalar(db.select(models.Feed).filter_by(id=feed_id, user_id=current_user.id))
@@ -279,7 +375,7 @@ def feed_edit(feed_id):
 
     folders = db.session.scalars(
         db.select(models.Feed.folder)
-        .filter(models.Feed.folder.isnot(None), models.Feed.folder.isnot(""))
+        .filter(models.Feed.folder.isnot(None), models.Feed.folder != "")
         .filter_by(user_id=current_user.id)
         .distinct()
     ).all()
@@ -287,7 +383,7 @@ def feed_edit(feed_id):
     return flask.render_template("feed_edit.html", feed=feed, folders=folders)
 
 
-@app.post("/feeds/<feed_id>")
+@app.post("/feeds/<int:feed_id>")
 @login_required
 def feed_edit_submit(feed_id):
     feed = db.session.scalar(db.select(models.Feed).filter_by(id=feed_id, user_id=current_user.id))
@@ -295,20 +391,26 @@ def feed_edit_submit(feed_id):
         flask.abort(404, "Feed not found")
 
     # FIXME fixme use proper form validations
-    values = flask.request.form
+    values = {attr: value.strip() for attr, value in flask.request.form.items()}
     if not values.get("name") or not values.get("url"):
-        return flask.render_template("feed_edit.html", error_msg="Name and url are required fields", **values)
+        return flask.render_template(
+            "feed_edit.html", feed=feed, error_msg="Name and url are required fields", **values
+        )
+
+    error_msg = parse_delete_after_days(values)
+    if error_msg:
+        return flask.render_template("feed_edit.html", feed=feed, error_msg=error_msg, **values)
 
     # setting values at the instance level instead of issuing an update on models.Feed
     # so we don't need to explicitly inspect the feed to figure out its subclass
     for attr, value in values.items():
-        setattr(feed, attr, value.strip())
+        setattr(feed, attr, value)
     db.session.commit()
 
     return flask.redirect(flask.url_for("feed_list"))
 
 
-@app.delete("/feeds/<feed_id>")
+@app.delete("/feeds/<int:feed_id>")
 @login_required
 def feed_delete(feed_id):
     "Remove a feed and its entries from the database. Pinned and favorited entries are preserved."
@@ -323,17 +425,25 @@ def feed_delete(feed_id):
         .where(
             (models.Entry.feed_id == feed.id) & (models.Entry.favorited.isnot(None) | models.Entry.pinned.isnot(None))
         )
-        .values(feed_id=None)
+        .values(feed_id=None, bucket=None)
     )
     db.session.execute(update)
 
+    # bulk delete the rest of the entries, instead of loading them one by one through the relationship
+    # cascades, along with their content if no other feed has them
+    source_entry_ids = db.session.scalars(
+        db.select(models.Entry.source_entry_id).where(models.Entry.feed_id == feed.id)
+    ).all()
+    db.session.execute(db.delete(models.Entry).where(models.Entry.feed_id == feed.id))
+    models.SourceEntry.delete_orphans(source_entry_ids)
+
     # running from db.session ensures cascading effects
     db.session.delete(feed)
     db.session.commit()
     return "", 204
 
 
-@app.post("/feeds/<feed_id>/entries")
+@app.post("/feeds/<int:feed_id>/entries")
 @login_required
 def feed_sync(feed_id):
     "Force sync the given feed and redirect to the entry list for it."
@@ -387,6 +497,17 @@ def entry_view(id):
     if entry.user_id != current_user.id:
         flask.abort(404)
 
+    def entry_etag():
+        return make_etag(entry.id, entry.updated, entry.has_content(), "content" in flask.request.args)
+
+    response = not_modified(entry_etag())
+    if response:
+        return response
+
+    if "content" not in flask.request.args and not entry.viewed:
+        models.prefetch_stats["opened"] += 1
+        models.prefetch_stats["prefetched"] += entry.has_content()
+
     # When requested through htmx (ajax), this page loads layout first, then the content
     # on a separate request. The reason for this is that article fetching is slow, and we
     # don't want the view entry action to freeze the UI without loading indication.
@@ -396,7 +517,8 @@ def entry_view(id):
 
     if "HX-Request" in flask.request.headers and "content" not in flask.request.args and not entry.content_full:
         # if ajax/htmx just load the empty UI and load content asynchronously
-        return flask.render_template("entry_content.html", entry=entry, content=None)
+        response = flask.render_template("entry_content.html", entry=entry, content=None)
+        return cacheable_response(response, entry_etag())
     else:
         if not entry.content_url and not entry.target_url:
             # this view can't work if no entry or content url
@@ -411,7 +533,8 @@ def entry_view(id):
         if entry.content_full:
             entry.viewed = entry.viewed or datetime.datetime.utcnow()
             db.session.commit()
-            return flask.render_template("entry_content.html", entry=entry, content=entry.content_full)
+            response = flask.render_template("entry_content.html", entry=entry, content=entry.content_full)
+            return cacheable_response(response, entry_etag())
 
         return redirect_response(entry.target_url)
 
@@ -429,48 +552,70 @@ def redirect_response(url):
         return flask.redirect(url)
 
 
+def make_etag(*state):
+    """
+    Return an etag for a response of the current user that only changes along with the given values,
+    e.g. the update dates of the rendered rows.
+    """
+    state = (current_user.id, bool(current_user.kindle_email), "HX-Request" in flask.request.headers, *state)
+    return hashlib.sha1(repr(state).encode()).hexdigest()
+
+
+def not_modified(etag):
+    "Return a 304 response if the client already has the version of the response with the given etag."
+    if flask.request.if_none_match.contains_weak(etag):
+        return cacheable_response(app.response_class(status=304), etag)
+    return None
+
+
+def cacheable_response(response, etag):
+    """
+    Tag the response so clients can ask if it changed on their next request.
+    The responses are user specific and always need to be revalidated. Some pages have a
+    partial version for htmx requests, so (browser) caches need to tell them apart.
+    """
+    response = flask.make_response(response)
+    response.set_etag(etag, weak=True)
+    response.headers["Cache-Control"] = "private, no-cache"
+    response.vary.add("HX-Request")
+    return response
+
+
 @app.post("/entries/kindle")
 @login_required
 def send_to_kindle():
     """
-    If the user has a registered device, send the article in the given URL through kindle.
+    If the user has a registered device, queue the article in the given URL to be sent through kindle.
     """
     if not current_user.kindle_email:
         return "", 204
 
-    url = flask.request.args["url"]
-
-    article = scraping.extract(url)
-    attach_data = scraping.package_epub(url, article)
-    email.send(current_user.kindle_email, attach_data, filename=article["title"])
-
-    # save as read entry if not already, to keep track of sent to kindle urls
-    entry = models.Entry.from_url(current_user.id, url)
-    entry.sent_to_kindle = datetime.datetime.now()
-    entry.viewed = entry.viewed or datetime.datetime.utcnow()
-    entry.content_full = article["content"]
-
-    db.session.add(entry)
+    # the article is packaged and sent in the background, so the page doesn't wait for it
+    db.session.add(models.KindleDelivery(user_id=current_user.id, url=flask.request.args["url"]))
     db.session.commit()
+    tasks.deliver_to_kindle()
 
     return "", 204
 
 
-@app.route("/feeds/<feed_id>/debug")
+@app.route("/feeds/<int:feed_id>/debug")
 @login_required
 def raw_feed(feed_id):
     """
     Shows a JSON dump of the feed data as received from the source.
     """
-    feed = db.session.scalar(
-        db.select(models.Feed)
-        .filter_by(id=feed_id, user_id=current_user.id)
-        .options(sa.orm.undefer(models.Feed.raw_data))
-    )
+    feed = db.session.scalar(db.select(models.Feed).filter_by(id=feed_id, user_id=current_user.id))
     if not feed:
         flask.abort(404, "Feed not found")
 
-    return app.response_class(response=feed.raw_data, status=200, mimetype="application/json")
+    # the raw data is only loaded if the client doesn't have it already
+    etag = make_etag(feed.id, feed.updated)
+    response = not_modified(etag)
+    if response:
+        return response
+
+    response = app.response_class(response=feed.raw_data, status=200, mimetype="application/json")
+    return cacheable_response(response, etag)
 
 
 @app.route("/entries/<int:id>/debug")
@@ -479,12 +624,42 @@ def raw_entry(id):
     """
     Shows a JSON dump of the entry data as received from the source.
     """
-    entry = db.get_or_404(models.Entry, id, options=[sa.orm.undefer(models.Entry.raw_data)])
+    entry = db.get_or_404(models.Entry, id)
 
     if entry.user_id != current_user.id:
         flask.abort(404)
 
-    return app.response_class(response=entry.raw_data, status=200, mimetype="application/json")
+    # the raw data is only loaded if the client doesn't have it already
+    etag = make_etag(entry.id, entry.updated)
+    response = not_modified(etag)
+    if response:
+        return response
+
+    response = app.response_class(response=entry.raw_data, status=200, mimetype="application/json")
+    return cacheable_response(response, etag)
+
+
+@app.get("/img")
+@login_required
+def image_proxy():
+    """
+    Serve a resized copy of a remote image, see the `thumbnail` template filter.
+    """
+    url = flask.request.args.get("url", "")
+    width = flask.request.args.get("w", type=int)
+    if width not in thumbnails.WIDTHS or not hmac.compare_digest(
+        flask.request.args.get("sig", ""), thumbnails.signature(url, width)
+    ):
+        flask.abort(404)
+
+    path = thumbnails.get(url, width)
+    if not path:
+        # let the browser try with the original
+        return flask.redirect(url)
+
+    response = flask.send_file(path, mimetype="image/webp", max_age=thumbnails.MAX_AGE_SECONDS)
+    response.cache_control.immutable = True
+    return response
 
 
 # TODO improve this views to accept only valid values
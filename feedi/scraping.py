@@ -1,6 +1,9 @@
+import hashlib
 import io
 import json
 import logging
+import os
+import re
 import subprocess
 import urllib
 import zipfile
@@ -9,15 +12,26 @@ import dateparser
 
 # use internal module to access unexported .tags function
 import favicon.favicon as favicon
+import gevent
+import gevent.pool
+import gevent.queue
+import lxml.etree
+import lxml.html
 from bs4 import BeautifulSoup
 from PIL import Image
 from requests.exceptions import RequestException
 
+from feedi import cache
 from feedi.requests import TIMEOUT_SLOWER, USER_AGENT, requests
 
 logger = logging.getLogger(__name__)
 
 
+# concurrent requests for the same url (e.g. from syncs of different feeds of the same site, or an entry
+# being opened while it's prefetched) wait for the one in progress instead of making their own
+remote_fetches = cache.SingleFlight(timeout_seconds=60)
+
+
 def get_favicon(url, html=None):
     "Return the best favicon from the given url, or None."
     url_parts = urllib.parse.urlparse(url)
@@ -25,7 +39,9 @@ def get_favicon(url, html=None):
 
     try:
         if not html:
-            favicons = favicon.get(url, headers={"User-Agent": USER_AGENT}, timeout=2)
+            favicons = remote_fetches.call(
+                ("favicon", url), favicon.get, url, headers={"User-Agent": USER_AGENT}, timeout=2
+            )
         else:
             favicons = sorted(favicon.tags(url, html), key=lambda i: i.width + i.height, reverse=True)
     except Exception:
@@ -61,7 +77,7 @@ class CachingRequestsMixin:
             return self.response_cache[url]
 
         logger.debug("making request %s", url)
-        content = requests.get(url).content
+        content = remote_fetches.call(("page", url), lambda: requests.get(url).content)
         self.response_cache[url] = content
         return content
 
@@ -96,24 +112,311 @@ def make_absolute(url, path):
     return path
 
 
+def normalize_url(url):
+    """
+    Return a canonical version of the given url, so different spellings of the same address
+    can be compared: lowercase scheme and host, no default port, fragment or trailing slash.
+    """
+    if not url:
+        return url
+
+    parts = urllib.parse.urlsplit(url.strip())
+    scheme = parts.scheme.lower()
+    netloc = parts.netloc.lower()
+    if (scheme, netloc.rpartition(":")[2]) in [("http", "80"), ("https", "443")]:
+        netloc = netloc.rpartition(":")[0]
+    path = parts.path.rstrip("/")
+    return urllib.parse.urlunsplit((scheme, netloc, path, parts.query, ""))
+
+
+# the amount of characters of the short content that are displayed in entry previews and excerpts
+PREVIEW_LENGTH = 500
+EXCERPT_LENGTH = 100
+
+
+def preview_html(html):
+    """
+    Return the given html as displayed in entry previews: truncated to around PREVIEW_LENGTH
+    characters and without the html and body tags added by the parser.
+    """
+    if not html:
+        return None
+
+    # poor man's line truncating: reduce the amount of characters and let bs4 fix the html
+    if len(html) > PREVIEW_LENGTH:
+        html = html[:PREVIEW_LENGTH] + "…"
+    soup = BeautifulSoup(html, "lxml")
+
+    if soup.html:
+        if soup.html.body:
+            soup.html.body.unwrap()
+        soup.html.unwrap()
+
+    return str(soup)
+
+
+def preview_text(html):
+    """
+    Return the text of the given html, as displayed in entry excerpts. It's cut one character past
+    EXCERPT_LENGTH, so the caller can tell whether it needs to be truncated further.
+    """
+    if not html:
+        return None
+    return BeautifulSoup(html, "lxml").text[: EXCERPT_LENGTH + 1]
+
+
+class ExtractorCrashed(Exception):
+    pass
+
+
+class ArticleExtractor:
+    """
+    A long-lived node process running extract_article.js in server mode, which parses one
+    article at a time. See the script for the protocol.
+    """
+
+    COMMAND = (os.path.join(os.path.dirname(__file__), "extract_article.js"), "--server")
+
+    def __init__(self, command=None):
+        self.process = subprocess.Popen(
+            list(command or self.COMMAND), stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL
+        )
+        self.memory = 0
+
+    def extract(self, url, html, timeout):
+        """
+        Return the article parsed out of the given html. Raises ExtractorCrashed if the process exits
+        or doesn't respond within `timeout` seconds, in which case it shouldn't be used again.
+        """
+        if isinstance(html, bytes):
+            html = html.decode("utf-8", errors="replace")
+
+        try:
+            with gevent.Timeout(timeout):
+                self.process.stdin.write(json.dumps({"url": url, "html": html}).encode("utf-8") + b"\n")
+                self.process.stdin.flush()
+                line = self.process.stdout.readline()
+        except gevent.Timeout:
+            raise ExtractorCrashed(f"timed out after {timeout}s parsing {url}")
+        except OSError as error:
+            raise ExtractorCrashed(f"failed to send {url}: {error}")
+
+        if not line:
+            raise ExtractorCrashed(f"exited while parsing {url}")
+
+        response = json.loads(line)
+        self.memory = response["memory"]
+        if "error" in response:
+            raise ValueError(response["error"])
+        return response["article"]
+
+    def is_alive(self):
+        return self.process.poll() is None
+
+    def close(self):
+        self.process.kill()
+        self.process.wait()
+
+
+class ExtractorPool:
+    """
+    Runs article extractions on up to `size` node processes, which are started on demand and reused
+    across requests. Extractions wait while all of them are busy.
+    Processes are replaced when they crash, time out or grow past `max_memory_mb`, e.g. because of
+    some leak while parsing a pathological page.
+    """
+
+    def __init__(self, size, timeout, max_memory_mb, command=None):
+        self.timeout = timeout
+        self.max_memory = max_memory_mb * 1024 * 1024
+        self.command = command
+
+        # each slot holds an idle extractor, or None if one needs to be started
+        self._slots = gevent.queue.LifoQueue()
+        for _ in range(size):
+            self._slots.put(None)
+
+    def extract(self, url, html):
+        extractor = self._slots.get()
+        try:
+            if extractor is None or not extractor.is_alive():
+                extractor = ArticleExtractor(self.command)
+
+            return extractor.extract(url, html, self.timeout)
+        except ExtractorCrashed:
+            logger.warning("restarting article extractor", exc_info=True)
+            extractor.close()
+            extractor = None
+            raise
+        finally:
+            if extractor and extractor.memory > self.max_memory:
+                logger.info("recycling article extractor using %sMB", extractor.memory // 1024**2)
+                extractor.close()
+                extractor = None
+            self._slots.put(extractor)
+
+    def close(self):
+        "Stop the idle extractors."
+        idle = []
+        while not self._slots.empty():
+            idle.append(self._slots.get())
+        for extractor in idle:
+            if extractor:
+                extractor.close()
+        for _ in idle:
+            self._slots.put(None)
+
+
+# sized from the app config by `configure`
+extractor_pool = None
+
+# the app config values used by this module, see `configure`
+SETTINGS = (
+    "FAST_EXTRACT_MIN_CONFIDENCE",
+    "FAST_EXTRACT_MIN_TEXT",
+    "EPUB_MAX_IMAGES",
+    "EPUB_MAX_IMAGE_BYTES",
+    "EPUB_IMAGE_SIZE",
+    "EPUB_IMAGE_DOWNLOADS",
+)
+settings = {}
+
+
+def configure(config):
+    """
+    Apply the scraping settings of the given app config. They are kept at the module level instead of
+    read from the app when used, since these functions also run in greenlets without an app context,
+    e.g. the workers of the content prefetch task.
+    """
+    global extractor_pool
+    settings.update((key, config[key]) for key in SETTINGS)
+    epub_cache.max_bytes = config["EPUB_CACHE_MB"] * 1024**2
+    if extractor_pool:
+        extractor_pool.close()
+    extractor_pool = ExtractorPool(
+        config["EXTRACTOR_POOL_SIZE"], config["EXTRACTOR_TIMEOUT_SECONDS"], config["EXTRACTOR_MAX_MEMORY_MB"]
+    )
+
+
+# elements that are never part of the article content
+NON_CONTENT_TAGS = ["script", "style", "noscript", "template", "nav", "aside", "footer", "form", "button", "dialog"]
+NON_CONTENT_CLASSES = re.compile(
+    r"comment|share|sharing|social|related|newsletter|subscribe|promo|sponsor|sidebar|breadcrumb|pagination|popup|advert",
+    re.IGNORECASE,
+)
+TEXT_TAGS = ["p", "pre", "blockquote"]
+# the elements that may hold the article content in pages with clean markup
+CANDIDATES_XPATH = "//article | //main | //*[@role='main'] | //*[@itemprop='articleBody']"
+
+
+def extract_fast(url, html):
+    """
+    Try to extract the article from the given html in-process, for pages with clean markup that
+    wrap the article content in an article, main or articleBody element.
+    Return a tuple with the article, in the same format as readability's, and a confidence score
+    between 0 and 1. The score is the share of the paragraph text of the page that is in the
+    chosen element, discounted by its link density, so e.g. listing pages with many articles or
+    elements that only hold a teaser get a low score.
+    """
+    try:
+        doc = lxml.html.document_fromstring(html, base_url=url)
+    except (lxml.etree.ParserError, ValueError):
+        return None, 0
+
+    # leave out the boilerplate from the whole page, so it doesn't count against the article text either.
+    # classes are less reliable than tags, e.g. a page wrapper could have a "has-sidebar" class
+    for element in list(doc.iter(*NON_CONTENT_TAGS)):
+        element.drop_tree()
+    for element in doc.xpath("//body//*[@class or @id]"):
+        if NON_CONTENT_CLASSES.search(f"{element.get('class', '')} {element.get('id', '')}") and not element.xpath(
+            CANDIDATES_XPATH.replace("//", ".//")
+        ):
+            element.drop_tree()
+
+    total_text = paragraph_text_length(doc)
+    if total_text < settings["FAST_EXTRACT_MIN_TEXT"]:
+        return None, 0
+
+    candidates = doc.xpath(CANDIDATES_XPATH)
+    if not candidates:
+        return None, 0
+
+    # prefer the innermost of the elements with the most text, e.g. an article inside the main element
+    scored = [(paragraph_text_length(element), len(list(element.iterancestors())), element) for element in candidates]
+    text_length, _depth, content = max(scored, key=lambda item: item[:2])
+    if text_length < settings["FAST_EXTRACT_MIN_TEXT"]:
+        return None, 0
+
+    text = content.text_content()
+    link_text = sum(len(link.text_content()) for link in content.iter("a"))
+    link_density = link_text / max(len(text), 1)
+    confidence = text_length / total_text * (1 - link_density)
+
+    if url:
+        content.make_links_absolute(url)
+
+    def meta(*names):
+        for name in names:
+            values = doc.xpath(f"//meta[@property='{name}' or @name='{name}' or @itemprop='{name}']/@content")
+            if values:
+                return values[0]
+
+    title = meta("og:title", "twitter:title") or doc.findtext(".//title") or ""
+    article = {
+        "title": title.strip(),
+        "byline": meta("author", "article:author"),
+        "siteName": meta("og:site_name"),
+        "publishedTime": meta("article:published_time", "datePublished"),
+        "excerpt": meta("og:description", "description"),
+        "content": lxml.html.tostring(content, encoding="unicode"),
+        "textContent": text,
+        "length": len(text),
+    }
+    return article, confidence
+
+
+def paragraph_text_length(element):
+    return sum(len(paragraph.text_content().strip()) for paragraph in element.iter(*TEXT_TAGS))
+
+
 # TODO this should be renamed, and maybe other things in this modules, using extract too much
 def extract(url=None, html=None):
+    """
+    Return the article content and metadata of the given html, or of the page at the given url if
+    no html is passed. The url is also used to make the article links absolute.
+    """
+    if url and not html:
+        # a page opened while it's being prefetched is downloaded and parsed once
+        return remote_fetches.call(("article", url), lambda: extract_html(url, requests.get(url).content))
+    elif not html:
+        raise ValueError("Expected either url or html")
+
+    return extract_html(url, html)
+
+
+def extract_html(url, html):
+    # Pages with clean markup are handled in-process by `extract_fast`, otherwise:
     # The mozilla/readability npm package shows better results at extracting the
     # article content than all the python libraries I've tried... even than the readabilipy
     # one, which is a wrapper of it. so resorting to running a node.js script on a subprocess
     # for parsing the article sadly this adds a dependency to node and a few npm pacakges
-    if url:
-        html = requests.get(url).content
-    elif not html:
-        raise ValueError("Expected either url or html")
+    article, confidence = extract_fast(url, html)
+    if confidence < settings["FAST_EXTRACT_MIN_CONFIDENCE"]:
+        logger.debug("not confident about extracting %s (%.2f), falling back to readability", url, confidence)
+        article = extractor_pool.extract(url, html)
 
-    r = subprocess.run(["feedi/extract_article.js", "--stdin", url], input=html, capture_output=True, check=True)
+    article["content"] = cleanup_content(article["content"])
+    return article
 
-    article = json.loads(r.stdout)
 
-    # load lazy images by replacing putting the data-src into src and stripping other attrs
-    soup = BeautifulSoup(article["content"], "lxml")
+def cleanup_content(html, url=None):
+    """
+    Adjust the given article html for display. If a url is passed, relative links and image
+    sources are made absolute using it as base.
+    """
+    soup = BeautifulSoup(html, "lxml")
 
+    # load lazy images by replacing putting the data-src into src and stripping other attrs
     LAZY_DATA_ATTRS = ["data-src", "data-lazy-src", "data-td-src-property", "data-srcset"]
     for data_attr in LAZY_DATA_ATTRS:
         for img in soup.findAll("img", attrs={data_attr: True}):
@@ -123,17 +426,32 @@ def extract(url=None, html=None):
     for iframe in soup.findAll("iframe", height=True):
         del iframe["height"]
 
-    article["content"] = str(soup)
+    if url:
+        for tag, attr in [("a", "href"), ("img", "src")]:
+            for element in soup.findAll(tag, attrs={attr: True}):
+                element[attr] = urllib.parse.urljoin(url, element[attr])
+
+    return str(soup)
 
-    return article
+
+# the EPUB files of recently packaged articles, so sending them again doesn't repeat the work
+epub_cache = cache.LRUCache(max_bytes=0, sizeof=len)
 
 
 def package_epub(url, article):
     """
-    Extract the article content, convert it to a valid html doc, localize its images, write
-    everything as a zip and add the proper EPUB metadata. Returns the zipped bytes.
+    Convert the article content to a valid html doc, localize its images, write everything
+    as a zip and add the proper EPUB metadata. Returns the zipped bytes.
     """
+    key = (url, hashlib.sha1(json.dumps(article, sort_keys=True).encode()).hexdigest())
+    epub = epub_cache.get(key)
+    if epub is None:
+        epub = build_epub(url, article)
+        epub_cache.set(key, epub)
+    return epub
+
 
+def build_epub(url, article):
     output_buffer = io.BytesIO()
     with zipfile.ZipFile(output_buffer, "w") as zip:
         # mimetype should be the first file in the container and it should be uncompressed
@@ -141,31 +459,25 @@ def package_epub(url, article):
         zip.writestr("mimetype", "application/epub+zip", compress_type=zipfile.ZIP_STORED)
 
         soup = BeautifulSoup(article["content"], "lxml")
-        for img in soup.findAll("img"):
-            img_url = img["src"]
-            img_filename = "article_files/" + img["src"].split("/")[-1].split("?")[0]
-            img_filename = img_filename.replace(".webp", ".jpg")
-
-            # update each img src url to point to the local copy of the file
-            img["src"] = img_filename
-
-            # download the image and save into the files subdir of the zip
-            try:
-                response = requests.get(img_url, timeout=TIMEOUT_SLOWER)
-                if not response.ok:
-                    continue
-            except RequestException:
-                logger.exception("error fetching image during epub generation: %s", img_url)
+        images = soup.findAll("img", src=True)
+        max_images = settings["EPUB_MAX_IMAGES"]
+        for img in images[max_images:]:
+            img.decompose()
+        images = images[:max_images]
+
+        # download the images concurrently and save them into the files subdir of the zip
+        image_urls = [urllib.parse.urljoin(url, img["src"]) for img in images]
+        image_data = gevent.pool.Pool(settings["EPUB_IMAGE_DOWNLOADS"]).map(fetch_epub_image, image_urls)
+        for index, img in enumerate(images):
+            data = image_data[index]
+            if data is None:
+                img.decompose()
                 continue
 
-            with zip.open(img_filename, "w") as dest_file:
-                if img_url.endswith(".webp"):
-                    # when the image is of a known unsupported format, convert it to jpg first
-                    jpg_img = Image.open(io.BytesIO(response.content)).convert("RGB")
-                    jpg_img.save(dest_file, "JPEG")
-                else:
-                    # else write as is
-                    dest_file.write(response.content)
+            # update each img src url to point to the local copy of the file
+            img_filename = f"article_files/{index}.jpg"
+            img.attrs = {"src": img_filename, "alt": img.get("alt", "")}
+            zip.writestr(img_filename, data, compress_type=zipfile.ZIP_STORED)
 
         zip.writestr("article.html", str(soup), compress_type=zipfile.ZIP_DEFLATED)
 
@@ -211,3 +523,62 @@ def package_epub(url, article):
         )
 
     return output_buffer.getvalue()
+
+
+def fetch_epub_image(url):
+    "Download the image at the given url and convert it for e-readers, returning None if it can't be included."
+    return convert_image(url, download_image(url, settings["EPUB_MAX_IMAGE_BYTES"]), convert_epub_image)
+
+
+def download_image(url, max_bytes):
+    "Return the content of the image at the given url, or None if it fails or is larger than `max_bytes`."
+    try:
+        with requests.get(url, timeout=TIMEOUT_SLOWER, stream=True) as response:
+            if not response.ok or int(response.headers.get("Content-Length") or 0) > max_bytes:
+                return None
+
+            content = bytearray()
+            for chunk in response.iter_content(64 * 1024):
+                content += chunk
+                if len(content) > max_bytes:
+                    logger.debug("skipping large image: %s", url)
+                    return None
+            return bytes(content)
+    except RequestException:
+        logger.exception("error fetching image: %s", url)
+        return None
+
+
+def convert_image(url, data, convert, *args):
+    "Return the result of the given conversion function on the image data, or None if it can't be converted."
+    if data is None:
+        return None
+
+    # decoding and resizing is cpu bound, so do it in a thread to let other greenlets run meanwhile
+    # (pillow releases the GIL while doing it). Its decoders raise all kinds of errors on malformed
+    # files (SyntaxError, struct.error, etc.), any of them just leaves this image out
+    try:
+        return gevent.get_hub().threadpool.apply(convert, (data, *args))
+    except Exception:
+        logger.debug("error converting image: %s", url, exc_info=True)
+        return None
+
+
+def convert_epub_image(data):
+    "Return the given image data as a grayscale JPEG no larger than EPUB_IMAGE_SIZE."
+    image = Image.open(io.BytesIO(data))
+    # let JPEGs be decoded at a reduced scale
+    image.draft("L", settings["EPUB_IMAGE_SIZE"])
+
+    if image.mode in ("RGBA", "LA", "P"):
+        # flatten transparent images over white, otherwise their background turns black
+        image = image.convert("RGBA")
+        background = Image.new("RGBA", image.size, "white")
+        background.alpha_composite(image)
+        image = background
+
+    image = image.convert("L")
+    image.thumbnail(settings["EPUB_IMAGE_SIZE"])
+    output = io.BytesIO()
+    image.save(output, "JPEG", quality=75, optimize=True)
+    return output.getvalue()
@@ -4,30 +4,39 @@ This module contains tasks that can be scheduled by huey and/or run as flask cli
 (The cli commands could eventually be moved to another module).
 """
 
+import collections
 import csv
 import datetime
+import time
 from functools import wraps
 
 import click
 import flask
+import gevent.pool
 import opml
 import sqlalchemy as sa
 from huey import crontab
 from huey.contrib.mini import MiniHuey
+from requests.exceptions import HTTPError
 
+import feedi.email as email
 import feedi.models as models
 import feedi.parsers as parsers
+from feedi import dialects, scraping, thumbnails
 from feedi.app import create_huey_app
 from feedi.models import db
+from feedi.requests import requests
 
 app = create_huey_app()
 huey = MiniHuey(pool_size=app.config["HUEY_POOL_SIZE"])
 
 feed_cli = flask.cli.AppGroup("feed")
 user_cli = flask.cli.AppGroup("user")
+db_cli = flask.cli.AppGroup("db")
 
 flask.current_app.cli.add_command(feed_cli)
 flask.current_app.cli.add_command(user_cli)
+flask.current_app.cli.add_command(db_cli)
 
 
 def huey_task(*huey_args):
@@ -62,11 +71,15 @@ def huey_task(*huey_args):
 @feed_cli.command("sync")
 @huey_task(crontab(minute=app.config["SYNC_FEEDS_CRON_MINUTES"]))
 def sync_all_feeds():
-    feeds = db.session.execute(db.select(models.Feed.id, models.Feed.name)).all()
+    # feeds of different users reading from the same source are synced together
+    sources = db.session.execute(
+        db.select(models.Source.id, models.Source.url).filter(models.Source.feeds.any()).order_by(models.Source.id)
+    ).all()
+    db.session.commit()
 
     tasks = []
-    for feed in feeds:
-        tasks.append((feed.name, sync_feed(feed.id, feed.name)))
+    for source_id, url in sources:
+        tasks.append((url, sync_source(source_id, url)))
 
     # wait for concurrent tasks to finish before returning
     for name, task in tasks:
@@ -82,95 +95,313 @@ def sync_feed(feed_id, _feed_name, force=False):
     db_feed = db.session.get(models.Feed, feed_id)
     db_feed.sync_with_remote(force=force)
     db.session.commit()
+    load_icons([db_feed])
+
+
+@huey_task()
+def sync_source(source_id, _url, force=False):
+    start = datetime.datetime.utcnow()
+    source = db.session.get(models.Source, source_id)
+    source.sync(force=force)
+    db.session.commit()
+    load_icons(source.feeds)
+
+    # prepare the thumbnails of the new entries, so they are ready when the timeline shows them
+    images = set()
+    new_entries = db.select(models.SourceEntry.media_url, models.SourceEntry.avatar_url).filter(
+        models.SourceEntry.source_id == source_id, models.SourceEntry.created >= start
+    )
+    for media_url, avatar_url in db.session.execute(new_entries):
+        if media_url:
+            images.update([(media_url, thumbnails.CARD_WIDTH), (media_url, thumbnails.WIDE_CARD_WIDTH)])
+        if avatar_url:
+            images.add((avatar_url, thumbnails.AVATAR_WIDTH))
+    db.session.commit()
+    thumbnails.warm(images)
+
+
+def load_icons(feeds):
+    """
+    Set the icons of the given feeds from the cache of their sites, using the metadata just
+    fetched by a sync, and queue the discovery of the ones that are missing or stale.
+    """
+    stale_ids = [feed.id for feed in feeds if feed.load_icon()]
+    db.session.commit()
+    if stale_ids:
+        refresh_icons(stale_ids)
+
+
+@huey_task()
+def refresh_icons(feed_ids):
+    """
+    Discover the icons of the sites of the given feeds and cache them by domain (see `models.Favicon`),
+    so other feeds and entries from the same sites get them without contacting them.
+    This runs in the background, so adding and syncing feeds doesn't wait on icon discovery.
+    """
+    feeds = db.session.scalars(db.select(models.Feed).filter(models.Feed.id.in_(feed_ids))).all()
+    sites = collections.defaultdict(list)
+    for feed in feeds:
+        # feeds that don't know their site yet are looked up after their next sync
+        site_url = feed.icon_site_url()
+        if site_url:
+            sites[models.Favicon.domain_of(site_url)].append(feed)
+    db.session.commit()
+
+    for site_feeds in sites.values():
+        # skip sites that were refreshed by another task since this one was queued
+        stale = site_feeds[0].load_icon()
+        db.session.commit()
+        if not stale:
+            continue
+
+        icon_url = site_feeds[0].fetch_icon()
+        models.Favicon.store(site_feeds[0].icon_site_url(), icon_url)
+        db.session.commit()
+        for feed in site_feeds:
+            feed.load_icon()
+        db.session.commit()
+
+
+@feed_cli.command("rank")
+@huey_task(crontab(minute=app.config["UPDATE_RANKING_CRON_MINUTES"]))
+def update_ranking():
+    "Flip the recency flag of the entries that crossed the home timeline recency boundary."
+    updated = models.Entry.update_ranking()
+    db.session.commit()
+    if updated:
+        app.logger.info("Updated ranking of %s entries", updated)
+
+
+# how many prefetched articles to save per transaction
+PREFETCH_COMMIT_SIZE = 10
 
 
 @feed_cli.command("prefetch")
 @huey_task(crontab(minute=app.config["CONTENT_PREFETCH_MINUTES"]))
 def content_prefetch():
-    # fetching and cleaning up the article html is too expensive to do on all articles,
-    # but we can prefetch the first few pages of the homepage to improve the experience
-    for user_id in db.session.scalars(db.select(models.User.id)):
-        start_at = datetime.datetime.utcnow()
-        query = (
-            models.Entry.filter_by(user_id, start_at, hide_seen=True)
-            .filter(models.Entry.content_full.is_(None), models.Entry.content_url.isnot(None))
-            .limit(15)
+    """
+    Fetch the article content of the entries users are likely to open next, so it's ready when they do.
+    Fetching and cleaning up the article html is too expensive to do on all of them, so this is limited to
+    a budget of the best candidates (see `models.Entry.select_prefetch`), fetched by a pool of workers.
+    """
+    start = time.monotonic()
+    candidates = models.Entry.select_prefetch(
+        app.config["CONTENT_PREFETCH_BUDGET"], app.config["CONTENT_PREFETCH_DEPTH"]
+    )
+    # don't hold the read transaction while waiting on the network
+    db.session.commit()
+
+    fetched = 0
+    pool = gevent.pool.Pool(app.config["CONTENT_PREFETCH_WORKERS"])
+    for source_entry_id, content in pool.imap_unordered(fetch_content, candidates):
+        if content:
+            models.EntryBlob.upsert(source_entry_id, content_full=content)
+            fetched += 1
+            if fetched % PREFETCH_COMMIT_SIZE == 0:
+                db.session.commit()
+    db.session.commit()
+
+    app.logger.info("Prefetched %s of %s entries in %.2fs", fetched, len(candidates), time.monotonic() - start)
+
+    opened = models.prefetch_stats["opened"]
+    if opened:
+        prefetched = models.prefetch_stats["prefetched"]
+        app.logger.info(
+            "%s of %s opened entries were prefetched (%.0f%%)", prefetched, opened, prefetched / opened * 100
         )
+    models.prefetch_stats.clear()
+
+    collapsed = scraping.remote_fetches.collapsed
+    if collapsed:
+        app.logger.info(
+            "Collapsed duplicate fetches: %s", ", ".join(f"{kind}={count}" for kind, count in collapsed.items())
+        )
+    collapsed.clear()
+
 
-        for entry in db.session.scalars(query):
-            app.logger.debug("Prefetching %s", entry.content_url)
-            entry.fetch_content()
+def fetch_content(candidate):
+    """
+    Return the id of the given (source entry id, content_url) candidate and its article html,
+    or None if it failed.
+    """
+    source_entry_id, content_url = candidate
+    app.logger.debug("Prefetching %s", content_url)
+    try:
+        return source_entry_id, scraping.extract(content_url)["content"]
+    except Exception as error:
+        app.logger.debug("failed to prefetch content %s %s", content_url, error)
+        return source_entry_id, None
+
+
+@huey_task()
+def deliver_to_kindle():
+    """
+    Send the queued articles that are due to the kindle of their users. Sends go out through a
+    shared smtp session (see `email.send`), and failed ones are retried by later runs with an
+    increasing delay, see `models.KindleDelivery`.
+    """
+    for user_id, deliveries in models.KindleDelivery.claim_due().items():
+        user = db.session.get(models.User, user_id)
+        for delivery in deliveries:
+            try:
+                if not user.kindle_email:
+                    raise ValueError("no kindle email configured")
+                entry, article = send_to_kindle(user, delivery)
+            except Exception as error:
+                app.logger.warning("failed to send %s to kindle: %s", delivery.url, error)
+                db.session.rollback()
+                delivery.mark_failed(error, permanent=is_permanent_error(error))
+                db.session.commit()
+                continue
+
+            # save as read entry if not already, to keep track of sent to kindle urls
+            delivery.mark_sent()
+            entry.sent_to_kindle = datetime.datetime.now()
+            entry.viewed = entry.viewed or datetime.datetime.utcnow()
+            entry.content_full = article["content"]
+            db.session.add(entry)
             db.session.commit()
 
 
+@feed_cli.command("kindle")
+@huey_task(crontab(minute=app.config["KINDLE_DELIVERY_CRON_MINUTES"]))
+def retry_kindle_deliveries():
+    deliver_to_kindle().get()
+
+
+def send_to_kindle(user, delivery):
+    """
+    Package the article of the delivery as an EPUB and email it to the kindle of the user.
+    Return the entry of the article (a new one if the user didn't have it) and the article.
+    """
+    # reuse the article if it was already read or prefetched, otherwise
+    # fetch the page once to get both the article and the entry metadata from it
+    url = delivery.url
+    entry = models.Entry.find_by_url(user.id, url)
+    article = entry and entry.stored_article()
+    if not article:
+        response = requests.get(url)
+        response.raise_for_status()
+        article = scraping.extract(url, html=response.content)
+        entry = entry or models.Entry.from_url(user.id, url, html=response.content)
+
+    attach_data = scraping.package_epub(url, article)
+
+    delivery.mark_sending()
+    db.session.commit()
+    email.send(user.kindle_email, attach_data, filename=article["title"])
+    return entry, article
+
+
+def is_permanent_error(error):
+    """
+    Return whether retrying won't fix the error of a delivery: the settings are missing, the page
+    doesn't exist or its content can't be parsed, as opposed to network or mail server errors.
+    """
+    if isinstance(error, HTTPError) and error.response is not None:
+        return 400 <= error.response.status_code < 500 and error.response.status_code != 429
+    return isinstance(error, ValueError)
+
+
 @feed_cli.command("purge")
 @huey_task(crontab(minute="0", hour=app.config["DELETE_OLD_CRON_HOURS"]))
 def delete_old_entries():
     """
-    Delete entries that are older than DELETE_AFTER_DAYS but
+    Delete entries that are older than DELETE_AFTER_DAYS (or their feed's override of it) but
     making sure we always keep RSS_MINIMUM_ENTRY_AMOUNT for each feed.
     Favorite and pinned entries aren't deleted.
+    The entries are deleted in chunks, each in a short transaction, so syncs don't have to wait
+    for the whole purge to acquire the db writer lock.
     """
-    older_than_date = datetime.datetime.utcnow() - datetime.timedelta(days=app.config["DELETE_AFTER_DAYS"])
-    minimum = app.config["RSS_MINIMUM_ENTRY_AMOUNT"]
-    # there must be more clever sql ways to do this, but it doesn't have to be efficient
-
-    # filter feeds that have old entries
-    feeds_q = (
-        db.select(models.Feed.id, models.Feed.name)
-        .join(models.Feed.entries)
-        .filter(
-            models.Entry.sort_date < older_than_date,
-            models.Entry.favorited.is_(None),
-            models.Entry.sent_to_kindle.is_(None),
-            models.Entry.pinned.is_(None),
+    start = time.monotonic()
+    chunk_size = app.config["DELETE_CHUNK_SIZE"]
+
+    query = models.Entry.select_expired(app.config["DELETE_AFTER_DAYS"], app.config["RSS_MINIMUM_ENTRY_AMOUNT"])
+    expired_ids = db.session.scalars(query).all()
+    db.session.commit()
+
+    deleted = 0
+    for i in range(0, len(expired_ids), chunk_size):
+        chunk = expired_ids[i : i + chunk_size]
+
+        source_entry_ids = db.session.scalars(
+            db.select(models.Entry.source_entry_id).where(models.Entry.id.in_(chunk))
+        ).all()
+
+        # check again for protected entries, in case they changed since the ids were selected
+        res = db.session.execute(
+            db.delete(models.Entry).where(
+                models.Entry.id.in_(chunk),
+                models.Entry.favorited.is_(None),
+                models.Entry.sent_to_kindle.is_(None),
+                models.Entry.pinned.is_(None),
+            )
         )
-        .group_by(models.Feed.id)
-        .having(sa.func.count(models.Feed.entries) > 0)
-    )
+        # the content is shared, so it's only deleted once no feed has the entry
+        models.SourceEntry.delete_orphans(source_entry_ids)
+        db.session.commit()
+        deleted += res.rowcount
 
-    for feed_id, feed_name in db.session.execute(feeds_q).all():
-        # of the ones that have old entries, get the date of the nth entry (overall, not just within the old ones)
-        min_sort_date = db.session.scalar(
-            db.select(models.Entry.sort_date)
-            .filter_by(feed_id=feed_id)
-            .order_by(models.Entry.sort_date.desc())
-            .limit(1)
-            .offset(minimum - 1)
+    # the sources that nobody follows anymore go once none of their entries are kept
+    db.session.execute(
+        db.delete(models.Source).where(
+            ~models.Source.feeds.any(),
+            ~db.select(models.SourceEntry.id).where(models.SourceEntry.source_id == models.Source.id).exists(),
         )
+    )
+    db.session.commit()
 
-        if not min_sort_date:
-            continue
+    app.logger.info("Deleted %s old entries in %.2fs", deleted, time.monotonic() - start)
 
-        # delete all entries from that feed that are older than RSS_SKIP_OLDER_THAN_DAYS
-        # AND ALSO older than the nth entry, so we guarantee to always keep at least the minimum
-        q = db.delete(models.Entry).where(
-            models.Entry.favorited.is_(None),
-            models.Entry.sent_to_kindle.is_(None),
-            models.Entry.pinned.is_(None),
-            models.Entry.feed_id == feed_id,
-            models.Entry.sort_date < min_sort_date,
-            models.Entry.sort_date < older_than_date,
-        )
 
-        res = db.session.execute(q)
-        db.session.commit()
-        if res.rowcount:
-            app.logger.info("Deleted %s old entries from %s/%s", res.rowcount, feed_id, feed_name)
-
-    # Delete old standalone entries (without associated feed)
-    q = db.delete(models.Entry).where(
-        models.Entry.feed_id.is_(None),
-        models.Entry.sent_to_kindle.is_(None),
-        models.Entry.favorited.is_(None),
-        models.Entry.pinned.is_(None),
-        models.Entry.sort_date < older_than_date,
-    )
+@feed_cli.command("purge-raw")
+@huey_task(crontab(minute="30", hour=app.config["DELETE_OLD_CRON_HOURS"]))
+def delete_old_raw_data():
+    """
+    Drop the raw data of entries older than RAW_DATA_RETENTION_DAYS, if set.
+    This data is only kept for debugging purposes.
+    """
+    retention_days = app.config["RAW_DATA_RETENTION_DAYS"]
+    if retention_days is None:
+        return
 
-    res = db.session.execute(q)
+    older_than_date = datetime.datetime.utcnow() - datetime.timedelta(days=retention_days)
+    dropped = models.EntryBlob.drop_raw_data(older_than_date)
     db.session.commit()
-    if res.rowcount:
-        app.logger.info("Deleted %s old standalone entries from", res.rowcount)
+    if dropped:
+        app.logger.info("Dropped raw data of %s entries", dropped)
+
+
+@db_cli.command("maintain")
+@huey_task(crontab(minute="45", hour=app.config["DB_MAINTENANCE_CRON_HOURS"]))
+def maintain_db():
+    """
+    Reclaim the space left by deleted entries, truncate the write-ahead log (on sqlite)
+    and refresh the query planner statistics.
+    """
+    before = models.db_stats()
+
+    # these need to run outside of a transaction to have an effect
+    with db.engine.connect().execution_options(isolation_level="AUTOCOMMIT") as connection:
+        dialects.get(db.engine).maintain(connection)
+
+    after = models.db_stats()
+    for key, label in [("db", "DB"), ("wal", "WAL"), ("free", "free space")]:
+        if before[key] is None:
+            continue
+        app.logger.info("%s size %.1fMB -> %.1fMB", label, before[key] / 1024**2, after[key] / 1024**2)
+
+
+@db_cli.command("connections")
+def connection_stats():
+    "Print the state of the db connection pools and how much memory their connections can use."
+    for stats in models.connection_stats():
+        print(
+            f"{stats['role']}: {stats['pool']}\n"
+            f"  page cache {stats['cache_per_connection'] / 1024**2:.1f}MB per connection, "
+            f"{stats['cache_total'] / 1024**2:.1f}MB total\n"
+            f"  shared mmap {stats['mmap'] / 1024**2:.1f}MB"
+        )
 
 
 @feed_cli.command("debug")
@@ -275,10 +506,9 @@ def add_if_not_exists(feed):
         app.logger.info("skipping already existent %s", feed.name)
         return
 
-    db.session.add(feed)
-    db.session.commit()
-
+    # the icon is set if the site is already cached, otherwise the next sync finds it
     feed.load_icon()
+    db.session.add(feed)
     db.session.commit()
     app.logger.info("added %s", feed)
 
@@ -301,6 +531,67 @@ def user_delete(email):
     db.session.commit()
 
 
+@db_cli.command("train-dictionary")
+@click.option("--sample-size", default=2000, help="Amount of recent entries to sample.")
+@click.option("--recompress", is_flag=True, help="Rewrite the stored raw data with the new dictionary.")
+def train_compression_dictionary(sample_size, recompress):
+    "Build a new compression dictionary for raw data out of the currently stored entries."
+    if not dialects.get(db.engine).compress_values:
+        app.logger.info("The %s backend compresses values on its own", db.engine.dialect.name)
+        return
+
+    dictionary = models.CompressionDictionary.train(sample_size)
+    app.logger.info("Created compression dictionary %s of %s bytes", dictionary.id, len(dictionary.data))
+
+    if not recompress:
+        return
+
+    last_id = 0
+    while True:
+        blobs = db.session.scalars(
+            db.select(models.EntryBlob)
+            .where(models.EntryBlob.source_entry_id > last_id, models.EntryBlob.raw_data.isnot(None))
+            .order_by(models.EntryBlob.source_entry_id)
+            .limit(500)
+        ).all()
+        if not blobs:
+            break
+
+        for blob in blobs:
+            # flag as modified so it's written again with the current dictionary
+            sa.orm.attributes.flag_modified(blob, "raw_data")
+        last_id = blobs[-1].source_entry_id
+        db.session.commit()
+        app.logger.info("Recompressed raw data up to source entry %s", last_id)
+
+
+@feed_cli.command("backfill-previews")
+def backfill_previews():
+    "Compute the preview columns of the entries saved before they were introduced."
+    last_id = 0
+    while True:
+        rows = db.session.execute(
+            db.select(models.SourceEntry.id, models.SourceEntry.content_short)
+            .where(
+                models.SourceEntry.id > last_id,
+                models.SourceEntry.content_preview.is_(None),
+                models.SourceEntry.content_short.isnot(None),
+            )
+            .order_by(models.SourceEntry.id)
+            .limit(500)
+        ).all()
+        if not rows:
+            break
+
+        db.session.execute(
+            db.update(models.SourceEntry),
+            [{"id": entry_id, **models.SourceEntry.preview_values(content_short)} for entry_id, content_short in rows],
+        )
+        last_id = rows[-1].id
+        db.session.commit()
+        app.logger.info("Computed previews up to source entry %s", last_id)
+
+
 @feed_cli.command("recalculate-buckets")
 def recalculate_buckets():
     """Recalculate frequency buckets for all feeds."""
@@ -309,6 +600,7 @@ def recalculate_buckets():
     for feed in feeds:
         old_bucket = feed.bucket
         feed.bucket = feed._calculate_bucket_from_db()
+        models.Entry.update_ranking(feed=feed)
         app.logger.info(f"Feed {feed.id}/{feed.name}: bucket {old_bucket} -> {feed.bucket}")
 
     db.session.commit()
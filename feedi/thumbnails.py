@@ -0,0 +1,183 @@
+"""
+Resized copies of the remote images shown in entry lists (media previews, avatars and feed icons),
+served by routes.image_proxy so browsers don't download full size images from slow origins just to
+show them small.
+
+Thumbnails are stored as WebP files under THUMBNAIL_CACHE_DIR. When their total size goes over
+THUMBNAIL_CACHE_MB, the least recently used ones are deleted.
+"""
+
+import hashlib
+import hmac
+import io
+import logging
+import os
+
+import flask
+import gevent.pool
+from PIL import Image
+
+from feedi import cache, scraping
+
+logger = logging.getLogger(__name__)
+
+# the widths thumbnails can be requested at, roughly the display sizes of images in the
+# entry lists on high density screens
+AVATAR_WIDTH = 96
+CARD_WIDTH = 400
+WIDE_CARD_WIDTH = 800
+PREVIEW_WIDTH = 1200
+WIDTHS = (AVATAR_WIDTH, CARD_WIDTH, WIDE_CARD_WIDTH, PREVIEW_WIDTH)
+
+MAX_SOURCE_BYTES = 10 * 1024**2
+# thumbnails don't change for a given url, so browsers can keep them
+MAX_AGE_SECONDS = 365 * 24 * 60 * 60
+
+# cache files are deleted down to this share of the size limit, so evictions don't happen on every new file
+EVICTION_TARGET = 0.9
+
+# images that can't be fetched or converted aren't tried again for a while, so a broken one
+# isn't downloaded on every page view that shows it
+failed_sources = cache.ExpiringDict(ttl_seconds=6 * 60 * 60)
+
+# total size of the cached files, computed on first use
+_cache_size = None
+
+
+def signature(url, width):
+    """
+    Return the signature that authorizes proxying the given image url at the given width.
+    This limits the proxy to the urls rendered by the app, instead of fetching anything it's given.
+    """
+    key = flask.current_app.config["SECRET_KEY"]
+    if isinstance(key, str):
+        key = key.encode()
+    return hmac.new(key, f"{width}:{url}".encode(), hashlib.sha256).hexdigest()[:32]
+
+
+def proxy_url(url, width):
+    "Return the url to request a thumbnail of the given image url through the app."
+    return flask.url_for("image_proxy", url=url, w=width, sig=signature(url, width))
+
+
+def cache_dir():
+    return flask.current_app.config["THUMBNAIL_CACHE_DIR"]
+
+
+def cache_path(url, width):
+    digest = hashlib.sha1(url.encode()).hexdigest()
+    return os.path.join(cache_dir(), digest[:2], f"{digest}-{width}.webp")
+
+
+def get(url, width):
+    """
+    Return the path of the thumbnail of the image at the given url, creating it if it's not cached yet,
+    or None if the image can't be fetched or converted.
+    """
+    path = cache_path(url, width)
+    try:
+        # the modification time tells the eviction which files were recently used
+        os.utime(path)
+        return path
+    except FileNotFoundError:
+        pass
+
+    if failed_sources.get(url):
+        return None
+
+    return scraping.remote_fetches.call(("thumbnail", url, width), create, url, width, path)
+
+
+def create(url, width, path):
+    data = scraping.download_image(url, MAX_SOURCE_BYTES)
+    thumbnail = scraping.convert_image(url, data, resize, width)
+    if thumbnail is None:
+        failed_sources.set(url, True)
+        return None
+
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    # write to a temporary file first so other processes don't serve it half-written
+    temp_path = f"{path}.{os.getpid()}.tmp"
+    with open(temp_path, "wb") as file:
+        file.write(thumbnail)
+    os.replace(temp_path, path)
+
+    add_to_cache_size(len(thumbnail))
+    return path
+
+
+def resize(data, width):
+    "Return the given image data as a WebP image no wider than the given width."
+    image = Image.open(io.BytesIO(data))
+    # very tall images are cut by the card layout anyway
+    size = (width, width * 4)
+    # let JPEGs be decoded at a reduced scale
+    image.draft("RGB", size)
+    if image.mode not in ("RGB", "RGBA"):
+        image = image.convert("RGBA")
+    image.thumbnail(size)
+
+    output = io.BytesIO()
+    image.save(output, "WEBP", quality=80)
+    return output.getvalue()
+
+
+def warm(images, concurrency=4):
+    "Create the thumbnails of the given (url, width) pairs that aren't cached yet, e.g. for new entries."
+    # the cache settings come from the app, which greenlets don't inherit
+    app = flask.current_app._get_current_object()
+
+    def warm_one(url, width):
+        with app.app_context():
+            get(url, width)
+
+    pool = gevent.pool.Pool(concurrency)
+    for url, width in images:
+        if url.startswith(("http://", "https://")):
+            pool.spawn(warm_one, url, width)
+    pool.join()
+
+
+def add_to_cache_size(size):
+    global _cache_size
+    if _cache_size is None:
+        _cache_size = sum(file_size for _path, _mtime, file_size in cached_files())
+    else:
+        _cache_size += size
+
+    max_bytes = flask.current_app.config["THUMBNAIL_CACHE_MB"] * 1024**2
+    if _cache_size > max_bytes:
+        evict(max_bytes * EVICTION_TARGET)
+
+
+def evict(target_bytes):
+    "Delete the least recently used thumbnails until the cache size is below the given amount of bytes."
+    global _cache_size
+    files = sorted(cached_files(), key=lambda file: file[1])
+    _cache_size = sum(file_size for _path, _mtime, file_size in files)
+    for path, _mtime, file_size in files:
+        if _cache_size <= target_bytes:
+            break
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            # deleted by another process
+            pass
+        _cache_size -= file_size
+    logger.info("evicted thumbnails, cache size is now %.1fMB", _cache_size / 1024**2)
+
+
+def cached_files():
+    "Return the (path, modification time, size) of the cached thumbnails."
+    files = []
+    for directory, _subdirs, filenames in os.walk(cache_dir()):
+        for filename in filenames:
+            if not filename.endswith(".webp"):
+                continue
+            path = os.path.join(directory, filename)
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                continue
+            files.append((path, stat.st_mtime, stat.st_size))
+    return files
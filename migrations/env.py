@@ -1,3 +1,4 @@
+import os
 from logging.config import fileConfig
 
 from alembic import context
@@ -8,6 +9,10 @@ from sqlalchemy import engine_from_config, pool
 # access to the values within the .ini file in use.
 config = context.config
 
+# allow migrating a database other than the default sqlite file, e.g. postgres
+if os.getenv("FEEDI_DATABASE_URI"):
+    config.set_main_option("sqlalchemy.url", os.environ["FEEDI_DATABASE_URI"])
+
 # Interpret the config file for Python logging.
 # This line sets up loggers basically.
 if config.config_file_name is not None:
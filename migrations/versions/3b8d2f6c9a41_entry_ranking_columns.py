@@ -0,0 +1,48 @@
+"""entry ranking columns
+
+Revision ID: 3b8d2f6c9a41
+Revises: f411849d887d
+Create Date: 2026-10-19 09:12:41.512304
+
+"""
+
+import datetime
+from typing import Sequence, Union
+
+import sqlalchemy as sa
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision: str = "3b8d2f6c9a41"
+down_revision: Union[str, None] = "f411849d887d"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    with op.batch_alter_table("entries", schema=None) as batch_op:
+        batch_op.add_column(sa.Column("recent", sa.Boolean(), nullable=False, server_default=sa.false()))
+        batch_op.add_column(sa.Column("bucket", sa.Integer(), nullable=True))
+
+    # populate the denormalized columns from the feeds table and the current recency boundary
+    boundary = datetime.datetime.utcnow() - datetime.timedelta(hours=24)
+    op.execute(
+        sa.text(
+            "UPDATE entries SET bucket = (SELECT feeds.bucket FROM feeds WHERE feeds.id = entries.feed_id), "
+            "recent = (sort_date >= :boundary)"
+        ).bindparams(boundary=boundary)
+    )
+
+    with op.batch_alter_table("entries", schema=None) as batch_op:
+        batch_op.create_index(
+            "entry_rank", ["user_id", sa.text("recent DESC"), "bucket", sa.text("sort_date DESC")], unique=False
+        )
+        batch_op.create_index("entry_recent_sort", ["recent", "sort_date"], unique=False)
+
+
+def downgrade() -> None:
+    with op.batch_alter_table("entries", schema=None) as batch_op:
+        batch_op.drop_index("entry_recent_sort")
+        batch_op.drop_index("entry_rank")
+        batch_op.drop_column("bucket")
+        batch_op.drop_column("recent")
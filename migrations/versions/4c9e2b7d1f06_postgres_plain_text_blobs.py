@@ -0,0 +1,86 @@
+"""widen user passwords and store compressed columns as text on postgres
+
+Revision ID: 4c9e2b7d1f06
+Revises: 8e5b0c3f1a92
+Create Date: 2026-10-20 10:12:37.204511
+
+"""
+
+from typing import Sequence, Union
+
+import sqlalchemy as sa
+from alembic import op
+
+from feedi import compression
+
+# revision identifiers, used by Alembic.
+revision: str = "4c9e2b7d1f06"
+down_revision: Union[str, None] = "8e5b0c3f1a92"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+BATCH_SIZE = 500
+
+# the columns of models.CompressedString, which postgres stores as plain text
+COMPRESSED_COLUMNS = [("feeds", "id", "raw_data"), ("entry_blobs", "entry_id", "content_full"), ("entry_blobs", "entry_id", "raw_data")]
+
+
+def replace_column(table, key, column, type_, convert):
+    "Replace the column with one of the given type, holding the values of the convert function."
+    connection = op.get_bind()
+    op.add_column(table, sa.Column(f"{column}_new", type_))
+
+    last_key = -1
+    while True:
+        rows = connection.execute(
+            sa.text(
+                f"SELECT {key}, {column} FROM {table} WHERE {key} > :last AND {column} IS NOT NULL "
+                f"ORDER BY {key} LIMIT {BATCH_SIZE}"
+            ),
+            {"last": last_key},
+        ).all()
+        if not rows:
+            break
+
+        connection.execute(
+            sa.text(f"UPDATE {table} SET {column}_new = :value WHERE {key} = :key"),
+            [{"key": row_key, "value": convert(value)} for row_key, value in rows],
+        )
+        last_key = rows[-1][0]
+
+    op.drop_column(table, column)
+    op.alter_column(table, f"{column}_new", new_column_name=column)
+
+
+def decompress(value):
+    return compression.decompress(value)
+
+
+def compress(value):
+    return compression.compress(value)
+
+
+def upgrade() -> None:
+    # the password hashes are longer than the previous limit, which only sqlite ignores
+    with op.batch_alter_table("users", schema=None) as batch_op:
+        batch_op.alter_column("password", existing_type=sa.String(length=100), type_=sa.String(length=255))
+
+    if op.get_bind().dialect.name != "postgresql":
+        return
+
+    # values compressed with a dictionary need it to be registered before decompressing
+    connection = op.get_bind()
+    for dictionary_id, data in connection.execute(sa.text("SELECT id, data FROM compression_dictionaries")):
+        compression.register_dictionary(dictionary_id, data)
+
+    for table, key, column in COMPRESSED_COLUMNS:
+        replace_column(table, key, column, sa.Text(), decompress)
+
+
+def downgrade() -> None:
+    if op.get_bind().dialect.name == "postgresql":
+        for table, key, column in COMPRESSED_COLUMNS:
+            replace_column(table, key, column, sa.LargeBinary(), compress)
+
+    with op.batch_alter_table("users", schema=None) as batch_op:
+        batch_op.alter_column("password", existing_type=sa.String(length=255), type_=sa.String(length=100))
@@ -0,0 +1,70 @@
+"""move entry content_full and raw_data to entry_blobs
+
+Revision ID: 8e4a7c1d2b90
+Revises: 3b8d2f6c9a41
+Create Date: 2026-10-19 10:31:07.240118
+
+"""
+
+from typing import Sequence, Union
+
+import sqlalchemy as sa
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision: str = "8e4a7c1d2b90"
+down_revision: Union[str, None] = "3b8d2f6c9a41"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        "entry_blobs",
+        sa.Column("entry_id", sa.Integer(), nullable=False),
+        sa.Column("content_full", sa.String(), nullable=True),
+        sa.Column("raw_data", sa.String(), nullable=True),
+        sa.ForeignKeyConstraint(["entry_id"], ["entries.id"], ondelete="CASCADE"),
+        sa.PrimaryKeyConstraint("entry_id"),
+    )
+
+    op.execute(
+        "INSERT INTO entry_blobs (entry_id, content_full, raw_data) "
+        "SELECT id, content_full, raw_data FROM entries "
+        "WHERE content_full IS NOT NULL OR raw_data IS NOT NULL"
+    )
+
+    # the batch operation recreates the entries table, so it's compacted without the blob columns
+    with op.batch_alter_table("entries", schema=None) as batch_op:
+        batch_op.drop_column("raw_data")
+        batch_op.drop_column("content_full")
+
+    recreate_sort_indexes()
+
+
+def downgrade() -> None:
+    with op.batch_alter_table("entries", schema=None) as batch_op:
+        batch_op.add_column(sa.Column("content_full", sa.VARCHAR(), nullable=True))
+        batch_op.add_column(sa.Column("raw_data", sa.VARCHAR(), nullable=True))
+
+    recreate_sort_indexes()
+
+    op.execute(
+        "UPDATE entries SET "
+        "content_full = (SELECT content_full FROM entry_blobs WHERE entry_blobs.entry_id = entries.id), "
+        "raw_data = (SELECT raw_data FROM entry_blobs WHERE entry_blobs.entry_id = entries.id)"
+    )
+
+    op.drop_table("entry_blobs")
+
+
+def recreate_sort_indexes():
+    # the table is recreated from its reflected schema on sqlite, which drops the sort direction of the
+    # index columns. without it the home timeline can't be ordered by walking the index
+    with op.batch_alter_table("entries", schema=None) as batch_op:
+        batch_op.drop_index("entry_sort_ts")
+        batch_op.drop_index("entry_rank")
+        batch_op.create_index("entry_sort_ts", [sa.text("sort_date DESC")], unique=False)
+        batch_op.create_index(
+            "entry_rank", ["user_id", sa.text("recent DESC"), "bucket", sa.text("sort_date DESC")], unique=False
+        )
@@ -0,0 +1,37 @@
+"""incremental auto vacuum
+
+Revision ID: 9c2e5a7f1b34
+Revises: 5d0f3e8b7c12
+Create Date: 2026-10-19 15:12:40.502913
+
+"""
+
+from typing import Sequence, Union
+
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision: str = "9c2e5a7f1b34"
+down_revision: Union[str, None] = "5d0f3e8b7c12"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    if op.get_bind().dialect.name != "sqlite":
+        return
+
+    # the auto vacuum mode of an existing db only changes after a full vacuum,
+    # which can't run inside a transaction
+    with op.get_context().autocommit_block():
+        op.execute("pragma auto_vacuum = INCREMENTAL")
+        op.execute("vacuum")
+
+
+def downgrade() -> None:
+    if op.get_bind().dialect.name != "sqlite":
+        return
+
+    with op.get_context().autocommit_block():
+        op.execute("pragma auto_vacuum = NONE")
+        op.execute("vacuum")
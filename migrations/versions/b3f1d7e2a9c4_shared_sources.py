@@ -0,0 +1,292 @@
+"""share feed sources and entries between users
+
+Revision ID: b3f1d7e2a9c4
+Revises: 4c9e2b7d1f06
+Create Date: 2026-10-20 16:41:52.380217
+
+"""
+
+from typing import Sequence, Union
+
+import sqlalchemy as sa
+from alembic import op
+
+from feedi import scraping
+
+# revision identifiers, used by Alembic.
+revision: str = "b3f1d7e2a9c4"
+down_revision: Union[str, None] = "4c9e2b7d1f06"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+# sqlite doesn't keep the names of foreign key and unique constraints, so the batch operations that
+# recreate its tables refer to them by these conventional names, also used for the ones created here
+NAMING_CONVENTION = {
+    "fk": "fk_%(table_name)s_%(column_0_name)s_%(referred_table_name)s",
+    "uq": "uq_%(table_name)s_%(column_0_N_name)s",
+}
+
+# the columns of an entry that are shared by all the feeds of its source
+SHARED_COLUMNS = [
+    "remote_id",
+    "title",
+    "username",
+    "user_url",
+    "display_name",
+    "avatar_url",
+    "content_short",
+    "content_preview",
+    "content_excerpt",
+    "target_url",
+    "content_url",
+    "comments_url",
+    "media_url",
+    "display_date",
+    "header",
+    "icon_url",
+]
+
+
+def blob_type():
+    "Return the column type of models.CompressedString, which postgres stores as plain text."
+    return sa.Text() if op.get_bind().dialect.name == "postgresql" else sa.LargeBinary()
+
+
+def foreign_key_name(table, column):
+    "Return the name of the foreign key of the given column, as known by the batch operations."
+    for foreign_key in sa.inspect(op.get_bind()).get_foreign_keys(table):
+        if foreign_key["constrained_columns"] == [column]:
+            return foreign_key["name"] or f"fk_{table}_{column}_{foreign_key['referred_table']}"
+
+
+def upgrade() -> None:
+    connection = op.get_bind()
+
+    op.create_table(
+        "sources",
+        sa.Column("id", sa.Integer(), nullable=False),
+        sa.Column("type", sa.String(), nullable=False),
+        sa.Column("url", sa.String(), nullable=False),
+        sa.Column("normalized_url", sa.String(), nullable=False),
+        sa.Column("created", sa.TIMESTAMP(), nullable=False),
+        sa.Column("last_fetch", sa.TIMESTAMP(), nullable=True),
+        sa.Column("raw_data", blob_type(), nullable=True),
+        sa.Column("etag", sa.String(), nullable=True),
+        sa.Column("modified_header", sa.String(), nullable=True),
+        sa.PrimaryKeyConstraint("id"),
+        sa.UniqueConstraint("type", "normalized_url"),
+    )
+    op.create_table(
+        "source_entries",
+        sa.Column("id", sa.Integer(), nullable=False),
+        sa.Column("source_id", sa.Integer(), nullable=True),
+        sa.Column("remote_id", sa.String(), nullable=False),
+        sa.Column("title", sa.String(), nullable=True),
+        sa.Column("username", sa.String(), nullable=True),
+        sa.Column("user_url", sa.String(), nullable=True),
+        sa.Column("display_name", sa.String(), nullable=True),
+        sa.Column("avatar_url", sa.String(), nullable=True),
+        sa.Column("content_short", sa.String(), nullable=True),
+        sa.Column("content_preview", sa.String(), nullable=True),
+        sa.Column("content_excerpt", sa.String(), nullable=True),
+        sa.Column("target_url", sa.String(), nullable=True),
+        sa.Column("content_url", sa.String(), nullable=True),
+        sa.Column("comments_url", sa.String(), nullable=True),
+        sa.Column("media_url", sa.String(), nullable=True),
+        sa.Column("created", sa.TIMESTAMP(), nullable=False),
+        sa.Column("updated", sa.TIMESTAMP(), nullable=False),
+        sa.Column("display_date", sa.TIMESTAMP(), nullable=False),
+        sa.Column("sort_date", sa.TIMESTAMP(), nullable=False),
+        sa.Column("header", sa.String(), nullable=True),
+        sa.Column("icon_url", sa.String(), nullable=True),
+        sa.ForeignKeyConstraint(["source_id"], ["sources.id"]),
+        sa.PrimaryKeyConstraint("id"),
+        sa.UniqueConstraint("source_id", "remote_id"),
+    )
+    with op.batch_alter_table("source_entries", schema=None) as batch_op:
+        batch_op.create_index(batch_op.f("ix_source_entries_content_url"), ["content_url"], unique=False)
+        batch_op.create_index(batch_op.f("ix_source_entries_title"), ["title"], unique=False)
+        batch_op.create_index(batch_op.f("ix_source_entries_username"), ["username"], unique=False)
+
+    # feeds of the same type and url share a source, with the url as entered by the first of them
+    op.add_column("feeds", sa.Column("source_id", sa.Integer(), nullable=True))
+    source_ids = {}
+    for feed_id, type_, url in connection.execute(sa.text("SELECT id, type, url FROM feeds ORDER BY id")).all():
+        url = url or ""
+        key = (type_, scraping.normalize_url(url))
+        if key not in source_ids:
+            connection.execute(
+                sa.text(
+                    "INSERT INTO sources (type, url, normalized_url, created) "
+                    "VALUES (:type, :url, :normalized_url, CURRENT_TIMESTAMP)"
+                ),
+                {"type": key[0], "url": url, "normalized_url": key[1]},
+            )
+            source_ids[key] = connection.scalar(
+                sa.text("SELECT id FROM sources WHERE type = :type AND normalized_url = :normalized_url"),
+                {"type": key[0], "normalized_url": key[1]},
+            )
+        connection.execute(
+            sa.text("UPDATE feeds SET source_id = :source_id WHERE id = :feed_id"),
+            {"source_id": source_ids[key], "feed_id": feed_id},
+        )
+
+    # the fetch state of a source is that of its most recently synced feed
+    latest_feed = "FROM feeds WHERE feeds.source_id = sources.id ORDER BY last_fetch IS NULL, last_fetch DESC LIMIT 1"
+    op.execute(
+        "UPDATE sources SET "
+        f"last_fetch = (SELECT last_fetch {latest_feed}), "
+        f"raw_data = (SELECT raw_data {latest_feed}), "
+        f"etag = (SELECT etag {latest_feed}), "
+        f"modified_header = (SELECT modified_header {latest_feed})"
+    )
+
+    # the first copy of each entry of a source becomes the shared one, keeping its id, so its blob can stay.
+    # standalone entries don't have a source and are never shared
+    columns = ", ".join(SHARED_COLUMNS)
+    entry_columns = ", ".join(f"entries.{column}" for column in SHARED_COLUMNS)
+    op.execute(
+        f"INSERT INTO source_entries (id, source_id, created, updated, sort_date, {columns}) "
+        f"SELECT entries.id, feeds.source_id, entries.created, entries.updated, entries.sort_date, {entry_columns} "
+        "FROM entries LEFT JOIN feeds ON feeds.id = entries.feed_id "
+        "WHERE entries.feed_id IS NULL OR entries.id IN ("
+        "SELECT MIN(entries.id) FROM entries JOIN feeds ON feeds.id = entries.feed_id "
+        "GROUP BY feeds.source_id, entries.remote_id)"
+    )
+    if connection.dialect.name == "postgresql":
+        op.execute(
+            "SELECT setval(pg_get_serial_sequence('source_entries', 'id'), COALESCE(MAX(id), 0) + 1, false) "
+            "FROM source_entries"
+        )
+
+    op.add_column("entries", sa.Column("source_entry_id", sa.Integer(), nullable=True))
+    op.execute(
+        "UPDATE entries SET source_entry_id = COALESCE(("
+        "SELECT source_entries.id FROM source_entries JOIN feeds ON feeds.source_id = source_entries.source_id "
+        "WHERE feeds.id = entries.feed_id AND source_entries.remote_id = entries.remote_id), entries.id)"
+    )
+
+    op.execute("DELETE FROM entry_blobs WHERE entry_id NOT IN (SELECT id FROM source_entries)")
+    with op.batch_alter_table("entry_blobs", schema=None, naming_convention=NAMING_CONVENTION) as batch_op:
+        batch_op.drop_constraint(foreign_key_name("entry_blobs", "entry_id"), type_="foreignkey")
+        batch_op.alter_column("entry_id", new_column_name="source_entry_id", existing_type=sa.Integer())
+    # the batch operations don't add a constraint on a column renamed in the same batch
+    with op.batch_alter_table("entry_blobs", schema=None) as batch_op:
+        batch_op.create_foreign_key(
+            "fk_entry_blobs_source_entry_id_source_entries",
+            "source_entries",
+            ["source_entry_id"],
+            ["id"],
+            ondelete="CASCADE",
+        )
+
+    # dropping the remote_id column drops the (feed_id, remote_id) unique constraint along with it
+    with op.batch_alter_table("entries", schema=None, naming_convention=NAMING_CONVENTION) as batch_op:
+        batch_op.drop_index("entry_content_url")
+        batch_op.drop_index("ix_entries_title")
+        batch_op.drop_index("ix_entries_username")
+        for column in SHARED_COLUMNS:
+            batch_op.drop_column(column)
+        batch_op.alter_column("source_entry_id", existing_type=sa.Integer(), nullable=False)
+        batch_op.create_index(batch_op.f("ix_entries_source_entry_id"), ["source_entry_id"], unique=False)
+        batch_op.create_unique_constraint("uq_entries_feed_id_source_entry_id", ["feed_id", "source_entry_id"])
+        batch_op.create_foreign_key(
+            "fk_entries_source_entry_id_source_entries", "source_entries", ["source_entry_id"], ["id"]
+        )
+
+    recreate_sort_indexes()
+
+    with op.batch_alter_table("feeds", schema=None, naming_convention=NAMING_CONVENTION) as batch_op:
+        batch_op.drop_column("raw_data")
+        batch_op.drop_column("etag")
+        batch_op.drop_column("modified_header")
+        batch_op.alter_column("source_id", existing_type=sa.Integer(), nullable=False)
+        batch_op.create_index(batch_op.f("ix_feeds_source_id"), ["source_id"], unique=False)
+        batch_op.create_foreign_key("fk_feeds_source_id_sources", "sources", ["source_id"], ["id"])
+
+
+def downgrade() -> None:
+    with op.batch_alter_table("feeds", schema=None) as batch_op:
+        batch_op.add_column(sa.Column("raw_data", blob_type(), nullable=True))
+        batch_op.add_column(sa.Column("etag", sa.VARCHAR(), nullable=True))
+        batch_op.add_column(sa.Column("modified_header", sa.VARCHAR(), nullable=True))
+
+    op.execute(
+        "UPDATE feeds SET "
+        "raw_data = (SELECT raw_data FROM sources WHERE sources.id = feeds.source_id), "
+        "etag = (SELECT etag FROM sources WHERE sources.id = feeds.source_id), "
+        "modified_header = (SELECT modified_header FROM sources WHERE sources.id = feeds.source_id), "
+        "last_fetch = (SELECT last_fetch FROM sources WHERE sources.id = feeds.source_id)"
+    )
+
+    with op.batch_alter_table("entries", schema=None) as batch_op:
+        for column in SHARED_COLUMNS:
+            column_type = sa.TIMESTAMP() if column == "display_date" else sa.VARCHAR()
+            batch_op.add_column(sa.Column(column, column_type, nullable=True))
+
+    op.execute(
+        "UPDATE entries SET "
+        + ", ".join(
+            f"{column} = (SELECT {column} FROM source_entries WHERE source_entries.id = entries.source_entry_id)"
+            for column in SHARED_COLUMNS
+        )
+    )
+
+    # each entry gets back a copy of the blob of its source entry
+    op.create_table(
+        "entry_blob_copies",
+        sa.Column("entry_id", sa.Integer(), nullable=False),
+        sa.Column("content_full", blob_type(), nullable=True),
+        sa.Column("raw_data", blob_type(), nullable=True),
+        sa.PrimaryKeyConstraint("entry_id"),
+    )
+    op.execute(
+        "INSERT INTO entry_blob_copies (entry_id, content_full, raw_data) "
+        "SELECT entries.id, entry_blobs.content_full, entry_blobs.raw_data "
+        "FROM entries JOIN entry_blobs ON entry_blobs.source_entry_id = entries.source_entry_id"
+    )
+    op.execute("DELETE FROM entry_blobs")
+    with op.batch_alter_table("entry_blobs", schema=None, naming_convention=NAMING_CONVENTION) as batch_op:
+        batch_op.drop_constraint(foreign_key_name("entry_blobs", "source_entry_id"), type_="foreignkey")
+        batch_op.alter_column("source_entry_id", new_column_name="entry_id", existing_type=sa.Integer())
+    with op.batch_alter_table("entry_blobs", schema=None) as batch_op:
+        batch_op.create_foreign_key(
+            "fk_entry_blobs_entry_id_entries", "entries", ["entry_id"], ["id"], ondelete="CASCADE"
+        )
+    op.execute(
+        "INSERT INTO entry_blobs (entry_id, content_full, raw_data) "
+        "SELECT entry_id, content_full, raw_data FROM entry_blob_copies"
+    )
+    op.drop_table("entry_blob_copies")
+
+    # dropping the source_entry_id column drops its foreign key and unique constraint along with it
+    with op.batch_alter_table("entries", schema=None, naming_convention=NAMING_CONVENTION) as batch_op:
+        batch_op.drop_index(batch_op.f("ix_entries_source_entry_id"))
+        batch_op.drop_column("source_entry_id")
+        batch_op.alter_column("remote_id", existing_type=sa.VARCHAR(), nullable=False)
+        batch_op.alter_column("display_date", existing_type=sa.TIMESTAMP(), nullable=False)
+        batch_op.create_unique_constraint("uq_entries_feed_id_remote_id", ["feed_id", "remote_id"])
+        batch_op.create_index("ix_entries_title", ["title"], unique=False)
+        batch_op.create_index("ix_entries_username", ["username"], unique=False)
+        batch_op.create_index("entry_content_url", ["user_id", "content_url"], unique=False)
+
+    recreate_sort_indexes()
+
+    with op.batch_alter_table("feeds", schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f("ix_feeds_source_id"))
+        batch_op.drop_column("source_id")
+
+    op.drop_table("source_entries")
+    op.drop_table("sources")
+
+
+def recreate_sort_indexes():
+    # the table is recreated from its reflected schema on sqlite, which drops the sort direction of the
+    # index columns. without it the home timeline can't be ordered by walking the index
+    with op.batch_alter_table("entries", schema=None) as batch_op:
+        batch_op.drop_index("entry_sort_ts")
+        batch_op.drop_index("entry_rank")
+        batch_op.create_index("entry_sort_ts", [sa.text("sort_date DESC")], unique=False)
+        batch_op.create_index(
+            "entry_rank", ["user_id", sa.text("recent DESC"), "bucket", sa.text("sort_date DESC")], unique=False
+        )
@@ -0,0 +1,92 @@
+"""compress raw data and full content columns
+
+Revision ID: c7e19a4f5d26
+Revises: 8e4a7c1d2b90
+Create Date: 2026-10-19 11:48:52.903617
+
+"""
+
+from typing import Sequence, Union
+
+import sqlalchemy as sa
+from alembic import op
+
+from feedi import compression
+
+# revision identifiers, used by Alembic.
+revision: str = "c7e19a4f5d26"
+down_revision: Union[str, None] = "8e4a7c1d2b90"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+BATCH_SIZE = 500
+
+
+def convert_rows(table, key, columns, convert):
+    "Apply the convert function to the given columns of every row, in batches."
+    connection = op.get_bind()
+    column_list = ", ".join(columns)
+    last_key = -1
+    while True:
+        rows = connection.execute(
+            sa.text(f"SELECT {key}, {column_list} FROM {table} WHERE {key} > :last ORDER BY {key} LIMIT {BATCH_SIZE}"),
+            {"last": last_key},
+        ).all()
+        if not rows:
+            break
+
+        assignments = ", ".join(f"{column} = :{column}" for column in columns)
+        connection.execute(
+            sa.text(f"UPDATE {table} SET {assignments} WHERE {key} = :key"),
+            [dict(key=row[0], **{column: convert(value) for column, value in zip(columns, row[1:])}) for row in rows],
+        )
+        last_key = rows[-1][0]
+
+
+def compress(value):
+    if value is None or not isinstance(value, str):
+        return value
+    return compression.compress(value)
+
+
+def decompress(value):
+    return compression.decompress(value)
+
+
+def upgrade() -> None:
+    convert_rows("feeds", "id", ["raw_data"], compress)
+    convert_rows("entry_blobs", "entry_id", ["content_full", "raw_data"], compress)
+
+    op.create_table(
+        "compression_dictionaries",
+        sa.Column("id", sa.Integer(), nullable=False),
+        sa.Column("data", sa.LargeBinary(), nullable=False),
+        sa.Column("created", sa.TIMESTAMP(), nullable=False),
+        sa.PrimaryKeyConstraint("id"),
+    )
+
+    with op.batch_alter_table("feeds", schema=None) as batch_op:
+        batch_op.alter_column("raw_data", existing_type=sa.VARCHAR(), type_=sa.LargeBinary())
+
+    with op.batch_alter_table("entry_blobs", schema=None) as batch_op:
+        batch_op.alter_column("content_full", existing_type=sa.VARCHAR(), type_=sa.LargeBinary())
+        batch_op.alter_column("raw_data", existing_type=sa.VARCHAR(), type_=sa.LargeBinary())
+
+
+def downgrade() -> None:
+    # values compressed with a dictionary need it to be registered before decompressing
+    connection = op.get_bind()
+    for dictionary_id, data in connection.execute(sa.text("SELECT id, data FROM compression_dictionaries")):
+        compression.register_dictionary(dictionary_id, data)
+
+    convert_rows("entry_blobs", "entry_id", ["content_full", "raw_data"], decompress)
+    convert_rows("feeds", "id", ["raw_data"], decompress)
+
+    with op.batch_alter_table("entry_blobs", schema=None) as batch_op:
+        batch_op.alter_column("raw_data", existing_type=sa.LargeBinary(), type_=sa.VARCHAR())
+        batch_op.alter_column("content_full", existing_type=sa.LargeBinary(), type_=sa.VARCHAR())
+
+    with op.batch_alter_table("feeds", schema=None) as batch_op:
+        batch_op.alter_column("raw_data", existing_type=sa.LargeBinary(), type_=sa.VARCHAR())
+
+    op.drop_table("compression_dictionaries")
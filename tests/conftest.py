@@ -1,3 +1,4 @@
+import contextlib
 import os
 import re
 import uuid
@@ -5,12 +6,14 @@ import uuid
 import feedgen.feed as feedgen
 import httpretty
 import pytest
+import sqlalchemy as sa
 
 import feedi.app as feedi_app
 from feedi.models import db
 
 
-@pytest.fixture(scope="module")
+# the app registers its routes and starts its task runner once per process, so it is shared by all test modules
+@pytest.fixture(scope="session")
 def app():
     assert os.getenv("FLASK_ENV") == "testing", "not running in testing mode"
 
@@ -37,6 +40,10 @@ def client(app):
         # user registering not exposed to the web
         from feedi import models
 
+        # tests mock the same feed urls with different entries, and feeds share the source of their url
+        for model in [models.EntryBlob, models.Entry, models.SourceEntry, models.Feed, models.Source]:
+            db.session.execute(sa.delete(model))
+
         user = models.User(email=email)
         user.set_password("password")
         db.session.add(user)
@@ -59,7 +66,7 @@ def create_feed(client, domain, items, folder=None):
     )
 
     matches = re.search(r"/feeds/(\d+)/", response.request.path)
-    feed_id = matches and matches.group(1)
+    feed_id = matches and int(matches.group(1))
     return response, feed_id
 
 
@@ -83,6 +90,8 @@ def mock_feed(domain, items):
         entry.published(item["date"])
         entry.updated(item["date"])
         entry.description(item.get("description", "default description"))
+        if "content" in item:
+            entry.content(item["content"], type="CDATA")
 
         mock_request(entry_url, body=item.get("body", "<p>content!</p>"))
 
@@ -106,3 +115,22 @@ def extract_entry_ids(response):
         if e not in entry_ids:
             entry_ids.append(e)
     return entry_ids
+
+
+@contextlib.contextmanager
+def count_queries(app):
+    "Collect the sql statements sent to the db while in the context."
+    statements = []
+
+    def before_cursor_execute(_conn, _cursor, statement, *_args):
+        statements.append(statement)
+
+    with app.app_context():
+        engines = list(db.engines.values())
+    for engine in engines:
+        sa.event.listen(engine, "before_cursor_execute", before_cursor_execute)
+    try:
+        yield statements
+    finally:
+        for engine in engines:
+            sa.event.remove(engine, "before_cursor_execute", before_cursor_execute)
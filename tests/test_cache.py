@@ -0,0 +1,57 @@
+import gevent
+import pytest
+
+from feedi import cache
+
+
+def test_single_flight():
+    calls = []
+
+    def fetch(url):
+        calls.append(url)
+        gevent.sleep(0.01)
+        if url == "broken":
+            raise ValueError(url)
+        return url.upper()
+
+    flights = cache.SingleFlight()
+    greenlets = [gevent.spawn(flights.call, ("page", url), fetch, url) for url in ["a", "a", "b", "a"]]
+    gevent.joinall(greenlets)
+    assert [greenlet.value for greenlet in greenlets] == ["A", "A", "B", "A"]
+    assert calls == ["a", "b"]
+    assert flights.collapsed == {"page": 2}
+
+    # once finished, the next call is made again
+    assert flights.call(("page", "a"), fetch, "a") == "A"
+    assert calls == ["a", "b", "a"]
+
+    greenlets = [gevent.spawn(flights.call, ("page", "broken"), fetch, "broken") for _ in range(2)]
+    gevent.joinall(greenlets)
+    assert all(isinstance(greenlet.exception, ValueError) for greenlet in greenlets)
+    assert calls.count("broken") == 1
+
+
+def test_single_flight_interrupted():
+    flights = cache.SingleFlight(timeout_seconds=5)
+
+    owner = gevent.spawn(flights.call, ("page", "a"), gevent.sleep, 10)
+    gevent.sleep(0)
+    waiter = gevent.spawn(flights.call, ("page", "a"), gevent.sleep, 10)
+    gevent.sleep(0)
+
+    # killing the greenlet making the call doesn't leave the waiting ones blocked
+    owner.kill()
+    waiter.join(timeout=1)
+    assert waiter.ready()
+    assert isinstance(waiter.exception, RuntimeError)
+
+    # and the key is released for the next call
+    assert flights.call(("page", "a"), str.upper, "a") == "A"
+
+    # waiters give up on calls that take too long
+    flights = cache.SingleFlight(timeout_seconds=0.01)
+    owner = gevent.spawn(flights.call, ("page", "b"), gevent.sleep, 10)
+    gevent.sleep(0)
+    with pytest.raises(TimeoutError):
+        flights.call(("page", "b"), str.upper, "b")
+    owner.kill()
@@ -0,0 +1,59 @@
+import json
+
+import pytest
+
+from feedi import compression
+
+
+@pytest.fixture
+def dictionaries(monkeypatch):
+    "Isolate the registered dictionaries of the test from the rest of the process."
+    monkeypatch.setattr(compression, "_dictionaries", {})
+    monkeypatch.setattr(compression, "_current_dictionary", None)
+
+
+def test_compression_roundtrip(dictionaries):
+    text = "<p>some article content</p>" * 20
+    value = compression.compress(text)
+    assert value[:1] == compression.ZLIB
+    assert len(value) < len(text)
+    assert compression.decompress(value) == text
+
+    # without registered dictionaries, values are compressed without one
+    assert compression.compress(text, use_dictionary=True)[:1] == compression.ZLIB
+
+    # values stored before compression are read as is
+    assert compression.decompress(text) == text
+    assert compression.decompress(None) is None
+
+    with pytest.raises(ValueError):
+        compression.decompress(b"x" + value[1:])
+
+
+def test_compression_dictionary(dictionaries):
+    samples = [
+        json.dumps({"title": f"entry {i}", "link": f"https://example.com/{i}", "author": "someone"}) for i in range(20)
+    ]
+    dictionary = compression.train_dictionary(samples)
+    assert 0 < len(dictionary) <= compression.MAX_DICTIONARY_SIZE
+    assert b'"author": "someone"' in dictionary
+
+    compression.register_dictionary(1, dictionary)
+    text = json.dumps({"title": "other entry", "link": "https://example.com/other", "author": "someone"})
+    value = compression.compress(text, use_dictionary=True)
+    assert value[:1] == compression.ZLIB_DICT
+    assert len(value) < len(compression.compress(text))
+    assert compression.decompress(value) == text
+
+    # the most recent dictionary is used for new values, older ones are still readable
+    compression.register_dictionary(2, dictionary)
+    assert compression.decompress(compression.compress(text, use_dictionary=True)) == text
+    assert compression.decompress(value) == text
+
+    # dictionaries that aren't registered are loaded on demand
+    compression._dictionaries.clear()
+    with pytest.raises(ValueError):
+        compression.decompress(value)
+    loaded = []
+    assert compression.decompress(value, lambda dictionary_id: loaded.append(dictionary_id) or dictionary) == text
+    assert loaded == [1]
@@ -0,0 +1,136 @@
+import datetime as dt
+import json
+import uuid
+
+import sqlalchemy as sa
+
+from feedi import compression, models
+from feedi.models import db
+
+
+def create_user():
+    user = models.User(email=f"user-{uuid.uuid4()}@mail.com")
+    user.set_password("password")
+    db.session.add(user)
+    db.session.commit()
+    return user
+
+
+def create_entry(user, remote_id, **values):
+    now = dt.datetime.utcnow()
+    source_entry = models.SourceEntry(remote_id=remote_id, display_date=now, sort_date=now, **values)
+    entry = models.Entry(user_id=user.id, source_entry=source_entry, sort_date=now)
+    db.session.add(entry)
+    db.session.commit()
+    return entry
+
+
+def test_entry_blobs(app):
+    with app.app_context():
+        user = create_user()
+        entry = create_entry(user, "blob-entry")
+        assert entry.source_entry.blob is None
+        assert entry.content_full is None
+
+        # setting a proxied column creates the blob row
+        entry.content_full = "<p>full article</p>"
+        db.session.commit()
+        assert db.session.get(models.EntryBlob, entry.source_entry_id).content_full == "<p>full article</p>"
+
+        # upserts with missing values don't discard the stored ones
+        models.EntryBlob.upsert(entry.source_entry_id, raw_data='{"title": "entry"}')
+        db.session.commit()
+        db.session.expire_all()
+        assert entry.content_full == "<p>full article</p>"
+        assert entry.raw_data == '{"title": "entry"}'
+
+        models.EntryBlob.upsert(entry.source_entry_id, content_full="<p>updated article</p>")
+        db.session.commit()
+        db.session.expire_all()
+        assert entry.content_full == "<p>updated article</p>"
+        assert entry.raw_data == '{"title": "entry"}'
+
+        # upserts without values don't create empty blobs
+        other = create_entry(user, "no-blob-entry")
+        models.EntryBlob.upsert(other.source_entry_id)
+        db.session.commit()
+        assert db.session.get(models.EntryBlob, other.source_entry_id) is None
+
+        # blobs are deleted along with their source entry, once no feed has it
+        source_entry_id = entry.source_entry_id
+        db.session.delete(entry)
+        db.session.commit()
+        models.SourceEntry.delete_orphans([source_entry_id])
+        db.session.commit()
+        assert db.session.get(models.SourceEntry, source_entry_id) is None
+        assert db.session.get(models.EntryBlob, source_entry_id) is None
+
+
+def test_train_compression_dictionary(app, monkeypatch):
+    monkeypatch.setattr(compression, "_dictionaries", {})
+    monkeypatch.setattr(compression, "_current_dictionary", None)
+
+    with app.app_context():
+        user = create_user()
+        entry_ids = []
+        for i in range(20):
+            raw_data = json.dumps({"title": f"entry {i}", "link": f"https://dictionary.com/{i}", "author": "someone"})
+            entry_ids.append(create_entry(user, f"dictionary-{i}", raw_data=raw_data).source_entry_id)
+
+    result = app.test_cli_runner().invoke(args=["db", "train-dictionary", "--sample-size", "20", "--recompress"])
+    assert result.exit_code == 0
+
+    with app.app_context():
+        if db.engine.dialect.name != "sqlite":
+            # the backend compresses the values itself
+            assert not db.session.scalars(db.select(models.CompressionDictionary)).all()
+            return
+
+        stored = db.session.scalar(
+            sa.text("SELECT raw_data FROM entry_blobs WHERE source_entry_id = :id"), {"id": entry_ids[0]}
+        )
+        assert stored[:1] == compression.ZLIB_DICT
+
+    # other processes load the dictionary when they first read a value compressed with it,
+    # also while their session holds the single writer connection
+    monkeypatch.setattr(compression, "_dictionaries", {})
+    monkeypatch.setattr(compression, "_current_dictionary", None)
+    with app.app_context():
+        user = db.session.merge(user)
+        now = dt.datetime.utcnow()
+        source_entry = models.SourceEntry(remote_id="pending", display_date=now, sort_date=now)
+        db.session.add(models.Entry(user_id=user.id, source_entry=source_entry, sort_date=now))
+        db.session.flush()
+        source_entry = db.session.get(models.SourceEntry, entry_ids[0])
+        assert json.loads(source_entry.raw_data)["title"] == "entry 0"
+        db.session.rollback()
+
+
+def test_purge_raw_data(app, monkeypatch):
+    # the task runs in the app of the task runner, with its own config
+    from feedi import tasks
+
+    old_date = dt.datetime.utcnow() - dt.timedelta(days=60)
+    with app.app_context():
+        user = create_user()
+        old = create_entry(user, "old", created=old_date, raw_data="{}", content_full="<p>article</p>")
+        old_id = old.id
+        old_raw_id = create_entry(user, "old-raw", created=old_date, raw_data="{}").source_entry_id
+        recent_id = create_entry(user, "recent", raw_data="{}").id
+
+    # raw data is kept by default
+    result = app.test_cli_runner().invoke(args=["feed", "purge-raw"])
+    assert result.exit_code == 0
+    with app.app_context():
+        assert db.session.get(models.Entry, old_id).raw_data == "{}"
+
+    monkeypatch.setitem(tasks.app.config, "RAW_DATA_RETENTION_DAYS", 30)
+    result = app.test_cli_runner().invoke(args=["feed", "purge-raw"])
+    assert result.exit_code == 0
+
+    with app.app_context():
+        old = db.session.get(models.Entry, old_id)
+        assert old.raw_data is None
+        assert old.content_full == "<p>article</p>"
+        assert db.session.get(models.EntryBlob, old_raw_id) is None
+        assert db.session.get(models.Entry, recent_id).raw_data == "{}"
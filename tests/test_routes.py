@@ -1,7 +1,12 @@
 import datetime as dt
+import os
 import re
 
-from tests.conftest import create_feed, extract_entry_ids, mock_feed, mock_request
+import httpretty
+import pytest
+import sqlalchemy as sa
+
+from tests.conftest import count_queries, create_feed, extract_entry_ids, mock_feed, mock_request
 
 
 def test_feed_add(client):
@@ -106,6 +111,37 @@ def test_home_sorting(client):
     assert response.text.find("f3-a1") < response.text.find("f2-a13")
 
 
+def test_home_sorting_recency_boundary(app, client):
+    # feed1: 1 post 12 hs ago
+    date12h = dt.datetime.now(dt.timezone.utc) - dt.timedelta(hours=12)
+    create_feed(client, "feed1.com", [{"title": "f1-a1", "date": date12h}])
+
+    # feed2: 20 posts < 12 hs ago
+    items = []
+    for i in range(1, 21):
+        items.append({"title": f"f2-a{i}", "date": date12h + dt.timedelta(hours=1, minutes=i)})
+    create_feed(client, "feed2.com", items)
+
+    response = client.get("/")
+    assert response.text.find("f1-a1") < response.text.find("f2-a20")
+
+    # move the infrequent post past the recency boundary, then update the ranking
+    with app.app_context():
+        from feedi import models
+        from feedi.models import db
+
+        date30h = dt.datetime.utcnow() - dt.timedelta(hours=30)
+        db.session.execute(db.update(models.Entry).where(models.Entry.title == "f1-a1").values(sort_date=date30h))
+        models.Entry.update_ranking()
+        db.session.commit()
+
+    # now all the recent posts go first, regardless of their feed frequency,
+    # pushing the infrequent one out of the first page
+    response = client.get("/")
+    assert "f2-a20" in response.text
+    assert "f1-a1" not in response.text
+
+
 def test_home_pagination(app, client):
     now = dt.datetime.now(dt.timezone.utc)
     items = []
@@ -192,6 +228,407 @@ def test_sync_updates(client):
     assert "my-third-article" in response.text
 
 
+def test_entry_previews(app, client):
+    description = "<div><p>" + "lorem ipsum " * 60 + "</p></div>"
+    response, feed_id = create_feed(
+        client, "feed1.com", [{"title": "my-first-article", "date": "2023-10-01 00:00Z", "description": description}]
+    )
+    assert "lorem ipsum " * 10 in response.text
+    assert "lorem ipsum " * 50 not in response.text, "the preview should be truncated"
+    preview = re.search(r'<div class="content".*?>(.*?)</div>', response.text, re.DOTALL).group(1)
+
+    from feedi import models
+
+    with app.app_context():
+        entry = models.db.session.scalar(sa.select(models.Entry).filter_by(feed_id=feed_id))
+        assert entry.content_preview.endswith("…</p></div>")
+        assert len(entry.content_excerpt) == 101
+
+        # entries saved before previews were computed at sync time
+        models.db.session.execute(sa.update(models.SourceEntry).values(content_preview=None, content_excerpt=None))
+        models.db.session.commit()
+
+    response = client.get(f"/feeds/{feed_id}/entries")
+    assert preview in response.text, "entries without preview should be rendered the same"
+
+    result = app.test_cli_runner().invoke(args=["feed", "backfill-previews"])
+    assert result.exit_code == 0
+
+    with app.app_context():
+        entry = models.db.session.scalar(sa.select(models.Entry).filter_by(feed_id=feed_id))
+        assert entry.content_preview.endswith("…</p></div>")
+
+    response = client.get(f"/feeds/{feed_id}/entries")
+    assert preview in response.text
+
+
+def test_feed_full_content(client):
+    article = "<p>" + "lorem ipsum " * 100 + '</p><img src="/image.png">'
+    excerpt = "<p>" + "lorem ipsum " * 100 + "… continue reading</p>"
+    response, _feed_id = create_feed(
+        client,
+        "feed1.com",
+        [
+            {"title": "full-article", "date": "2023-10-01 00:00Z", "content": article, "body": "<p>scraped</p>"},
+            {"title": "excerpt-article", "date": "2023-10-02 00:00Z", "content": excerpt},
+        ],
+    )
+    entry_ids = extract_entry_ids(response)
+    assert len(entry_ids) == 2
+
+    # the full article is shown as included in the feed, without scraping its page
+    response = client.get(f"/entries/{entry_ids[1]}")
+    assert "lorem ipsum " * 100 in response.text
+    assert 'src="http://feed1.com/image.png"' in response.text
+    assert "scraped" not in response.text
+
+    from feedi import models
+
+    with client.application.app_context():
+        entry = models.db.session.get(models.Entry, entry_ids[0])
+        assert entry.content_full is None, "excerpts aren't taken as full content"
+
+
+def test_content_prefetch(app, client):
+    paragraph = "<p>" + "lorem ipsum dolor sit amet " * 20 + "</p>"
+    article = f"<html><body><article>{paragraph * 3}</article></body></html>"
+    items = [{"title": f"article-{i}", "date": f"2023-10-0{i + 1} 00:00Z", "body": article} for i in range(3)]
+    response, _feed_id = create_feed(client, "prefetch.com", items)
+    entry_ids = extract_entry_ids(response)
+
+    from feedi import models
+
+    # one of the entries is opened before it's prefetched
+    models.prefetch_stats.clear()
+    assert "lorem ipsum" in client.get(f"/entries/{entry_ids[0]}").text
+
+    with app.app_context():
+        candidates = [
+            candidate for candidate in models.Entry.select_prefetch(100, 100) if "prefetch.com" in candidate[1]
+        ]
+        assert candidates == [
+            (int(entry_ids[1]), "http://prefetch.com/article-1"),
+            (int(entry_ids[2]), "http://prefetch.com/article-0"),
+        ]
+        assert models.prefetch_stats == {"opened": 1, "prefetched": 0}
+
+    result = app.test_cli_runner().invoke(args=["feed", "prefetch"])
+    assert result.exit_code == 0
+
+    with app.app_context():
+        assert not [candidate for candidate in models.Entry.select_prefetch(100, 100) if "prefetch.com" in candidate[1]]
+        assert not models.prefetch_stats, "the stats are reset after being reported"
+
+    client.get(f"/entries/{entry_ids[1]}")
+    assert models.prefetch_stats == {"opened": 1, "prefetched": 1}
+
+
+def test_new_entry_events(app, client):
+    _response, feed_id = create_feed(client, "feed1.com", [{"title": "my-first-article", "date": "2023-10-01 00:00Z"}])
+    assert 'hx-sse="connect:/events' in client.get("/").text
+
+    from feedi import events, models
+
+    with app.app_context():
+        user_id = models.db.session.scalar(sa.select(models.Feed.user_id).filter_by(id=feed_id))
+
+    with events.subscribe(user_id) as queue:
+        mock_feed(
+            "feed1.com",
+            [
+                {"title": "my-first-article", "date": "2023-10-01 00:00Z"},
+                {"title": "my-second-article", "date": "2023-10-02 00:00Z"},
+                {"title": "my-third-article", "date": "2023-10-03 00:00Z"},
+            ],
+        )
+        client.post(f"/feeds/{feed_id}/entries")
+        assert queue.get_nowait() == ("new-entries", {"count": 2})
+
+        # syncs that don't find anything new don't notify
+        client.post(f"/feeds/{feed_id}/entries")
+        assert queue.empty()
+
+    assert events.encode("new-entries", "<a>\n2 new entries</a>") == (
+        "event: new-entries\ndata: <a>\ndata: 2 new entries</a>\n\n"
+    )
+
+
+def test_raw_data_debug(client):
+    response, feed_id = create_feed(client, "feed1.com", [{"title": "my-first-article", "date": "2023-10-01 00:00Z"}])
+    entry_id = extract_entry_ids(response)[0]
+
+    response = client.get(f"/feeds/{feed_id}/debug")
+    assert response.status_code == 200
+    assert response.json["title"] == "feed1.com feed"
+
+    response = client.get(f"/entries/{entry_id}/debug")
+    assert response.status_code == 200
+    assert response.json["title"] == "my-first-article"
+
+
+def test_conditional_responses(app, client):
+    import time
+    from unittest import mock
+
+    response, feed_id = create_feed(client, "feed1.com", [{"title": "my-first-article", "date": "2023-10-01 00:00Z"}])
+    entry_id = extract_entry_ids(response)[0]
+
+    for url in ["/", f"/feeds/{feed_id}/debug", f"/entries/{entry_id}/debug"]:
+        response = client.get(url)
+        assert response.status_code == 200
+        assert response.headers["Cache-Control"] == "private, no-cache"
+        etag = response.headers["ETag"]
+
+        response = client.get(url, headers={"If-None-Match": etag})
+        assert response.status_code == 304
+        assert not response.data
+
+        # htmx requests get a different version of the pages
+        response = client.get(url, headers={"If-None-Match": etag, "HX-Request": "true"})
+        assert response.status_code == 200
+
+    # stored articles are revalidated without loading them
+    with app.app_context():
+        from feedi import models
+
+        models.db.session.get(models.Entry, entry_id).content_full = "<p>stored article</p>"
+        models.db.session.commit()
+    response = client.get(f"/entries/{entry_id}")
+    assert "stored article" in response.text
+    with count_queries(app) as statements:
+        response = client.get(f"/entries/{entry_id}", headers={"If-None-Match": response.headers["ETag"]})
+    assert response.status_code == 304
+    assert not [statement for statement in statements if "content_full" in statement.split("FROM")[0]]
+
+    etag = client.get("/").headers["ETag"]
+    client.put(f"/favorites/{entry_id}")
+    response = client.get("/", headers={"If-None-Match": etag})
+    assert response.status_code == 200, "the home page should change when an entry changes"
+
+    etag = response.headers["ETag"]
+    mock_feed("feed1.com", [{"title": "my-second-article", "date": "2023-10-02 00:00Z"}])
+    client.post(f"/feeds/{feed_id}/entries")
+    response = client.get("/", headers={"If-None-Match": etag})
+    assert response.status_code == 200, "the home page should change after a sync"
+    assert "my-second-article" in response.text
+
+    etag = response.headers["ETag"]
+    with app.app_context():
+        models.db.session.execute(sa.delete(models.Entry).filter_by(id=int(entry_id)))
+        models.db.session.commit()
+    response = client.get("/", headers={"If-None-Match": etag})
+    assert response.status_code == 200, "the home page should change after a purge"
+
+    etag = response.headers["ETag"]
+    assert client.get("/", headers={"If-None-Match": etag}).status_code == 304
+    with mock.patch("time.time", return_value=time.time() + 3600):
+        response = client.get("/", headers={"If-None-Match": etag})
+    assert response.status_code == 200, "the home page should be rendered again after a while"
+
+
+def test_purge_old_entries(app, client):
+    now = dt.datetime.now(dt.timezone.utc)
+    items = [{"title": f"f1-a{i}", "date": now - dt.timedelta(days=10, hours=i)} for i in range(15)]
+    response, feed1_id = create_feed(client, "feed1.com", items)
+    items = [{"title": f"f2-a{i}", "date": now - dt.timedelta(days=10, hours=i)} for i in range(15)]
+    create_feed(client, "feed2.com", items)
+
+    # pin one of the oldest entries of feed1
+    second_page = f"{(now + dt.timedelta(hours=1)).timestamp()}:2"
+    response = client.get(f"/feeds/{feed1_id}/entries?page={second_page}")
+    pinned_id = extract_entry_ids(response)[-1]
+    assert client.put(f"/pinned/{pinned_id}").status_code == 200
+
+    # lower the retention of feed1 so its entries are considered old
+    response = client.post(
+        f"/feeds/{feed1_id}", data={"name": "feed1.com", "url": "http://feed1.com/feed", "delete_after_days": "5"}
+    )
+    assert response.status_code == 302
+
+    result = app.test_cli_runner().invoke(args=["feed", "purge"])
+    assert result.exit_code == 0
+
+    # only the minimum amount of feed1 entries is kept, plus the pinned one
+    response = client.get(f"/feeds/{feed1_id}/entries")
+    assert "f1-a0" in response.text
+    assert "f1-a9" in response.text
+    response = client.get(f"/feeds/{feed1_id}/entries?page={second_page}")
+    assert "f1-a10" not in response.text
+    assert "f1-a13" not in response.text
+    assert "f1-a14" in response.text
+
+    # feed2 entries are within the default retention
+    client.post("/session/hide_seen")
+    response = client.get("/?q=f2-a14")
+    assert "f2-a14" in response.text
+
+
+def test_db_maintain(app, client):
+    items = [{"title": f"f1-a{i}", "date": "2023-10-01 00:00Z"} for i in range(30)]
+    _response, feed_id = create_feed(client, "feed1.com", items)
+    client.delete(f"/feeds/{feed_id}")
+
+    result = app.test_cli_runner().invoke(args=["db", "maintain"])
+    assert result.exit_code == 0
+
+    with app.app_context():
+        from feedi import models
+
+        stats = models.db_stats()
+        if models.db.engine.dialect.name != "sqlite":
+            return
+
+        assert stats["free"] == 0, "deleted pages should be returned to the filesystem"
+        assert stats["wal"] == 0, "the write-ahead log should be truncated"
+
+
+def test_db_connection_roles(app, client):
+    from feedi import models, tasks
+
+    with app.app_context():
+        # reads go to the read only connections until the session writes
+        assert models.db.session.get_bind(clause=sa.select(models.Feed)) is models.db.engines["reader"]
+        models.db.session.execute(sa.update(models.Feed).values(name=models.Feed.name))
+        assert models.db.session.get_bind(clause=sa.select(models.Feed)) is models.db.engine
+        models.db.session.commit()
+        assert models.db.session.get_bind(clause=sa.select(models.Feed)) is models.db.engines["reader"]
+
+        with pytest.raises(sa.exc.DBAPIError), models.db.engines["reader"].connect() as connection:
+            connection.execute(sa.delete(models.Feed))
+
+        stats = models.connection_stats()
+
+    # the page cache budget is shared between all connections of the process, including the tasks app ones
+    with tasks.app.app_context():
+        stats += models.connection_stats()
+    assert sum(pool["cache_total"] for pool in stats) <= app.config["DB_CACHE_MB"] * 1024**2
+
+
+def test_sync_shared_source(app, client):
+    create_feed(client, "shared.com", [{"title": "shared-a1", "date": "2023-10-01 00:00Z"}])
+
+    # another user follows the same source, with a slightly different url
+    with app.app_context():
+        from feedi import models
+
+        user = models.User(email="shared-source@mail.com")
+        user.set_password("password")
+        models.db.session.add(user)
+        models.db.session.commit()
+
+    other_client = app.test_client()
+    other_client.post("/auth/login", data={"email": "shared-source@mail.com", "password": "password"})
+    other_client.post("/feeds/new", data={"type": "rss", "name": "my shared", "url": "HTTP://Shared.com:80/feed"})
+
+    # a new entry is published and both feeds are due for a sync
+    mock_feed(
+        "shared.com",
+        [{"title": "shared-a2", "date": "2023-10-02 00:00Z"}, {"title": "shared-a1", "date": "2023-10-01 00:00Z"}],
+    )
+    with app.app_context():
+        source = models.db.session.scalar(sa.select(models.Source).filter_by(url="http://shared.com/feed"))
+        assert [feed.name for feed in source.feeds] == ["shared.com", "my shared"]
+        source.last_fetch = None
+        models.db.session.commit()
+
+    httpretty.latest_requests().clear()
+    result = app.test_cli_runner().invoke(args=["feed", "sync"])
+    assert result.exit_code == 0
+
+    feed_requests = [r for r in httpretty.latest_requests() if r.headers["Host"] == "shared.com" and r.path == "/feed"]
+    assert len(feed_requests) == 1, "the shared source should be fetched once"
+
+    assert "shared-a2" in client.get("/?q=shared").text
+    response = other_client.get("/?q=shared")
+    assert "shared-a2" in response.text
+
+    with app.app_context():
+        # the entry content is stored once, and each user has their own state on it
+        source_entries = models.db.session.scalars(sa.select(models.SourceEntry).filter_by(title="shared-a2")).all()
+        assert len(source_entries) == 1
+        entries = models.db.session.scalars(
+            sa.select(models.Entry).filter_by(source_entry_id=source_entries[0].id)
+        ).all()
+        assert len(entries) == 2
+
+    entry_id = extract_entry_ids(response)[0]
+    assert other_client.put(f"/favorites/{entry_id}").status_code == 204
+    assert "shared-a2" in other_client.get("/favorites").text
+    assert "shared-a2" not in client.get("/favorites").text
+
+
+def test_search_full_content(app, client):
+    items = [{"title": "search-a1", "date": "2023-10-01 00:00Z"}, {"title": "search-a2", "date": "2023-10-02 00:00Z"}]
+    _response, feed_id = create_feed(client, "search.com", items)
+
+    from feedi import models
+
+    with app.app_context():
+        entry = models.db.session.scalar(sa.select(models.Entry).filter_by(feed_id=feed_id, title="search-a1"))
+        entry.content_full = "<p>an article about Haystacks</p>"
+        models.db.session.commit()
+
+    # the stored article is searched too, although it's compressed on some backends
+    response = client.get("/?q=haystacks")
+    assert "search-a1" in response.text
+    assert "search-a2" not in response.text
+
+
+def test_entry_list_queries(app, client):
+    _response, feed_id = create_feed(client, "feed1.com", [{"title": "f1-a1", "date": "2023-10-01 00:00Z"}])
+
+    with count_queries(app) as statements:
+        client.get("/")
+    home_queries = len(statements)
+
+    with count_queries(app) as statements:
+        client.get(f"/feeds/{feed_id}/entries")
+    feed_queries = len(statements)
+
+    # user, last change (for the etag), page entries and pinned entries
+    assert home_queries == 4
+    assert feed_queries == 4
+
+    for i in range(2, 6):
+        create_feed(client, f"feed{i}.com", [{"title": f"f{i}-a1", "date": "2023-10-01 00:00Z"}])
+
+    with count_queries(app) as statements:
+        response = client.get("/")
+    assert "f5-a1" in response.text
+    assert len(statements) == home_queries, "the amount of queries shouldn't depend on the amount of feeds"
+
+
+def test_entry_card_cache(app, client):
+    response, feed_id = create_feed(client, "feed1.com", [{"title": "f1-a1", "date": "2023-10-01 00:00Z"}])
+    entry_id = int(extract_entry_ids(response)[0])
+
+    from feedi import models
+
+    models.entry_card_cache.clear()
+    response = client.get(f"/feeds/{feed_id}/entries")
+    assert models.entry_card_cache.get(entry_id)
+    assert models.entry_card_cache.size > 0
+
+    # cached cards are rendered the same
+    assert client.get(f"/feeds/{feed_id}/entries").text == response.text
+
+    # the card reflects state changes
+    favorite_button = re.compile(r'class="[^"]*toggled"\s+title="Favorite"')
+    assert not favorite_button.search(response.text)
+    client.put(f"/favorites/{entry_id}")
+    assert not models.entry_card_cache.get(entry_id)
+    response = client.get(f"/feeds/{feed_id}/entries")
+    assert favorite_button.search(response.text)
+
+    # the least recently used cards are evicted when over the memory cap
+    max_bytes = models.entry_card_cache.max_bytes
+    models.entry_card_cache.max_bytes = models.entry_card_cache.size
+    models.entry_card_cache.set(-1, {"variant": "x" * 100})
+    assert not models.entry_card_cache.get(entry_id)
+    assert models.entry_card_cache.get(-1)
+    models.entry_card_cache.max_bytes = max_bytes
+
+
 def test_sync_between_pages(client):
     # TODO verify pagination behaves reasonably if new feeds/entries
     # are added between fetching one page and the next
@@ -333,6 +770,277 @@ def test_add_external_entry(client):
     assert "There’s a kind of zen flow" in response.text
 
 
+def test_autocomplete(app, client):
+    create_feed(client, "hackernews.com", [{"title": "a1", "date": "2023-10-01 00:00Z"}], folder="tech")
+    _response, feed_id = create_feed(client, "news.ycombinator.com", [{"title": "a2", "date": "2023-10-01 00:00Z"}])
+
+    def options(term):
+        response = client.get("/autocomplete", query_string={"q": term})
+        return [option.strip() for option in re.findall(r"</span>([^<]+)</a>", response.text)]
+
+    # prefixes before words before other substrings
+    assert options("news")[:2] == ["news.ycombinator.com", "hackernews.com"]
+    assert options("tec") == ["tech", "Search: tec"]
+    assert "hackernews.com" in options("hnws"), "characters in order should match"
+    assert "Favorites" in options("favs")
+
+    # the index doesn't need the db
+    with count_queries(app) as statements:
+        options("news")
+    assert len(statements) == 1, "only the user should be loaded"
+
+    client.post(f"/feeds/{feed_id}", data={"name": "yc", "url": "http://news.ycombinator.com/feed", "folder": "misc"})
+    assert "yc" in options("yc")
+    assert "misc" in options("misc")
+    assert "news.ycombinator.com" not in options("news")
+
+
+def test_send_to_kindle(app, client):
+    from unittest import mock
+
+    from feedi import email, models
+
+    paragraph = "<p>" + "lorem ipsum dolor sit amet " * 20 + "</p>"
+    urls = [f"http://kindle.com/article-{i}" for i in range(2)]
+    for i, url in enumerate(urls):
+        mock_request(
+            url, body=f"<html><head><title>Article {i}</title></head><article>{paragraph * 3}</article></html>"
+        )
+
+    with app.app_context():
+        models.db.session.execute(sa.update(models.User).values(kindle_email="reader@kindle.com"))
+        models.db.session.commit()
+
+    # the request only queues the delivery
+    with mock.patch("feedi.tasks.deliver_to_kindle") as deliver:
+        for url in urls:
+            assert client.post("/entries/kindle", query_string={"url": url}).status_code == 204
+        assert deliver.call_count == 2
+
+    httpretty.latest_requests().clear()
+    with mock.patch("smtplib.SMTP") as smtp:
+        smtp.return_value.noop.return_value = (250, b"OK")
+        smtp.return_value.sendmail.side_effect = [None, ConnectionResetError("dropped")]
+
+        assert app.test_cli_runner().invoke(args=["feed", "kindle"]).exit_code == 0
+        assert smtp.return_value.login.call_count == 1, "the deliveries should share the smtp session"
+        page_requests = [r for r in httpretty.latest_requests() if r.headers["Host"] == "kindle.com"]
+        assert len(page_requests) == 2, "each page should be fetched once for both the article and the entry"
+
+        with app.app_context():
+            sent, failed = models.db.session.scalars(sa.select(models.KindleDelivery).order_by("id"))
+            assert sent.status == models.KindleDelivery.SENT
+            assert failed.status == models.KindleDelivery.QUEUED
+            assert failed.attempts == 1
+            assert failed.error == "dropped"
+            assert failed.next_attempt > dt.datetime.utcnow(), "the retry should wait"
+
+            # the user sees the result of the deliveries
+            response = client.get("/auth/kindle")
+            assert urls[0] in response.text and "sent" in response.text
+            assert urls[1] in response.text and "queued" in response.text and "dropped" in response.text
+
+            entry = models.db.session.scalar(sa.select(models.Entry).filter_by(content_url=urls[0]))
+            assert entry.sent_to_kindle
+            assert "lorem ipsum" in entry.content_full
+
+            # the retry happens in a later run
+            failed.next_attempt = dt.datetime.utcnow()
+            models.db.session.commit()
+
+        smtp.return_value.sendmail.side_effect = None
+        assert app.test_cli_runner().invoke(args=["feed", "kindle"]).exit_code == 0
+        assert smtp.return_value.login.call_count == 2, "a new session should replace the failed one"
+
+        with app.app_context():
+            statuses = models.db.session.scalars(sa.select(models.KindleDelivery.status)).all()
+            assert statuses == [models.KindleDelivery.SENT] * 2
+
+        # the stored article is reused when sending it again
+        httpretty.latest_requests().clear()
+        with mock.patch("feedi.tasks.deliver_to_kindle"):
+            assert client.post("/entries/kindle", query_string={"url": urls[0]}).status_code == 204
+
+        # the delivery is saved as sending before the email goes out, so it's not sent twice if saving the result fails
+        statuses_on_send = []
+
+        def sendmail(*_args):
+            with models.db.engine.connect() as connection:
+                statuses_on_send.append(
+                    connection.scalar(sa.select(models.KindleDelivery.status).order_by(models.KindleDelivery.id.desc()))
+                )
+
+        smtp.return_value.sendmail.side_effect = sendmail
+        assert app.test_cli_runner().invoke(args=["feed", "kindle"]).exit_code == 0
+        assert smtp.return_value.sendmail.call_count == 4
+        assert statuses_on_send == [models.KindleDelivery.SENDING]
+        assert not [r for r in httpretty.latest_requests() if r.headers["Host"] == "kindle.com"]
+        email.disconnect()
+
+        # errors that retrying won't fix fail the delivery right away
+        with mock.patch("feedi.tasks.deliver_to_kindle"):
+            assert client.post("/entries/kindle", query_string={"url": urls[1]}).status_code == 204
+        with app.app_context():
+            models.db.session.execute(sa.update(models.User).values(kindle_email=None))
+            models.db.session.commit()
+        assert app.test_cli_runner().invoke(args=["feed", "kindle"]).exit_code == 0
+        assert smtp.return_value.sendmail.call_count == 4
+
+        with app.app_context():
+            delivery = models.db.session.scalar(
+                sa.select(models.KindleDelivery).order_by(models.KindleDelivery.id.desc())
+            )
+            assert delivery.status == models.KindleDelivery.FAILED
+            assert delivery.attempts == 1
+            assert delivery.error == "no kindle email configured"
+
+
+def test_image_proxy(app, client):
+    import io
+    import shutil
+
+    from PIL import Image
+
+    from feedi import thumbnails
+
+    for name in ["wide", "other"]:
+        output = io.BytesIO()
+        Image.frombytes("RGB", (2000, 1000), os.urandom(2000 * 1000 * 3)).save(output, "PNG")
+        httpretty.register_uri(httpretty.GET, f"http://images.com/{name}.png", body=output.getvalue(), priority=1)
+
+    with app.test_request_context():
+        shutil.rmtree(thumbnails.cache_dir(), ignore_errors=True)
+        wide_url = thumbnails.proxy_url("http://images.com/wide.png", 400)
+        other_url = thumbnails.proxy_url("http://images.com/other.png", 400)
+        assert client.get(wide_url.replace("w=400", "w=500")).status_code == 404
+        assert client.get(wide_url.replace("wide.png", "other.png")).status_code == 404, "urls should be signed"
+
+    httpretty.latest_requests().clear()
+    response = client.get(wide_url)
+    assert response.status_code == 200
+    assert response.mimetype == "image/webp"
+    assert response.cache_control.max_age == thumbnails.MAX_AGE_SECONDS
+    image = Image.open(io.BytesIO(response.data))
+    assert image.size == (400, 200)
+
+    # later requests are served from disk
+    assert client.get(wide_url).data == response.data
+    assert len(httpretty.latest_requests()) == 1
+
+    # the least recently used thumbnails are evicted when the cache is full
+    app.config["THUMBNAIL_CACHE_MB"] = len(response.data) * 1.5 / 1024**2
+    assert client.get(other_url).status_code == 200
+    with app.app_context():
+        assert [path for path, _mtime, _size in thumbnails.cached_files()] == [
+            thumbnails.cache_path("http://images.com/other.png", 400)
+        ]
+    app.config["THUMBNAIL_CACHE_MB"] = 256
+
+    # images that can't be fetched fall back to the original url
+    with app.test_request_context():
+        missing_url = thumbnails.proxy_url("http://images.com/missing.png", 96)
+    httpretty.register_uri(httpretty.GET, "http://images.com/missing.png", status=404, priority=1)
+    response = client.get(missing_url)
+    assert response.status_code == 302
+    assert response.location == "http://images.com/missing.png"
+
+    # and aren't downloaded again on every request
+    httpretty.latest_requests().clear()
+    assert client.get(missing_url).status_code == 302
+    assert not httpretty.latest_requests()
+
+    thumbnails.failed_sources.clear()
+    with app.app_context():
+        shutil.rmtree(thumbnails.cache_dir())
+
+
+def test_sync_thumbnails(app, client):
+    import io
+    import shutil
+
+    from PIL import Image
+
+    from feedi import models, thumbnails
+
+    output = io.BytesIO()
+    Image.new("RGB", (1000, 500), "blue").save(output, "PNG")
+    media_url = "http://thumbs.com/photo.png"
+    httpretty.register_uri(httpretty.GET, media_url, body=output.getvalue(), priority=1)
+
+    create_feed(client, "thumbs.com", [{"title": "thumbs-a1", "date": "2023-10-01 00:00Z"}])
+
+    # the thumbnails of new entries are created when the feed is synced
+    item = {"title": "thumbs-a2", "date": "2023-10-02 00:00Z", "description": f'<img src="{media_url}">'}
+    mock_feed("thumbs.com", [item, {"title": "thumbs-a1", "date": "2023-10-01 00:00Z"}])
+    with app.app_context():
+        models.db.session.execute(
+            sa.update(models.Source).filter_by(url="http://thumbs.com/feed").values(last_fetch=None)
+        )
+        models.db.session.commit()
+
+    result = app.test_cli_runner().invoke(args=["feed", "sync"])
+    assert result.exit_code == 0
+
+    with app.app_context():
+        for width in [thumbnails.CARD_WIDTH, thumbnails.WIDE_CARD_WIDTH]:
+            assert os.path.exists(thumbnails.cache_path(media_url, width))
+        shutil.rmtree(thumbnails.cache_dir())
+
+
+def test_feed_icons(app, client):
+    import json
+
+    import gevent
+
+    from feedi import models
+    from feedi.models import db
+
+    _response, feed_id = create_feed(client, "icons.com", [{"title": "my-article", "date": "2023-10-01 00:00Z"}])
+
+    # the icon is discovered in the background after the first sync
+    with app.app_context():
+        for _ in range(50):
+            feed = db.session.get(models.Feed, feed_id)
+            if feed.icon_url:
+                break
+            db.session.commit()
+            gevent.sleep(0.1)
+        assert feed.icon_url == "http://icons.com/favicon.ico"
+        assert models.Favicon.lookup("http://www.icons.com/").icon_url == feed.icon_url
+
+    # feeds and entries from the same site get the cached icon without looking it up again
+    httpretty.latest_requests().clear()
+    feed_url = mock_feed("icons.com", [{"title": "other-article", "date": "2023-10-01 00:00Z"}])
+    response = client.post(
+        "/feeds/new", data={"type": "rss", "name": "icons 2", "url": feed_url}, follow_redirects=True
+    )
+    assert response.status_code == 200
+    assert not [request for request in httpretty.latest_requests() if request.path == "/favicon.ico"]
+
+    with app.app_context():
+        feed = db.session.scalar(db.select(models.Feed).filter_by(name="icons 2"))
+        assert feed.icon_url == "http://icons.com/favicon.ico"
+
+        entry = models.Entry.from_url(feed.user_id, "http://icons.com/page", html="<title>a page</title>")
+        assert entry.icon_url == "http://icons.com/favicon.ico"
+
+        # stale icons are discovered again on the next sync
+        db.session.execute(
+            db.update(models.Favicon).filter_by(domain="icons.com").values(updated=dt.datetime(2020, 1, 1))
+        )
+        db.session.commit()
+        assert feed.load_icon()
+
+        # rss feeds don't take the icon of the host that serves them before the sync tells their site
+        hosted = models.RssFeed(name="hosted", url="http://icons.com/hosted/feed")
+        assert hosted.load_icon()
+        assert hosted.icon_url is None
+
+        hosted.source = models.RssSource(raw_data=json.dumps({"link": "http://hosted.com"}))
+        assert hosted.load_icon()
+        assert hosted.icon_url is None
+
+
 def test_discover_feed(client):
     # TODO
     pass
@@ -344,8 +1052,25 @@ def test_feed_list(client):
 
 
 def test_feed_edit(client):
-    # TODO
-    pass
+    _response, feed_id = create_feed(client, "edit.com", [{"title": "my-article", "date": "2023-10-01 00:00Z"}])
+    values = {"name": "edit.com", "url": "http://edit.com/feed", "folder": "", "delete_after_days": ""}
+
+    # blank names and invalid retentions are rejected instead of failing on save
+    for invalid in [{"name": "  "}, {"delete_after_days": "soon"}, {"delete_after_days": "0"}]:
+        response = client.post(f"/feeds/{feed_id}", data={**values, **invalid})
+        assert response.status_code == 200
+        assert "is-danger" in response.text
+
+    response = client.post(f"/feeds/{feed_id}", data={**values, "name": " edited ", "delete_after_days": "5"})
+    assert response.status_code == 302
+    response = client.get(f"/feeds/{feed_id}")
+    assert 'value="edited"' in response.text
+    assert 'value="5"' in response.text
+
+    # a blank retention goes back to the default
+    response = client.post(f"/feeds/{feed_id}", data={**values, "name": "edited"})
+    assert response.status_code == 302
+    assert 'value="5"' not in client.get(f"/feeds/{feed_id}").text
 
 
 def test_feed_delete(client):
@@ -0,0 +1,127 @@
+import io
+import os
+import re
+import struct
+import sys
+import zipfile
+import zlib
+
+import httpretty
+import pytest
+from PIL import Image
+
+from feedi import scraping
+
+FAKE_EXTRACTOR = """
+import json, os, sys, time
+for line in sys.stdin:
+    html = json.loads(line)["html"]
+    if html == "hang":
+        time.sleep(60)
+    if html == "crash":
+        sys.exit(1)
+    memory = 2**30 if html == "bloat" else 2**20
+    print(json.dumps({"article": {"content": html, "pid": os.getpid()}, "memory": memory}), flush=True)
+"""
+
+
+def test_article_extractor_pool():
+    pool = scraping.ExtractorPool(1, timeout=1, max_memory_mb=100, command=[sys.executable, "-c", FAKE_EXTRACTOR])
+
+    article = pool.extract("http://example.com", b"<p>hello</p>")
+    assert article["content"] == "<p>hello</p>"
+    pid = article["pid"]
+    assert pool.extract("http://example.com", "<p>again</p>")["pid"] == pid, "the process should be reused"
+
+    for html in ["crash", "hang"]:
+        with pytest.raises(scraping.ExtractorCrashed):
+            pool.extract("http://example.com", html)
+        new_pid = pool.extract("http://example.com", "<p>hello</p>")["pid"]
+        assert new_pid != pid, "a new process should replace the failed one"
+        pid = new_pid
+
+    assert pool.extract("http://example.com", "bloat")["pid"] == pid
+    assert pool.extract("http://example.com", "<p>hello</p>")["pid"] != pid, (
+        "processes using too much memory are replaced"
+    )
+    pool.close()
+
+
+def test_extract_fast(app):
+    paragraph = "<p>" + "Lorem ipsum dolor sit amet, consectetur adipiscing elit. " * 4 + "</p>"
+    page = f"""<html><head><meta property="og:title" content="My title"><meta name="author" content="Jane"></head>
+    <body class="has-sidebar"><nav><a href="/">home</a></nav>
+    <article><h1>My title</h1>{paragraph * 5}<img src="/image.png"><div class="share"><a href="/x">share</a></div></article>
+    <div id="comments">{paragraph * 2}</div><footer><p>copyright</p></footer></body></html>"""
+
+    article, confidence = scraping.extract_fast("http://example.com/post", page)
+    assert confidence >= app.config["FAST_EXTRACT_MIN_CONFIDENCE"]
+    assert article["title"] == "My title"
+    assert article["byline"] == "Jane"
+    assert 'src="http://example.com/image.png"' in article["content"]
+    assert "share" not in article["content"]
+
+    # this doesn't need the node worker
+    assert scraping.extract(html=page)["title"] == "My title"
+
+    listing = "".join(f"<article><h2><a href='/{i}'>post {i}</a></h2>{paragraph}</article>" for i in range(5))
+    assert scraping.extract_fast("http://example.com", f"<html><body>{listing}</body></html>")[1] < 0.5
+
+    no_article = f"<html><body><div>{paragraph * 5}</div></body></html>"
+    assert scraping.extract_fast("http://example.com", no_article)[1] == 0
+
+
+def image_bytes(image, format):
+    output = io.BytesIO()
+    image.save(output, format)
+    return output.getvalue()
+
+
+def malformed_png():
+    "Return a png that pillow can open but fails to decode with a SyntaxError, from a chunk that follows its data."
+    data = image_bytes(Image.frombytes("L", (64, 64), bytes(range(256)) * 16), "PNG")
+    start = data.index(b"IDAT") - 4
+    (length,) = struct.unpack(">I", data[start : start + 4])
+    half = data[start + 8 : start + 8 + length // 2]
+    chunk = struct.pack(">I", len(half)) + b"IDAT" + half + struct.pack(">I", zlib.crc32(b"IDAT" + half))
+    return data[:start] + chunk + b"\x00\x00\x00\x10:\xe0U\x03"
+
+
+def test_package_epub(app, monkeypatch):
+    transparent = Image.new("RGBA", (3000, 2000), (255, 0, 0, 0))
+    noise = Image.frombytes("L", (400, 400), os.urandom(400 * 400))
+    images = {
+        "transparent.png": image_bytes(transparent, "PNG"),
+        "photo.jpg": image_bytes(Image.new("RGB", (100, 100), "blue"), "JPEG"),
+        "broken.png": b"not an image",
+        "malformed.png": malformed_png(),
+        "noise.png": image_bytes(noise, "PNG"),
+        "extra.jpg": image_bytes(Image.new("RGB", (100, 100), "blue"), "JPEG"),
+    }
+    for filename, data in images.items():
+        httpretty.register_uri(httpretty.GET, f"http://epub.com/{filename}", body=data, priority=1)
+
+    monkeypatch.setitem(scraping.settings, "EPUB_MAX_IMAGES", 5)
+    monkeypatch.setitem(scraping.settings, "EPUB_MAX_IMAGE_BYTES", 100 * 1024)
+    content = "".join(f'<p><img src="/{filename}"></p>' for filename in images)
+    article = {"title": "Images", "byline": "John", "siteName": None, "content": content}
+
+    httpretty.latest_requests().clear()
+    epub = scraping.package_epub("http://epub.com/article", article)
+    assert len(httpretty.latest_requests()) == 5, "images beyond the limit shouldn't be fetched"
+
+    # images that can't be fetched or decoded are left out
+    with zipfile.ZipFile(io.BytesIO(epub)) as files:
+        html = files.read("article.html").decode()
+        assert re.findall(r'src="([^"]+)"', html) == ["article_files/0.jpg", "article_files/1.jpg"]
+
+        image = Image.open(files.open("article_files/0.jpg"))
+        assert image.format == "JPEG"
+        assert image.mode == "L"
+        assert image.size == (1072, 715), "large images should be downscaled"
+        assert image.getpixel((0, 0)) > 250, "transparent backgrounds should turn white"
+
+    # packaging the same article again doesn't repeat the work
+    httpretty.latest_requests().clear()
+    assert scraping.package_epub("http://epub.com/article", article) == epub
+    assert not httpretty.latest_requests()